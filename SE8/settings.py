@@ -134,18 +134,67 @@ CELERY_MAX_TASKS_PER_CHILD = 3
 CELERY_CACHE_BACKEND = "default"
 CELERY_BROKER_URL = REDIS_URI
 
+# Discovery and downloads are I/O bound and run on thread pools, rendering is CPU
+# bound and runs on prefork, each queue is served by its own workers so that one
+# workload can not starve the other (see config/ecosystem.config.js)
+CELERY_TASK_DEFAULT_QUEUE = "default"
+CELERY_TASK_ROUTES = {
+    "apps.tasks.find_books": {"queue": "discovery"},
+    "apps.tasks.find_episodes": {"queue": "discovery"},
+    "apps.tasks.find_images": {"queue": "discovery"},
+    "apps.tasks.resume_frontier": {"queue": "discovery"},
+    "apps.tasks.download_image": {"queue": "download"},
+    "apps.tasks.download_images": {"queue": "download"},
+    "apps.tasks.download_covers": {"queue": "download"},
+    "apps.tasks.convert_to_pdf": {"queue": "render"},
+}
+# Redis consumes lower priority steps first: reader-triggered work uses 0, the
+# pipeline 3 and background sweeps 9 (apps/priority.py), prefetching defeats them
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    "priority_steps": [0, 3, 6, 9],
+    "queue_order_strategy": "priority",
+    "sep": ":",
+}
+CELERY_TASK_DEFAULT_PRIORITY = 3
+# Hard limits are only enforced by prefork pools, I/O tasks also time out their requests
+CELERY_TASK_ANNOTATIONS = {
+    "apps.tasks.find_books": {"soft_time_limit": 6 * 60 * 60},
+    "apps.tasks.find_episodes": {"soft_time_limit": 5 * 60},
+    "apps.tasks.find_images": {"soft_time_limit": 30 * 60},
+    "apps.tasks.download_image": {"soft_time_limit": 5 * 60},
+    "apps.tasks.download_images": {"soft_time_limit": 30 * 60},
+    "apps.tasks.download_covers": {"soft_time_limit": 30 * 60},
+    "apps.tasks.convert_to_pdf": {"soft_time_limit": 10 * 60, "time_limit": 11 * 60},
+}
+
+# Finished pipeline stages queue the next one themselves, the fix_* sweeps only
+# catch up with work whose task was lost
 CELERY_BEAT_SCHEDULE = {
     "auto_fetch_books": {
         "task": "apps.tasks.find_books",
-        "schedule": crontab(hour=0),
+        "schedule": crontab(minute=0, hour=0, day_of_week="1-6"),
+    },
+    # Away from the incremental crawl, which would otherwise reset its checkpoint
+    "auto_reconcile_books": {
+        "task": "apps.tasks.find_books",
+        "schedule": crontab(minute=0, hour=3, day_of_week=0),
+        "kwargs": {"mode": "full"},
     },
     "auto_fix_images": {
         "task": "apps.tasks.fix_images",
-        "schedule": crontab(hour=1),
+        "schedule": crontab(minute=0, hour=1),
     },
     "auto_fix_pdf": {
         "task": "apps.tasks.fix_pdf",
-        "schedule": crontab(hour=2),
+        "schedule": crontab(minute=15),
+    },
+    "auto_evict_thumbnails": {
+        "task": "apps.tasks.evict_thumbnails",
+        "schedule": crontab(minute=30),
+    },
+    "auto_resume_frontier": {
+        "task": "apps.tasks.resume_frontier",
+        "schedule": crontab(minute="*/10"),
     },
 }
 
@@ -206,6 +255,28 @@ if use_sqlite := env_bool("USE_SQLITE", False):
 
     CELERY_BROKER_URL = REDIS_URI
 
+# Validators of crawled listing and book pages
+# Redis expires them on its own, the file backend would list its whole directory to
+# cull on every write
+CRAWLER_PAGE_CACHE = {
+    "alias": "pages",
+    "timeout": int(getenv("CRAWLER_PAGE_CACHE_TTL", str(7 * 24 * 60 * 60))),
+}
+if use_sqlite:
+    # Table made by createcachetable, culled past MAX_ENTRIES with one COUNT per write
+    CACHES["pages"] = {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "page_cache",
+        "TIMEOUT": CRAWLER_PAGE_CACHE["timeout"],
+        "OPTIONS": {"MAX_ENTRIES": int(getenv("CRAWLER_PAGE_CACHE_ENTRIES", "100000"))},
+    }
+else:
+    CACHES["pages"] = {
+        **CACHES["default"],
+        "KEY_PREFIX": "pages",
+        "TIMEOUT": CRAWLER_PAGE_CACHE["timeout"],
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -233,6 +304,104 @@ AUTH_PASSWORD_VALIDATORS = [
 STATIC_URL = "/static/"
 MEDIA_URL = "/media/"
 
+# Site crawled for books, point it at `manage.py serve_replay` for load tests
+CRAWLER_ORIGIN = getenv("CRAWLER_ORIGIN", "https://se8.us")
+
+# Fixed User-Agent of the crawler, a random desktop Chrome one when empty
+CRAWLER_USER_AGENT = getenv("CRAWLER_USER_AGENT", "")
+
+# HTTP client of the crawler, FALLBACK is tried when the pooled client is rejected
+CRAWLER_HTTP = {
+    "BACKEND": "apps.transport.AiohttpTransport",
+    "OPTIONS": {
+        "limit": int(getenv("CRAWLER_HTTP_LIMIT", "64")),
+        "limit_per_host": int(getenv("CRAWLER_HTTP_LIMIT_PER_HOST", "8")),
+        "dns_cache_ttl": 300,
+        "keepalive_timeout": 30,
+        "connect_timeout": 10,
+        "read_timeout": int(getenv("CRAWLER_HTTP_TIMEOUT", "60")),
+    },
+    "FALLBACK": {
+        "BACKEND": "apps.transport.CurlTransport",
+        "OPTIONS": {"timeout": int(getenv("CRAWLER_HTTP_TIMEOUT", "60"))},
+    },
+}
+
+# Listing pages fetched at once, and the (requests per second, burst) page budget
+CRAWLER_PAGE_CONCURRENCY = int(getenv("CRAWLER_PAGE_CONCURRENCY", "8"))
+CRAWLER_RATE_LIMIT = (
+    float(getenv("CRAWLER_RATE_LIMIT", "10")),
+    float(getenv("CRAWLER_RATE_BURST", "10")),
+)
+
+# Image downloads in flight per task, their retry policy and size limit
+CRAWLER_DOWNLOAD = {
+    "concurrency": int(getenv("CRAWLER_DOWNLOAD_CONCURRENCY", "16")),
+    "retries": int(getenv("CRAWLER_DOWNLOAD_RETRIES", "3")),
+    "backoff": 0.5,
+    "max_backoff": 30,
+    "timeout": int(getenv("CRAWLER_DOWNLOAD_TIMEOUT", "120")),
+    "max_bytes": int(getenv("CRAWLER_DOWNLOAD_MAX_MB", "20")) * 1024 * 1024,
+    "chunk_size": 64 * 1024,
+}
+
+# Consecutive listing pages without changed books that end an incremental crawl
+CRAWLER_INCREMENTAL_STOP_PAGES = int(getenv("CRAWLER_INCREMENTAL_STOP_PAGES", "3"))
+
+# Background sweeps stream ids page_size at a time and queue jobs of batch_size items
+CRAWLER_SWEEP = {
+    "batch_size": int(getenv("CRAWLER_SWEEP_BATCH_SIZE", "100")),
+    "page_size": 1000,
+    # Seconds an episode stays complete before fix_pdf queues its PDF once more
+    "grace": int(getenv("CRAWLER_SWEEP_GRACE", str(60 * 60))),
+}
+
+# Tries an episode gets at each pipeline stage before it is marked failed
+CRAWLER_PIPELINE_MAX_ATTEMPTS = int(getenv("CRAWLER_PIPELINE_MAX_ATTEMPTS", "3"))
+
+# Reader-triggered work: how long it holds background sweeps back and the longest
+# a sweep pauses for it
+CRAWLER_PRIORITY = {
+    "hold": 60,
+    "poll": 1,
+    "max_pause": 5 * 60,
+}
+
+# Persistent crawl frontier: how long a worker owns a book or episode before another
+# may take it over, how many attempts an entry gets before it is left alone, and how
+# long finished entries are kept to turn away queued copies of their task
+CRAWLER_FRONTIER = {
+    "lease": int(getenv("CRAWLER_FRONTIER_LEASE", str(30 * 60))),
+    "max_attempts": int(getenv("CRAWLER_FRONTIER_MAX_ATTEMPTS", "5")),
+    "retention": int(getenv("CRAWLER_FRONTIER_RETENTION", str(24 * 60 * 60))),
+}
+
+# Raw image bytes, content-addressed by SHA-256
+BLOB_STORE = {
+    "BACKEND": "apps.storage.FileSystemBlobStore",
+    "OPTIONS": {"location": MEDIA_ROOT / "blobs"},
+}
+
+# Admin previews rendered from BLOB_STORE, evicted least recently used first
+THUMBNAILS = {
+    "location": MEDIA_ROOT / "thumbs",
+    "size": int(getenv("THUMBNAIL_SIZE", "200")),
+    "format": getenv("THUMBNAIL_FORMAT", "WEBP"),
+    "quality": 75,
+    "max_bytes": int(getenv("THUMBNAIL_CACHE_MB", "512")) * 1024 * 1024,
+}
+
+# Episode PDFs: "passthrough" embeds every JPEG as is on a page of its own height,
+# "stitch" cuts the stacked images into A4 pages and encodes them again.
+# Rendering runs on a thread pool kept by each process, 0 workers shares the CPUs
+# between the pool processes of a prefork worker.
+# Stitched pages are drawn at `dpi`, 72 makes them 595 pixels wide
+PDF_RENDER = {
+    "mode": getenv("PDF_RENDER_MODE", "passthrough"),
+    "workers": int(getenv("PDF_WORKERS", "0")),
+    "dpi": int(getenv("PDF_DPI", "72")),
+}
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
@@ -1,24 +1,39 @@
 from django.contrib import admin
 from django.utils.html import format_html
 
-from apps.models import Book, Episode, Image, Tag
+from apps.models import Book, CrawlState, Episode, FrontierEntry, Image, Tag
 from apps.tasks import convert_to_pdf, download_images, find_episodes, find_images
 
 
+def thumbnail_html(obj):
+    """Reference the cached thumbnail instead of inlining the original image"""
+    if not obj.has_image:
+        return "-"
+    return format_html('<img src="{}" width="100" loading="lazy"/>', obj.thumbnail_url)
+
+
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     list_display = ("name", "get_book_count")
 
     def get_book_count(self, obj):
         """Get the number of books associated with this tag"""
-        return obj.books.count()
+        return obj.book_count
 
     get_book_count.short_description = "Number of Books"
+    get_book_count.admin_order_field = "book_count"
 
 
 @admin.register(Book)
 class BookAdmin(admin.ModelAdmin):
-    list_display = ("id", "title", "get_episode_count", "hot", "view_episodes")
+    list_display = (
+        "id",
+        "get_cover_display",
+        "title",
+        "get_episode_count",
+        "hot",
+        "view_episodes",
+    )
     search_fields = ("title", "id")
     list_filter = ("tags",)
     readonly_fields = (
@@ -26,7 +41,9 @@ class BookAdmin(admin.ModelAdmin):
         "id",
         "raw_url",
         "image_url",
-        "image",
+        "image_hash",
+        "image_size",
+        "image_mime",
         "description",
         "hot",
         "tags",
@@ -35,9 +52,16 @@ class BookAdmin(admin.ModelAdmin):
 
     def get_episode_count(self, obj):
         """Get the number of episodes for this book"""
-        return obj.episodes.count()
+        return obj.episode_count
 
     get_episode_count.short_description = "Number of Episodes"
+    get_episode_count.admin_order_field = "episode_count"
+
+    def get_cover_display(self, obj):
+        """Display the cover thumbnail in the admin panel"""
+        return thumbnail_html(obj)
+
+    get_cover_display.short_description = "Cover"
 
     def view_episodes(self, obj):
         """Generate a link to view episodes of this book"""
@@ -51,7 +75,7 @@ class BookAdmin(admin.ModelAdmin):
     def start_crawling(self, request, queryset):
         """Start crawling episodes for selected books"""
         for book in queryset:
-            find_episodes.apply_async(args=[book.id])
+            find_episodes.apply_async(args=[book.id], kwargs={"force": True})
 
     start_crawling.short_description = "Start Crawling"
 
@@ -66,16 +90,26 @@ class EpisodeAdmin(admin.ModelAdmin):
         "view_images",
         "all_images",
         "has_pdf",
+        "status",
         "read_episode",
     )
     search_fields = ("title", "book__title")
-    list_filter = ("book__tags", "book__title")
-    readonly_fields = ("book", "title", "id", "raw_url")
+    list_filter = ("status", "book__tags", "book__title")
+    list_select_related = ("book",)
+    readonly_fields = (
+        "book",
+        "title",
+        "id",
+        "raw_url",
+        "status",
+        "status_changed_at",
+        "attempts",
+    )
     actions = ["get_images", "convert_to_pdf", "convert_to_pdf_force", "refresh_images"]
 
     def get_image_count(self, obj):
         """Get the count of images for this episode"""
-        return f'{obj.images.exclude(image="").count()}/{obj.images.count()}'
+        return f"{obj.downloaded_image_count}/{obj.image_count}"
 
     get_image_count.short_description = "Number of Images"
 
@@ -89,7 +123,7 @@ class EpisodeAdmin(admin.ModelAdmin):
 
     def all_images(self, obj):
         """Check if all images for this episode are present"""
-        return not obj.images.filter(image="").exists()
+        return obj.downloaded_image_count >= obj.image_count
 
     all_images.short_description = "All Images"
     all_images.boolean = True
@@ -144,17 +178,20 @@ class ImageAdmin(admin.ModelAdmin):
     list_display = ("id", "episode", "index", "get_image_display")
     search_fields = ("episode__title", "id")
     list_filter = ("episode__book",)
-    readonly_fields = ("episode", "index", "id", "raw_url", "image")
+    readonly_fields = (
+        "episode",
+        "index",
+        "id",
+        "raw_url",
+        "image_hash",
+        "image_size",
+        "image_mime",
+    )
     actions = ["get_images"]
 
     def get_image_display(self, obj):
         """Display the image in the admin panel"""
-        try:
-            return format_html(
-                f'<img src="data:image/jpeg;base64,{obj.image}" width="100" height="100"/>',
-            )
-        except Exception as e:
-            return str(e)
+        return thumbnail_html(obj)
 
     get_image_display.short_description = "Image"
 
@@ -169,7 +206,7 @@ class ImageAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         """Optimize queryset by selecting related episode"""
         queryset = super().get_queryset(request)
-        queryset = queryset.select_related("episode")
+        queryset = queryset.select_related("episode__book")
         return queryset
 
     def get_images(self, request, queryset):
@@ -179,3 +216,24 @@ class ImageAdmin(admin.ModelAdmin):
         )
 
     get_images.short_description = "Download Images (Force)"
+
+
+@admin.register(CrawlState)
+class CrawlStateAdmin(admin.ModelAdmin):
+    list_display = (
+        "name",
+        "mode",
+        "last_page",
+        "changed_books",
+        "started_at",
+        "finished_at",
+    )
+    readonly_fields = list_display
+
+
+@admin.register(FrontierEntry)
+class FrontierEntryAdmin(admin.ModelAdmin):
+    list_display = ("kind", "key", "status", "attempts", "leased_until", "updated_at")
+    list_filter = ("kind", "status")
+    search_fields = ("key", "url")
+    readonly_fields = list_display + ("url",)
@@ -0,0 +1,56 @@
+import atexit
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+
+from django.conf import settings
+
+logger = getLogger(__name__)
+
+# Rendering pool of this process, created on first use and kept until shutdown
+# Threads rather than processes: Pillow and zlib release the GIL while they decode,
+# resize and compress, and a prefork render worker, whose pool processes are daemonic,
+# may not start processes of its own
+_executor = None
+_owner = os.getpid()
+_lock = threading.Lock()
+# Pool processes of a prefork worker rendering side by side, see share_cpus
+_processes = 1
+
+
+def share_cpus(processes: int) -> None:
+    """Split the CPUs between the `processes` pool processes of a prefork worker"""
+    global _processes
+    _processes = max(1, processes)
+
+
+def pool_size() -> int:
+    """PDF_RENDER["workers"], or this process's share of the CPUs"""
+    return settings.PDF_RENDER["workers"] or max(1, (os.cpu_count() or 1) // _processes)
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """The shared thread pool of this process"""
+    global _executor, _owner
+    with _lock:
+        if _owner != os.getpid():
+            # Forked: the threads of the parent pool do not exist in this process
+            _executor, _owner = None, os.getpid()
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=pool_size())
+            logger.debug(f"Started {pool_size()} render threads")
+        return _executor
+
+
+def shutdown_executors(wait: bool = True) -> None:
+    """Let the running work finish and stop the pool of this process"""
+    global _executor
+    with _lock:
+        executor = _executor if _owner == os.getpid() else None
+        _executor = None
+    if executor:
+        executor.shutdown(wait=wait, cancel_futures=True)
+
+
+atexit.register(shutdown_executors)
@@ -0,0 +1,125 @@
+from typing import List
+
+from lxml import etree
+from lxml import html as lxml_html
+
+PARSER = lxml_html.HTMLParser(encoding="utf-8", remove_comments=True)
+
+# Selectors are compiled once, per-item ones are relative to their item so that
+# a page costs one walk of the document however many entries it lists
+
+# Listing page
+LISTING_ITEMS = etree.XPath("//div[@class='common-comic-item']")
+LISTING_URL = etree.XPath(".//a[@class='cover']/@href")
+LISTING_TITLE = etree.XPath(".//p[@class='comic__title']")
+LISTING_IMAGE = etree.XPath(".//img/@data-original")
+LISTING_CURRENT = etree.XPath(".//p[@class='comic-update']/a/text()")
+LAST_PAGE = etree.XPath("//a[@class='end']/@href")
+
+# Book page
+CHAPTER_ITEMS = etree.XPath("//ul[@class='chapter__list-box clearfix']//li")
+CHAPTER_URL = etree.XPath(".//a/@href")
+BOOK_STATUS = etree.XPath("//div[@class='comic-status']")
+BOOK_TAGS = etree.XPath(".//a/text()")
+BOOK_HOT = etree.XPath("./span[3]/b/text()")
+BOOK_INTRO = etree.XPath("//div[@class='comic-intro']//p")
+
+# Chapter page
+PAGE_ITEMS = etree.XPath("//div[@class='rd-article__pic hide']")
+PAGE_ID = etree.XPath("descendant-or-self::*/@data-pid")
+PAGE_INDEX = etree.XPath("descendant-or-self::*/@data-index")
+PAGE_IMAGE = etree.XPath(".//img/@data-original")
+
+
+def parse_document(content: bytes | str) -> etree._Element:
+    """Parse a page, an empty body gives an empty document"""
+    if not content or not content.strip():
+        return lxml_html.Element("html")
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return lxml_html.document_fromstring(content, parser=PARSER)
+
+
+def first(values: list, default: str = "") -> str:
+    return str(values[0]).strip() if values else default
+
+
+def text_of(element) -> str:
+    return element.text_content().strip() if element is not None else ""
+
+
+def last_segment(url: str) -> str:
+    return url.rstrip("/").split("/")[-1]
+
+
+def parse_max_page(doc) -> int | None:
+    """Number of the last listing page, from the pagination links"""
+    try:
+        return int(last_segment(first(LAST_PAGE(doc))))
+    except ValueError:
+        return None
+
+
+def parse_listing(doc) -> List[dict]:
+    """Books of a listing page"""
+    books = []
+    for item in LISTING_ITEMS(doc):
+        if not (url := first(LISTING_URL(item))):
+            continue
+        titles = LISTING_TITLE(item)
+        books.append(
+            {
+                "raw_url": url,
+                "id": last_segment(url),
+                "title": text_of(titles[0] if titles else None),
+                "image_url": first(LISTING_IMAGE(item)),
+                "current": first(LISTING_CURRENT(item)),
+            }
+        )
+    return books
+
+
+def parse_book_details(doc) -> dict:
+    """Tags, popularity and description of a book page"""
+    status = BOOK_STATUS(doc)
+    status = status[0] if status else None
+    try:
+        hot = float(first(BOOK_HOT(status)).split()[0]) if status is not None else 0
+    except (IndexError, ValueError):
+        hot = 0
+    intro = BOOK_INTRO(doc)
+    return {
+        "tags": (
+            [tag.strip() for tag in BOOK_TAGS(status)] if status is not None else []
+        ),
+        "hot": hot,
+        "description": text_of(intro[2] if len(intro) > 2 else None),
+    }
+
+
+def parse_chapters(doc) -> List[dict]:
+    """Chapter list of a book page"""
+    chapters = []
+    for item in CHAPTER_ITEMS(doc):
+        if not (url := first(CHAPTER_URL(item))):
+            continue
+        chapters.append(
+            {"raw_url": url, "id": last_segment(url), "title": text_of(item)}
+        )
+    return chapters
+
+
+def parse_pages(doc) -> List[dict]:
+    """Images of a chapter page"""
+    pages = []
+    for item in PAGE_ITEMS(doc):
+        if not (pid := first(PAGE_ID(item))):
+            continue
+        pages.append(
+            {
+                "id": pid,
+                "index": first(PAGE_INDEX(item)),
+                "raw_url": first(PAGE_IMAGE(item)),
+            }
+        )
+    return pages
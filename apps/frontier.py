@@ -0,0 +1,144 @@
+from contextlib import contextmanager
+from datetime import timedelta
+from logging import getLogger
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from apps.models import FrontierEntry
+
+logger = getLogger(__name__)
+
+
+def lease_duration() -> timedelta:
+    return timedelta(seconds=settings.CRAWLER_FRONTIER["lease"])
+
+
+def enqueue(kind: str, items: list) -> None:
+    """Record [key, url] items as waiting to be crawled, reopening finished ones"""
+    if not items:
+        return
+    keys = [str(key) for key, _ in items]
+    with transaction.atomic():
+        FrontierEntry.objects.bulk_create(
+            [FrontierEntry(kind=kind, key=str(key), url=url) for key, url in items],
+            ignore_conflicts=True,
+        )
+        FrontierEntry.objects.filter(
+            kind=kind, key__in=keys, status=FrontierEntry.STATUS_DONE
+        ).update(
+            status=FrontierEntry.STATUS_PENDING, attempts=0, updated_at=timezone.now()
+        )
+
+
+def acquire(kind: str, key: str, reopen: bool = True) -> bool:
+    """
+    Lease an entry to the calling worker
+    Fails while another worker holds an unexpired lease on it, and on finished entries
+    unless `reopen`, so that copies of a task dispatched again do not redo its work
+    """
+    now = timezone.now()
+    FrontierEntry.objects.get_or_create(kind=kind, key=str(key))
+    queryset = FrontierEntry.objects.filter(kind=kind, key=str(key)).exclude(
+        status=FrontierEntry.STATUS_LEASED, leased_until__gt=now
+    )
+    if not reopen:
+        queryset = queryset.exclude(status=FrontierEntry.STATUS_DONE)
+    return bool(
+        queryset.update(
+            status=FrontierEntry.STATUS_LEASED,
+            leased_until=now + lease_duration(),
+            updated_at=now,
+        )
+    )
+
+
+def finish(kind: str, key: str, done: bool = True) -> None:
+    """Give a lease back, the entry is pending again unless its work is `done`"""
+    FrontierEntry.objects.filter(kind=kind, key=str(key)).update(
+        status=FrontierEntry.STATUS_DONE if done else FrontierEntry.STATUS_PENDING,
+        leased_until=None,
+        updated_at=timezone.now(),
+    )
+
+
+@contextmanager
+def lease(kind: str, key: str, reopen: bool = True):
+    """Hold the lease of an entry for the duration of the block, yields whether it was granted"""
+    if not acquire(kind, key, reopen):
+        logger.info(f"Skip {kind} {key}: leased by another worker or done")
+        yield False
+        return
+    try:
+        yield True
+    except BaseException:
+        finish(kind, key, done=False)
+        raise
+    finish(kind, key)
+
+
+def stale_entries(kind: str = None):
+    """
+    Entries whose work was lost: leases that expired, and pending entries that
+    were dispatched more than one lease ago and never picked up
+    Entries dispatched again max_attempts times are left alone, see `dispatched`
+    """
+    cutoff = timezone.now() - lease_duration()
+    queryset = FrontierEntry.objects.exclude(kind=FrontierEntry.KIND_LISTING).filter(
+        Q(status=FrontierEntry.STATUS_LEASED, leased_until__lt=timezone.now())
+        | Q(status=FrontierEntry.STATUS_PENDING, updated_at__lt=cutoff),
+        attempts__lt=settings.CRAWLER_FRONTIER["max_attempts"],
+    )
+    if kind:
+        queryset = queryset.filter(kind=kind)
+    return queryset.order_by("updated_at")
+
+
+def dispatched(entries) -> None:
+    """
+    Count a new dispatch of the entries and restart their staleness clock
+    A task still waiting in the queue never leases its entry, so attempts are
+    counted here rather than when a worker starts on it
+    """
+    FrontierEntry.objects.filter(pk__in=[entry.pk for entry in entries]).update(
+        attempts=F("attempts") + 1, updated_at=timezone.now()
+    )
+
+
+def prune() -> int:
+    """Forget books and episodes finished longer than the retention ago"""
+    cutoff = timezone.now() - timedelta(seconds=settings.CRAWLER_FRONTIER["retention"])
+    deleted, _ = (
+        FrontierEntry.objects.exclude(kind=FrontierEntry.KIND_LISTING)
+        .filter(status=FrontierEntry.STATUS_DONE, updated_at__lt=cutoff)
+        .delete()
+    )
+    return deleted
+
+
+def checkpoint_page(page: int) -> None:
+    """Record a listing page as crawled"""
+    FrontierEntry.objects.update_or_create(
+        kind=FrontierEntry.KIND_LISTING,
+        key=str(page),
+        defaults={"status": FrontierEntry.STATUS_DONE},
+    )
+
+
+def resume_page() -> int:
+    """First listing page after the crawled ones, pages are crawled in order"""
+    pages = FrontierEntry.objects.filter(
+        kind=FrontierEntry.KIND_LISTING, status=FrontierEntry.STATUS_DONE
+    ).values_list("key", flat=True)
+    return max(map(int, pages), default=0) + 1
+
+
+def reset(kind: str = None) -> int:
+    """Forget the frontier, or the part of it of one kind"""
+    queryset = FrontierEntry.objects.all()
+    if kind:
+        queryset = queryset.filter(kind=kind)
+    deleted, _ = queryset.delete()
+    return deleted
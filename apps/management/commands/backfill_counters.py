@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandParser
+
+from apps.models import Book, Episode, Tag
+from apps.persistence import (
+    refresh_book_counters,
+    refresh_episode_counters,
+    refresh_tag_counters,
+)
+
+
+class Command(BaseCommand):
+    help = "recompute the denormalized book, episode and tag counters"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def backfill(self, model, refresh, batch_size: int):
+        last_pk, total = None, 0
+        while True:
+            queryset = model.objects.order_by("pk")
+            if last_pk is not None:
+                queryset = queryset.filter(pk__gt=last_pk)
+            if not (pks := list(queryset.values_list("pk", flat=True)[:batch_size])):
+                break
+            refresh(pks)
+            last_pk, total = pks[-1], total + len(pks)
+        self.stdout.write(f"Refreshed {total} {model.__name__} counters")
+
+    def handle(self, *args, **options) -> None:
+        for model, refresh in [
+            (Book, refresh_book_counters),
+            (Episode, refresh_episode_counters),
+            (Tag, refresh_tag_counters),
+        ]:
+            self.backfill(model, refresh, options["batch_size"])
@@ -0,0 +1,59 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from apps.extractors import (
+    parse_book_details,
+    parse_chapters,
+    parse_document,
+    parse_listing,
+    parse_pages,
+)
+
+CORPUS_DIR = Path(__file__).resolve().parents[2] / "testdata" / "pages"
+
+# Saved pages are matched to their parsers by file name
+PAGE_PARSERS = {
+    "listing": [parse_listing],
+    "empty_listing": [parse_listing],
+    "book": [parse_book_details, parse_chapters],
+    "chapter": [parse_pages],
+}
+
+
+class Command(BaseCommand):
+    help = "measure the parse throughput of the saved page corpus"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--iterations", type=int, default=500)
+        parser.add_argument("--corpus", type=Path, default=CORPUS_DIR)
+
+    def handle(self, *args, **options) -> None:
+        iterations = options["iterations"]
+        total_pages, total_seconds = 0, 0.0
+        for path in sorted(options["corpus"].glob("*.html")):
+            parsers = PAGE_PARSERS.get(path.stem)
+            if not parsers:
+                self.stderr.write(f"Skip {path.name}: no parser for this page kind")
+                continue
+            content = path.read_bytes()
+
+            started = time.perf_counter()
+            for _ in range(iterations):
+                doc = parse_document(content)
+                for parse in parsers:
+                    parse(doc)
+            elapsed = time.perf_counter() - started
+
+            total_pages += iterations
+            total_seconds += elapsed
+            self.stdout.write(
+                f"{path.name:<24} {iterations / elapsed:>10.0f} pages/s "
+                f"{elapsed * 1000 / iterations:>8.3f} ms/page"
+            )
+        if total_pages:
+            self.stdout.write(
+                f"{'total':<24} {total_pages / total_seconds:>10.0f} pages/s "
+                f"{total_seconds * 1000 / total_pages:>8.3f} ms/page"
+            )
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import random
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.test import override_settings
+from PIL import Image, ImageDraw
+
+from apps.executors import shutdown_executors
+from apps.models import Episode
+from apps.pdf import assemble_pdf, render_pages
+from apps.storage import get_blob_store
+
+
+def synthetic_chapter(count: int, width: int, height: int, seed: int = 0) -> list:
+    """JPEG pages of flat shapes and lines, closer to drawn art than noise is"""
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        img = Image.new("RGB", (width, height), "white")
+        draw = ImageDraw.Draw(img)
+        for _ in range(40):
+            x, y = rng.randrange(width), rng.randrange(height)
+            box = [x, y, x + rng.randrange(20, width // 2), y + rng.randrange(20, 400)]
+            color = tuple(rng.randrange(256) for _ in range(3))
+            shape = rng.choice([draw.rectangle, draw.ellipse])
+            shape(box, fill=color, outline="black", width=3)
+        for _ in range(60):
+            points = [(rng.randrange(width), rng.randrange(height)) for _ in range(2)]
+            draw.line(points, fill="black", width=rng.randrange(1, 5))
+        buffer = BytesIO()
+        img.save(buffer, format="JPEG", quality=85)
+        images.append(buffer.getvalue())
+    return images
+
+
+class Command(BaseCommand):
+    help = "measure stitched PDF rendering by pool size, resolution and draft decoding"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--episode", type=int, help="render a stored episode")
+        parser.add_argument("--images", type=int, default=40)
+        parser.add_argument("--width", type=int, default=800)
+        parser.add_argument("--height", type=int, default=1600)
+        parser.add_argument(
+            "--workers",
+            default=f"1,{os.cpu_count() or 1}",
+            help="comma separated pool sizes to compare",
+        )
+        parser.add_argument(
+            "--dpi",
+            default=str(settings.PDF_RENDER["dpi"]),
+            help="comma separated resolutions to compare",
+        )
+        parser.add_argument(
+            "--draft",
+            choices=["on", "off", "both"],
+            default="both",
+            help="let the JPEG decoder scale sources down, or decode them in full",
+        )
+
+    def handle(self, *args, **options) -> None:
+        if options["episode"]:
+            digests = list(
+                Episode.objects.get(pk=options["episode"])
+                .images.order_by("index")
+                .values_list("image_hash", flat=True)
+            )
+            if not digests or not all(digests):
+                raise CommandError(f"Episode {options['episode']} has missing images")
+            store = get_blob_store()
+            images = [store.read(digest) for digest in digests]
+        else:
+            images = synthetic_chapter(
+                options["images"], options["width"], options["height"]
+            )
+        self.stdout.write(f"{len(images)} images, {sum(map(len, images)) / 1e6:.1f} MB")
+
+        drafts = {"on": [True], "off": [False], "both": [False, True]}[options["draft"]]
+        baseline = None
+        for draft in drafts:
+            for dpi in sorted({int(n) for n in options["dpi"].split(",")}):
+                for workers in sorted({int(n) for n in options["workers"].split(",")}):
+                    with override_settings(
+                        PDF_RENDER={**settings.PDF_RENDER, "workers": workers}
+                    ):
+                        # Pools live as long as the worker, their startup is not part of a render
+                        asyncio.run(render_pages(images[:1]))
+                        started = time.perf_counter()
+                        pages = asyncio.run(render_pages(images, dpi, draft))
+                        rendered = time.perf_counter()
+                        pdf = assemble_pdf(pages)
+                        finished = time.perf_counter()
+                        shutdown_executors()
+
+                    pages = [page for page in pages if page]
+                    timings = sorted(page.seconds for page in pages)
+                    total = finished - started
+                    baseline = baseline or total
+                    self.stdout.write(
+                        f"draft {'on ' if draft else 'off'} {dpi:>4} dpi {workers:>3} workers "
+                        f"{total:>7.2f}s {baseline / total:>5.1f}x "
+                        f"| {len(pages)} pages, {len(pdf.getvalue()) / 1e6:.1f} MB "
+                        f"| render {rendered - started:.2f}s, assemble {finished - rendered:.2f}s "
+                        f"| CPU {sum(page.cpu for page in pages):.2f}s, "
+                        f"decoded {sum(page.decoded for page in pages) / 1e6:.0f} MB, "
+                        f"page peak {max(page.held for page in pages) / 1e6:.0f} MB "
+                        f"| per page median {timings[len(timings) // 2] * 1000:.0f} ms, "
+                        f"p95 {timings[int(len(timings) * 0.95)] * 1000:.0f} ms, "
+                        f"max {timings[-1] * 1000:.0f} ms"
+                    )
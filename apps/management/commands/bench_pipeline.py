@@ -0,0 +1,58 @@
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import connection
+from django.test import override_settings
+
+from apps.management.commands.serve_replay import add_site_arguments, build_site
+from apps.replay import peak_memory_mb, run_pipeline, serve
+
+
+class Command(BaseCommand):
+    help = "measure the crawl pipeline end to end against a local replay site"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        add_site_arguments(parser)
+        parser.add_argument(
+            "--rate-limit", type=float, default=0, help="pages/s, 0 for unlimited"
+        )
+
+    def handle(self, *args, **options) -> None:
+        # Work on a throwaway database and storage so the benchmark leaves no trace
+        # The database is the test database of the default connection, created and
+        # dropped like `manage.py test` does: never run this with production settings
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir, override_settings(
+                MEDIA_ROOT=tmp_dir,
+                BLOB_STORE={
+                    "BACKEND": "apps.storage.FileSystemBlobStore",
+                    "OPTIONS": {"location": f"{tmp_dir}/blobs"},
+                },
+                THUMBNAILS={**settings.THUMBNAILS, "location": f"{tmp_dir}/thumbs"},
+                CACHES={
+                    **settings.CACHES,
+                    "pages": {
+                        "BACKEND": "django.core.cache.backends.locmem.LocMemCache"
+                    },
+                },
+            ), serve(build_site(options)) as site:
+                started = time.perf_counter()
+                stages = run_pipeline(site.origin, rate_limit=options["rate_limit"])
+                elapsed = time.perf_counter() - started
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for stage in stages:
+            self.stdout.write(str(stage))
+        # Chapter pages are timed together with their image downloads
+        crawl = sum(stage.seconds for stage in stages if stage.unit == "pages")
+        pages = sum(site.served.get(kind, 0) for kind in ["listing", "book", "chapter"])
+        self.stdout.write(
+            f"{'crawl':<10} {pages:>7} pages {crawl:>9.2f}s {pages / crawl:>9.1f} pages/s"
+        )
+        self.stdout.write(f"{'total':<10} {elapsed:>24.2f}s")
+        self.stdout.write(f"Peak memory: {peak_memory_mb():.0f} MiB")
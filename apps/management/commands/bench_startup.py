@@ -0,0 +1,75 @@
+import os
+import re
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+# What a gunicorn worker and a celery worker import before serving anything
+ENTRY_POINTS = {
+    "web": "import django; django.setup(); import SE8.urls",
+    "worker": (
+        "import django; django.setup(); from SE8 import celery_app; "
+        "celery_app.loader.import_default_modules()"
+    ),
+}
+# Only loaded by the tasks that need them, see apps.tools and apps.transport
+LAZY_MODULES = ["aiohttp", "fake_useragent", "reportlab"]
+BUDGET_MS = 1500
+
+IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure_imports(code: str) -> dict:
+    """Run `code` in a fresh interpreter, map each imported module to its own import time in µs"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        env={"DJANGO_SETTINGS_MODULE": "SE8.settings", **os.environ},
+    )
+    if result.returncode:
+        raise CommandError(result.stderr.strip().splitlines()[-1])
+    return {
+        match[4]: int(match[1])
+        for match in map(IMPORT_TIME.match, result.stderr.splitlines())
+        if match
+    }
+
+
+class Command(BaseCommand):
+    help = "measure the import time of the web and worker entry points"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--budget-ms", type=float, default=BUDGET_MS)
+        parser.add_argument("--top", type=int, default=10)
+
+    def handle(self, *args, **options) -> None:
+        failures = []
+        for name, code in ENTRY_POINTS.items():
+            # The fastest run is the least disturbed by the rest of the machine
+            modules = min(
+                (measure_imports(code) for _ in range(options["repeat"])),
+                key=lambda modules: sum(modules.values()),
+            )
+            total_ms = sum(modules.values()) / 1000
+            self.stdout.write(
+                f"{name:<8} {total_ms:>8.1f} ms {len(modules):>6} modules"
+            )
+
+            packages = {}
+            for module, micros in modules.items():
+                package = module.split(".")[0]
+                packages[package] = packages.get(package, 0) + micros
+            heaviest = sorted(packages.items(), key=lambda item: -item[1])
+            for package, micros in heaviest[: options["top"]]:
+                self.stdout.write(f"    {package:<28} {micros / 1000:>8.1f} ms")
+
+            if total_ms > options["budget_ms"]:
+                failures.append(f"{name} takes {total_ms:.0f} ms to import")
+            if loaded := [module for module in LAZY_MODULES if module in modules]:
+                failures.append(f"{name} imports {', '.join(loaded)} at startup")
+
+        if failures:
+            raise CommandError("; ".join(failures))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandParser
+from django.db.models import Count
+
+from apps import frontier
+from apps.models import CrawlState, FrontierEntry
+
+
+class Command(BaseCommand):
+    help = "inspect or reset the persistent crawl frontier"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        kinds = [kind for kind, _ in FrontierEntry.KIND_CHOICES]
+        parser.add_argument("--kind", choices=kinds, help="only this kind of entry")
+        parser.add_argument(
+            "--stale", action="store_true", help="list the entries to dispatch again"
+        )
+        parser.add_argument(
+            "--reset", action="store_true", help="forget the selected entries"
+        )
+
+    def handle(self, *args, **options) -> None:
+        kind = options["kind"]
+        if options["reset"]:
+            deleted = frontier.reset(kind)
+            if kind in (None, FrontierEntry.KIND_LISTING):
+                # Without its checkpoints an unfinished crawl must start over
+                CrawlState.objects.filter(name="books", finished_at=None).update(
+                    started_at=None
+                )
+            self.stdout.write(f"Deleted {deleted} frontier entries")
+            return
+
+        if options["stale"]:
+            for entry in frontier.stale_entries(kind):
+                self.stdout.write(
+                    f"{entry.kind:<8} {entry.key:<12} {entry.status:<8} "
+                    f"attempts={entry.attempts} updated={entry.updated_at:%Y-%m-%d %H:%M}"
+                )
+            return
+
+        queryset = FrontierEntry.objects.all()
+        if kind:
+            queryset = queryset.filter(kind=kind)
+        for row in (
+            queryset.values("kind", "status")
+            .annotate(count=Count("*"))
+            .order_by("kind", "status")
+        ):
+            self.stdout.write(f"{row['kind']:<8} {row['status']:<8} {row['count']}")
+        state = CrawlState.objects.filter(name="books").first()
+        if state and state.started_at and not state.finished_at:
+            self.stdout.write(
+                f"Unfinished {state.mode} crawl resumes at page {frontier.resume_page()}"
+            )
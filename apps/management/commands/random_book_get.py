@@ -5,8 +5,8 @@ from random import choice
 
 from django.core.management.base import BaseCommand, CommandParser
 
+from apps.pdf import images_to_pdf
 from apps.services import ImageExtractor
-from apps.tools import images_to_long_image, long_image_to_pdf
 
 logger = getLogger(__name__)
 
@@ -68,15 +68,12 @@ class Command(BaseCommand):
                 images = await worker.get_images_concurrently(image_urls)
 
                 print(f"Got {len(images)} images")
+                print("Converting to PDF, please wait...")
                 if not (
-                    long_image := await images_to_long_image(
-                        [img for img in images if img]
-                    )
+                    pdf_buffer := await images_to_pdf([img for img in images if img])
                 ):
                     continue
 
-                print("Image: ", long_image, "Converting to PDF, please wait...")
-                pdf_buffer = await long_image_to_pdf(long_image)
                 with open(book_dir / f"{episode['title']}.pdf", "wb") as f:
                     f.write(pdf_buffer.read())
             except Exception as e:
@@ -84,4 +81,7 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options) -> None:
         loop = get_event_loop()
-        loop.run_until_complete(self.handle_async())
+        try:
+            loop.run_until_complete(self.handle_async())
+        finally:
+            loop.run_until_complete(ImageExtractor().close())
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from apps.replay import ReplaySite, serve
+
+
+def add_site_arguments(parser: CommandParser) -> None:
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--books-per-page", type=int, default=20)
+    parser.add_argument("--episodes", type=int, default=5)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument(
+        "--image-size", type=int, nargs=2, default=[720, 1000], metavar=("W", "H")
+    )
+    parser.add_argument("--latency", type=float, default=0, help="seconds per request")
+    parser.add_argument("--page-error-rate", type=float, default=0)
+    parser.add_argument("--image-error-rate", type=float, default=0)
+
+
+def build_site(options: dict) -> ReplaySite:
+    return ReplaySite(
+        pages=options["pages"],
+        books_per_page=options["books_per_page"],
+        episodes=options["episodes"],
+        images=options["images"],
+        image_size=tuple(options["image_size"]),
+        latency=options["latency"],
+        page_error_rate=options["page_error_rate"],
+        image_error_rate=options["image_error_rate"],
+    )
+
+
+class Command(BaseCommand):
+    help = "serve a local stand-in of the comic site, for CRAWLER_ORIGIN"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        add_site_arguments(parser)
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8001)
+
+    def handle(self, *args, **options) -> None:
+        with serve(build_site(options), options["host"], options["port"]) as site:
+            self.stdout.write(f"Serving on {site.origin}, stop with CONTROL-C")
+            try:
+                while True:
+                    time.sleep(60)
+            except KeyboardInterrupt:
+                pass
+            self.stdout.write(f"Served {site.served}")
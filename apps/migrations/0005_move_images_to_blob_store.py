@@ -0,0 +1,77 @@
+import base64
+import binascii
+from logging import getLogger
+
+from django.db import migrations, transaction
+
+from apps.storage import get_blob_store, guess_mime
+
+logger = getLogger(__name__)
+
+BATCH_SIZE = 200
+BLOB_MODELS = ("Book", "Image")
+
+
+def iter_batches(queryset):
+    """Walk the queryset by primary key in fixed-size batches"""
+    last_pk = None
+    while True:
+        batch_qs = queryset.order_by("pk")
+        if last_pk is not None:
+            batch_qs = batch_qs.filter(pk__gt=last_pk)
+        if not (batch := list(batch_qs[:BATCH_SIZE])):
+            return
+        yield batch
+        last_pk = batch[-1].pk
+
+
+def move_images_to_blob_store(apps, schema_editor):
+    store = get_blob_store()
+    for model_name in BLOB_MODELS:
+        model = apps.get_model("apps", model_name)
+        moved = 0
+        for batch in iter_batches(model.objects.exclude(image="").only("pk", "image")):
+            for obj in batch:
+                try:
+                    content = base64.b64decode(obj.image)
+                except (binascii.Error, ValueError):
+                    content = b""
+                if mime := guess_mime(content):
+                    obj.image_hash = store.save(content)
+                    obj.image_size = len(content)
+                    obj.image_mime = mime
+                else:
+                    # Leave the hash empty so fix_images downloads it again
+                    logger.warning(f"Drop undecodable image of {model_name} {obj.pk}")
+                obj.image = ""
+            with transaction.atomic():
+                model.objects.bulk_update(
+                    batch, ["image", "image_hash", "image_size", "image_mime"]
+                )
+            moved += len(batch)
+            logger.info(f"Moved {moved} {model_name} images to the blob store")
+
+
+def restore_images_from_blob_store(apps, schema_editor):
+    store = get_blob_store()
+    for model_name in BLOB_MODELS:
+        model = apps.get_model("apps", model_name)
+        queryset = model.objects.exclude(image_hash="").only("pk", "image_hash")
+        for batch in iter_batches(queryset):
+            for obj in batch:
+                obj.image = base64.b64encode(store.read(obj.image_hash)).decode()
+            with transaction.atomic():
+                model.objects.bulk_update(batch, ["image"])
+
+
+class Migration(migrations.Migration):
+    # Every batch commits on its own so an interrupted run can simply be resumed
+    atomic = False
+
+    dependencies = [
+        ("apps", "0004_blob_store_fields"),
+    ]
+
+    operations = [
+        migrations.RunPython(move_images_to_blob_store, restore_images_from_blob_store),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("apps", "0005_move_images_to_blob_store"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="book",
+            name="image",
+        ),
+        migrations.RemoveField(
+            model_name="image",
+            name="image",
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.5 on 2026-10-16 20:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("apps", "0006_remove_base64_image"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="book",
+            name="image_url",
+            field=models.URLField(db_index=True, default=""),
+        ),
+        migrations.AlterField(
+            model_name="image",
+            name="raw_url",
+            field=models.URLField(db_index=True, default=""),
+        ),
+    ]
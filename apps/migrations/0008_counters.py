@@ -0,0 +1,33 @@
+# Generated by Django 4.2.5 on 2026-10-16 20:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("apps", "0007_index_image_urls"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="episode_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="episode",
+            name="downloaded_image_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="episode",
+            name="image_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="tag",
+            name="book_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
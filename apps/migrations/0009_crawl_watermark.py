@@ -0,0 +1,43 @@
+# Generated by Django 4.2.5 on 2026-10-16 20:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("apps", "0008_counters"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CrawlState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=50, unique=True)),
+                ("mode", models.CharField(default="incremental", max_length=20)),
+                ("last_page", models.IntegerField(default=0)),
+                ("changed_books", models.IntegerField(default=0)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "verbose_name": "Crawl State",
+                "verbose_name_plural": "Crawl States",
+                "ordering": ["name"],
+            },
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="update_marker",
+            field=models.CharField(blank=True, default="", max_length=100),
+        ),
+    ]
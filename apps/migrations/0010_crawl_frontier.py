@@ -0,0 +1,72 @@
+# Generated by Django 4.2.5 on 2026-10-16 20:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("apps", "0009_crawl_watermark"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FrontierEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("listing", "Listing page"),
+                            ("book", "Book"),
+                            ("episode", "Episode"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("key", models.CharField(max_length=100)),
+                ("url", models.URLField(blank=True, default="")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("leased", "Leased"),
+                            ("done", "Done"),
+                        ],
+                        default="pending",
+                        max_length=20,
+                    ),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("leased_until", models.DateTimeField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Frontier Entry",
+                "verbose_name_plural": "Frontier Entries",
+                "ordering": ["kind", "updated_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["status", "kind", "updated_at"],
+                        name="apps_fronti_status_6f6fa5_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="frontierentry",
+            constraint=models.UniqueConstraint(
+                fields=("kind", "key"), name="unique_frontier_key"
+            ),
+        ),
+    ]
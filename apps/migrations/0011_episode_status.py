@@ -0,0 +1,67 @@
+# Generated by Django 4.2.5 on 2026-10-16 22:20
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef, Q
+
+
+def derive_episode_status(apps, schema_editor):
+    """Place existing episodes in the pipeline from their images and PDF"""
+    Episode = apps.get_model("apps", "Episode")
+    Image = apps.get_model("apps", "Image")
+    images = Image.objects.filter(episode_id=OuterRef("pk"))
+    episodes = Episode.objects.annotate(
+        has_images=Exists(images),
+        has_missing_images=Exists(images.filter(image_hash="")),
+    )
+    with_pdf = Q(pdf__isnull=False) & ~Q(pdf="")
+    episodes.filter(with_pdf).update(status="rendered")
+    episodes.exclude(with_pdf).filter(has_images=True, has_missing_images=True).update(
+        status="images_listed"
+    )
+    episodes.exclude(with_pdf).filter(has_images=True, has_missing_images=False).update(
+        status="images_complete"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("apps", "0010_crawl_frontier"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="episode",
+            name="attempts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="episode",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("discovered", "Discovered"),
+                    ("images_listed", "Images listed"),
+                    ("images_complete", "Images complete"),
+                    ("rendered", "Rendered"),
+                    ("failed", "Failed"),
+                ],
+                default="discovered",
+                max_length=20,
+            ),
+        ),
+        migrations.AddField(
+            model_name="episode",
+            name="status_changed_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name="episode",
+            index=models.Index(
+                fields=["status", "status_changed_at"],
+                name="apps_episod_status_f44940_idx",
+            ),
+        ),
+        migrations.RunPython(derive_episode_status, migrations.RunPython.noop),
+    ]
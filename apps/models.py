@@ -1,21 +1,18 @@
 # models.py
-import base64
 import logging
 
-from asgiref.sync import sync_to_async
-from django.core.files.base import ContentFile
 from django.db import models
-from PIL import ImageFile
+from django.urls import reverse
+from django.utils import timezone
 
-from apps.tools import images_to_long_image, long_image_to_pdf
+from apps.storage import BlobInfo, get_blob_store, guess_mime
 
 logger = logging.getLogger(__name__)
 
-ImageFile.LOAD_TRUNCATED_IMAGES = True
-
 
 class Tag(models.Model):
     name = models.CharField(max_length=100, unique=True, verbose_name="tag-name")
+    book_count = models.PositiveIntegerField(default=0)
 
     class Meta:
         verbose_name = "Tag"
@@ -26,15 +23,83 @@ class Tag(models.Model):
         return self.name
 
 
-class Book(models.Model):
+class BlobImage(models.Model):
+    """Reference to raw image bytes kept in the blob store"""
+
+    IMAGE_FIELDS = ["image_hash", "image_size", "image_mime"]
+    IMAGE_URL_FIELD = "raw_url"
+
+    image_hash = models.CharField(max_length=64, default="", blank=True, db_index=True)
+    image_size = models.PositiveIntegerField(default=0)
+    image_mime = models.CharField(max_length=50, default="", blank=True)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def has_image(self) -> bool:
+        return bool(self.image_hash)
+
+    @property
+    def thumbnail_url(self) -> str:
+        if not self.image_hash:
+            return ""
+        return reverse("serve_thumbnail", args=[self.image_hash])
+
+    def read_image(self) -> bytes:
+        """Load the raw image bytes from the blob store"""
+        if not self.image_hash:
+            return b""
+        return get_blob_store().read(self.image_hash)
+
+    def set_image(self, content: bytes, mime: str = "") -> list:
+        """Store the content in the blob store and point this row at it"""
+        if not content:
+            self.image_hash, self.image_size, self.image_mime = "", 0, ""
+        else:
+            self.image_hash = get_blob_store().save(content)
+            self.image_size = len(content)
+            self.image_mime = guess_mime(content) or mime
+        return self.IMAGE_FIELDS
+
+    def set_blob(self, blob: BlobInfo) -> list:
+        """Point this row at a blob that is already stored"""
+        self.image_hash, self.image_size, self.image_mime = (
+            blob.digest,
+            blob.size,
+            blob.mime,
+        )
+        return self.IMAGE_FIELDS
+
+    @classmethod
+    def known_images(cls, urls, exclude_pks=()) -> dict:
+        """Map URLs some other row already downloaded to that row's blob reference"""
+        url_field = cls.IMAGE_URL_FIELD
+        store = get_blob_store()
+        known = {}
+        for url, *reference in (
+            cls.objects.filter(**{f"{url_field}__in": set(urls)})
+            .exclude(image_hash="")
+            .exclude(pk__in=exclude_pks)
+            .values_list(url_field, *cls.IMAGE_FIELDS)
+        ):
+            if url not in known and store.exists(reference[0]):
+                known[url] = dict(zip(cls.IMAGE_FIELDS, reference))
+        return known
+
+
+class Book(BlobImage):
     id = models.CharField(max_length=100, unique=True, db_index=True, primary_key=True)
-    image = models.TextField(default="")
     hot = models.IntegerField(default=0)
     title = models.CharField(max_length=100, default="")
     tags = models.ManyToManyField(Tag, related_name="books")
     description = models.TextField(default="")
     raw_url = models.URLField(default="")
-    image_url = models.URLField(default="")
+    image_url = models.URLField(default="", db_index=True)
+    episode_count = models.PositiveIntegerField(default=0)
+    update_marker = models.CharField(max_length=100, default="", blank=True)
+
+    IMAGE_URL_FIELD = "image_url"
 
     class Meta:
         verbose_name = "Book"
@@ -42,75 +107,63 @@ class Book(models.Model):
         ordering = ["title"]
 
     def __str__(self):
-        return f"<{self.title} [{self.episodes.count()}]>"
+        return f"<{self.title} [{self.episode_count}]>"
 
     def is_outdated(self, episodes_title: str) -> bool:
-        if not self.episodes.exists():
-            return True
-        return self.episodes.all().order_by("id").last().title != episodes_title
+        latest = self.episodes.order_by("-id").values_list("title", flat=True).first()
+        return latest is None or latest != episodes_title
 
 
 class Episode(models.Model):
+    """
+    A chapter and where it stands in the pipeline
+    discovered -> images_listed -> images_complete -> rendered, or failed once a
+    stage ran out of attempts, `attempts` counts the tries of the current stage
+    """
+
+    STATUS_DISCOVERED = "discovered"
+    STATUS_IMAGES_LISTED = "images_listed"
+    STATUS_IMAGES_COMPLETE = "images_complete"
+    STATUS_RENDERED = "rendered"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_DISCOVERED, "Discovered"),
+        (STATUS_IMAGES_LISTED, "Images listed"),
+        (STATUS_IMAGES_COMPLETE, "Images complete"),
+        (STATUS_RENDERED, "Rendered"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
     id = models.IntegerField(primary_key=True)
     title = models.CharField(max_length=100, default="")
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="episodes")
     raw_url = models.URLField(default="")
     pdf = models.FileField(upload_to="pdfs", null=True, blank=True)
+    image_count = models.PositiveIntegerField(default=0)
+    downloaded_image_count = models.PositiveIntegerField(default=0)
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=STATUS_DISCOVERED
+    )
+    status_changed_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
 
     class Meta:
         verbose_name = "Episode"
         verbose_name_plural = "Episodes"
         ordering = ["book__id", "id", "title"]
+        indexes = [models.Index(fields=["status", "status_changed_at"])]
 
     def __str__(self):
-        return f"{self.book.title} - {self.id} - [{self.images.count()}]"
-
-    async def get_episode_long_image(self, auto_fix: bool = False):
-        from apps.tasks import download_image, find_images
-
-        images = await sync_to_async(
-            lambda: list(self.images.all().order_by("index").only("image", "id"))
-        )()
-        if not images:
-            if auto_fix:
-                find_images.apply_async(args=[self.book.id])
-            return
-
-        problem_images = [image for image in images if not image.image]
-        if problem_images:
-            logger.error(f"Episode {self.id} has missing images")
-            if auto_fix:
-                for image in problem_images:
-                    download_image.apply_async(args=[image.id], countdown=5)
-            return
-
-        image_data = (base64.b64decode(item.image) for item in images)
-        return await images_to_long_image(image_data)
-
-    async def convert_to_pdf(self, force: bool = False, read: bool = False):
-        if self.pdf and not force:
-            return await sync_to_async(self.pdf.read)() if read else None
-
-        img = await self.get_episode_long_image(auto_fix=True)
-        if not img:
-            return
-
-        buffer = await long_image_to_pdf(img, use_process_pool=True)
-        await sync_to_async(self.pdf.save)(
-            f"{self.title}.pdf", ContentFile(buffer.read())
-        )
+        return f"{self.book.title} - {self.id} - [{self.image_count}]"
 
-        return buffer
 
-
-class Image(models.Model):
+class Image(BlobImage):
     id = models.IntegerField(primary_key=True)
     episode = models.ForeignKey(
         Episode, on_delete=models.CASCADE, related_name="images"
     )
     index = models.IntegerField(default=0)
-    image = models.TextField(default="")
-    raw_url = models.URLField(default="")
+    raw_url = models.URLField(default="", db_index=True)
 
     class Meta:
         verbose_name = "Image"
@@ -119,3 +172,72 @@ class Image(models.Model):
 
     def __str__(self):
         return f"Image {self.id} for Episode {self.episode.id}"
+
+
+class CrawlState(models.Model):
+    """Where the last crawl of the listing ended"""
+
+    MODE_INCREMENTAL = "incremental"
+    MODE_FULL = "full"
+
+    name = models.CharField(max_length=50, unique=True)
+    mode = models.CharField(max_length=20, default=MODE_INCREMENTAL)
+    last_page = models.IntegerField(default=0)
+    changed_books = models.IntegerField(default=0)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Crawl State"
+        verbose_name_plural = "Crawl States"
+        ordering = ["name"]
+
+    def __str__(self):
+        return f"{self.name} ({self.mode}, page {self.last_page})"
+
+
+class FrontierEntry(models.Model):
+    """
+    A unit of crawl work that outlives the worker running it
+    Listing pages are recorded once crawled, books and episodes while they wait to be crawled
+    """
+
+    KIND_LISTING = "listing"
+    KIND_BOOK = "book"
+    KIND_EPISODE = "episode"
+    KIND_CHOICES = [
+        (KIND_LISTING, "Listing page"),
+        (KIND_BOOK, "Book"),
+        (KIND_EPISODE, "Episode"),
+    ]
+
+    STATUS_PENDING = "pending"
+    STATUS_LEASED = "leased"
+    STATUS_DONE = "done"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_LEASED, "Leased"),
+        (STATUS_DONE, "Done"),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    key = models.CharField(max_length=100)
+    url = models.URLField(default="", blank=True)
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    leased_until = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Frontier Entry"
+        verbose_name_plural = "Frontier Entries"
+        ordering = ["kind", "updated_at"]
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "key"], name="unique_frontier_key")
+        ]
+        indexes = [models.Index(fields=["status", "kind", "updated_at"])]
+
+    def __str__(self):
+        return f"{self.kind} {self.key} ({self.status})"
@@ -0,0 +1,112 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from logging import getLogger
+
+from django.conf import settings
+from django.core.cache import caches
+
+from apps.transport import Response
+
+logger = getLogger(__name__)
+
+
+class NotModified:
+    """Signal that a page has not changed since it was last crawled"""
+
+    def __repr__(self):
+        return "NOT_MODIFIED"
+
+
+NOT_MODIFIED = NotModified()
+
+
+class PageCache:
+    """
+    Validators of crawled pages: ETag, Last-Modified and a hash of the body
+    Entries live in a Django cache, which provides the TTL
+    A changed page is remembered only once its caller commits it, so that a page whose
+    processing failed is parsed again on the next crawl
+    """
+
+    def __init__(
+        self, alias: str = "default", timeout: int = None, max_pending: int = 1024
+    ):
+        self.alias = alias
+        self.timeout = timeout
+        # Entries of changed pages fetched by is_modified, waiting for `commit`
+        # Shared by the threads and loops of the worker, the oldest are dropped past
+        # max_pending, those pages are only parsed again on the next crawl
+        self.pending = OrderedDict()
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def key(self, url: str) -> str:
+        return f"page:{hashlib.sha1(url.encode()).hexdigest()}"
+
+    async def get(self, url: str) -> dict | None:
+        return await self.cache.aget(self.key(url))
+
+    @staticmethod
+    def entry_for(resp: Response) -> dict:
+        return {
+            "etag": resp.headers.get("ETag", ""),
+            "last_modified": resp.headers.get("Last-Modified", ""),
+            "body_hash": hashlib.sha256(resp.content).hexdigest(),
+        }
+
+    async def set(self, url: str, entry: dict) -> None:
+        await self.cache.aset(self.key(url), entry, timeout=self.timeout)
+
+    def _stash(self, url: str, entry: dict) -> None:
+        with self._lock:
+            self.pending[url] = entry
+            self.pending.move_to_end(url)
+            while len(self.pending) > self.max_pending:
+                self.pending.popitem(last=False)
+
+    def _unstash(self, url: str) -> dict | None:
+        with self._lock:
+            return self.pending.pop(url, None)
+
+    async def delete(self, url: str) -> None:
+        self._unstash(url)
+        await self.cache.adelete(self.key(url))
+
+    async def commit(self, url: str) -> None:
+        """Remember a page returned by is_modified, once its content was processed"""
+        if (entry := self._unstash(url)) is not None:
+            await self.set(url, entry)
+
+    @staticmethod
+    def conditional_headers(entry: dict | None) -> dict:
+        headers = {}
+        if entry and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    async def is_modified(self, url: str, entry: dict | None, resp: Response) -> bool:
+        """Tell whether callers need to parse the response, see `commit`"""
+        if entry and resp.status == 304:
+            # Refresh the TTL of the entry the server just confirmed
+            await self.set(url, entry)
+            return False
+        if not resp.ok:
+            return True
+        new_entry = self.entry_for(resp)
+        # Servers without validators still let us skip parsing an identical body
+        if entry and entry["body_hash"] == new_entry["body_hash"]:
+            await self.set(url, new_entry)
+            return False
+        self._stash(url, new_entry)
+        return True
+
+
+def get_page_cache() -> PageCache:
+    return PageCache(**settings.CRAWLER_PAGE_CACHE)
@@ -0,0 +1,429 @@
+import asyncio
+import time
+import zlib
+from dataclasses import dataclass, field
+from functools import lru_cache
+from io import BytesIO
+from logging import getLogger
+from math import ceil
+
+from django.conf import settings
+
+from apps.executors import get_executor, pool_size
+from apps.tools import load_and_convert_image, pillow
+
+logger = getLogger(__name__)
+
+MODE_PASSTHROUGH = "passthrough"
+MODE_STITCH = "stitch"
+# Viewers follow the PDF 1.x limit of 200 inches per page side
+MAX_PAGE_HEIGHT = 200 * 72
+
+
+@dataclass
+class Strip:
+    """Rows [top, bottom) of source image `index`, pasted `offset` rows down a page"""
+
+    index: int
+    top: int
+    bottom: int
+    offset: int
+
+
+@dataclass
+class PagePlan:
+    """One output page: `width` x `height` pixels of the stacked sources, made of strips"""
+
+    width: int
+    height: int
+    strips: list = field(default_factory=list)
+
+
+def image_size(content: bytes) -> tuple | None:
+    """Width and height read from the image header, without decoding the pixels"""
+    try:
+        with pillow().open(BytesIO(content)) as img:
+            return img.size
+    except Exception as e:
+        logger.error(f"Error loading image: {str(e)}")
+        return None
+
+
+def plan_pages(sizes: list, page_width: float, page_height: float) -> tuple:
+    """
+    Stack the sources top to bottom, left aligned, scaled so that the widest one
+    fills the page width, and cut the stack into pages of `page_height`
+    `sizes` holds the (width, height) of each source, None for unreadable ones
+    Returns the scale and the PagePlan of every page
+    """
+    known = [size for size in sizes if size]
+    if not known:
+        return 0, []
+    width = max(w for w, _ in known)
+    total_height = sum(h for _, h in known)
+    scale = page_width / width
+    page_count = -(-int(total_height * scale) // int(page_height))
+
+    # Where each readable source starts in the stack
+    starts, y = [], 0
+    for index, size in enumerate(sizes):
+        if size:
+            starts.append((index, y, y + size[1]))
+            y += size[1]
+
+    pages, first = [], 0
+    for page in range(page_count):
+        top = int(page * page_height / scale)
+        bottom = min(int((page + 1) * page_height / scale), total_height)
+        if top >= bottom:
+            logger.error(f"Invalid crop box coordinates: top={top}, bottom={bottom}")
+            continue
+        plan = PagePlan(width=width, height=bottom - top)
+        # Sources are visited in order, those above this page are never looked at again
+        while first < len(starts) and starts[first][2] <= top:
+            first += 1
+        for index, start, end in starts[first:]:
+            if start >= bottom:
+                break
+            plan.strips.append(
+                Strip(
+                    index=index,
+                    top=max(top, start) - start,
+                    bottom=min(bottom, end) - start,
+                    offset=max(top, start) - top,
+                )
+            )
+        pages.append(plan)
+    return scale, pages
+
+
+@lru_cache(maxsize=None)
+def configure_reportlab() -> None:
+    """
+    Have reportlab write streams as binary, once per process
+    It would otherwise spell them out in ASCII85 with a pure Python encoder, a
+    quarter larger and slower than the rest
+    """
+    from reportlab import rl_config
+
+    rl_config.useA85 = 0
+
+
+def new_canvas(buffer: BytesIO):
+    """A4 reportlab canvas writing to `buffer`"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    configure_reportlab()
+    return canvas.Canvas(buffer, pagesize=A4)
+
+
+def jpeg_reader(content: bytes):
+    """
+    ImageReader that embeds a JPEG stream as is
+    reportlab names images after their decoded pixels, this one is named after its
+    bytes so that drawing it never decodes it
+    """
+    from reportlab.lib.utils import ImageReader
+
+    class JpegReader(ImageReader):
+        _dataA = None
+
+        def getRGBData(self):
+            return content
+
+    reader = JpegReader(BytesIO(content))
+    return reader if reader.jpeg_fh() else None
+
+
+def passthrough_pdf(images: list) -> BytesIO | None:
+    """
+    Put every image on a page of its own at A4 width, scaled by the PDF transform
+    JPEG streams are embedded without being decoded, other formats losslessly
+    Images taller than a PDF page are shown across several pages but embedded once
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.utils import ImageReader
+
+    pdf_width = A4[0]
+    buffer = BytesIO()
+    pdf_canvas = new_canvas(buffer)
+    drawn = 0
+    for image in images:
+        try:
+            reader = jpeg_reader(image) or ImageReader(load_and_convert_image(image))
+            width, height = reader.getSize()
+        except Exception as e:
+            logger.error(f"Error loading image: {str(e)}")
+            continue
+
+        scaled_height = height * pdf_width / width
+        top = 0
+        while top < scaled_height:
+            page_height = min(MAX_PAGE_HEIGHT, scaled_height - top)
+            pdf_canvas.setPageSize((pdf_width, page_height))
+            pdf_canvas.drawImage(
+                reader,
+                0,
+                page_height + top - scaled_height,
+                width=pdf_width,
+                height=scaled_height,
+            )
+            pdf_canvas.showPage()
+            top += page_height
+        drawn += 1
+
+    if not drawn:
+        return None
+    pdf_canvas.save()
+    buffer.seek(0)
+    return buffer
+
+
+@dataclass
+class RenderedPage:
+    """
+    Page `number` scaled to the PDF width, its RGB pixels Flate encoded
+    `points` is its height on the PDF page, `decoded` the bytes of source pixels
+    decoded for it and `held` the bytes of pixels in memory while drawing it
+    """
+
+    number: int
+    width: int
+    height: int
+    points: float
+    stream: bytes = b""
+    seconds: float = 0
+    cpu: float = 0
+    decoded: int = 0
+    held: int = 0
+
+
+def plan_stitch(images: list) -> tuple:
+    from reportlab.lib.pagesizes import A4
+
+    return plan_pages([image_size(image) for image in images], *A4)
+
+
+def decode_scaled(content: bytes, ratio: float, draft: bool = True) -> tuple | None:
+    """
+    Decode a source to be drawn at `ratio` times its size, as RGB
+    JPEGs are scaled down by the decoder itself, by up to 8, and what is still twice
+    as large as needed or more is reduced by a whole factor before being resized
+    Returns the image and the factor its size was divided by
+    """
+    try:
+        img = pillow().open(BytesIO(content))
+        width = img.width
+        if draft:
+            img.draft("RGB", (ceil(img.width * ratio), ceil(img.height * ratio)))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        if draft and (factor := int(img.width / (width * ratio))) >= 2:
+            img = img.reduce(factor)
+        return img, width / img.width
+    except Exception as e:
+        logger.error(f"Error loading image: {str(e)}")
+        return None
+
+
+def render_page(
+    number: int,
+    plan: PagePlan,
+    scale: float,
+    images,
+    dpi: int = 72,
+    draft: bool = True,
+    sources: dict = None,
+) -> RenderedPage | None:
+    """
+    Draw the strips of one page at `dpi` and encode it
+    `images` maps source indexes to their bytes, only those on this page are decoded,
+    and each straight to about the size it is drawn at, see decode_scaled
+    `sources` keeps decoded sources for the next pages of a run, see render_run
+    """
+    started, cpu_started = time.perf_counter(), time.thread_time()
+    # Output pixels per source pixel, `scale` is in points
+    ratio = scale * dpi / 72
+    new_width, new_height = int(plan.width * ratio), int(plan.height * ratio)
+    if new_width <= 0 or new_height <= 0:
+        logger.error(
+            f"Invalid dimensions for resized image: width={new_width}, height={new_height}. "
+            f"Page {number} of {plan.height} rows, scale={scale}"
+        )
+        return None
+
+    sources = {} if sources is None else sources
+    page_img = pillow().new("RGB", (new_width, new_height))
+    decoded = 0
+    for strip in plan.strips:
+        if strip.index not in sources:
+            sources[strip.index] = decode_scaled(images[strip.index], ratio, draft)
+            if found := sources[strip.index]:
+                decoded += found[0].width * found[0].height
+        if not sources[strip.index]:
+            continue
+        source, factor = sources[strip.index]
+        top = round(strip.offset * ratio)
+        bottom = round((strip.offset + strip.bottom - strip.top) * ratio)
+        if bottom <= top:
+            continue
+        rows = source.crop(
+            (0, round(strip.top / factor), source.width, round(strip.bottom / factor))
+        )
+        page_img.paste(
+            rows.resize((round(source.width * factor * ratio), bottom - top)),
+            (0, top),
+        )
+
+    held = new_width * new_height
+    for index in {strip.index for strip in plan.strips}:
+        if found := sources[index]:
+            held += found[0].width * found[0].height
+    # Pillow keeps 4 bytes per RGB pixel
+    return RenderedPage(
+        number=number,
+        width=new_width,
+        height=new_height,
+        points=new_height * 72 / dpi,
+        stream=zlib.compress(page_img.tobytes()),
+        seconds=time.perf_counter() - started,
+        cpu=time.thread_time() - cpu_started,
+        decoded=decoded * 4,
+        held=held * 4,
+    )
+
+
+def render_run(
+    run: list, scale: float, images, dpi: int = 72, draft: bool = True
+) -> list:
+    """
+    Render consecutive (number, PagePlan) pages in order
+    A source spanning several pages of the run is decoded once, and released after
+    the last of them
+    """
+    last_page = {strip.index: number for number, plan in run for strip in plan.strips}
+    sources, pages = {}, []
+    for number, plan in run:
+        pages.append(render_page(number, plan, scale, images, dpi, draft, sources))
+        for index in [index for index in sources if last_page[index] == number]:
+            del sources[index]
+    return pages
+
+
+def split_runs(items: list, count: int) -> list:
+    """Cut `items` into at most `count` runs of consecutive items, as even as possible"""
+    size, extra = divmod(len(items), count)
+    runs, start = [], 0
+    for i in range(min(count, len(items))):
+        end = start + size + (i < extra)
+        runs.append(items[start:end])
+        start = end
+    return runs
+
+
+def draw_page(pdf_canvas, page: RenderedPage) -> None:
+    """
+    Put an encoded page at the top of an A4 page
+    drawImage would decode and compress the pixels once more on the thread that
+    assembles the document, so the encoded stream is registered as is and drawn
+    the way drawImage draws it
+    This goes through reportlab internals, the version is pinned in requirements.txt
+    and PdfTests compares the result with drawImage
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase.pdfdoc import PDFImageXObject
+
+    pdf_width, pdf_height = A4
+    name = f"page{page.number}"
+    image = PDFImageXObject(name)
+    image.width, image.height = page.width, page.height
+    image.colorSpace, image.bitsPerComponent = "DeviceRGB", 8
+    image._filters = ("FlateDecode",)
+    image.streamContent = page.stream
+
+    pdf_canvas._doc.addForm(name, image)
+
+    pdf_canvas.saveState()
+    pdf_canvas.translate(0, pdf_height - page.points)
+    pdf_canvas.scale(pdf_width, page.points)
+    pdf_canvas.doForm(name)
+    pdf_canvas.restoreState()
+    pdf_canvas.showPage()
+
+
+def assemble_pdf(pages: list) -> BytesIO | None:
+    """Write the rendered pages in order, None stands for a page that was skipped"""
+    if not (pages := [page for page in pages if page]):
+        return None
+    buffer = BytesIO()
+    pdf_canvas = new_canvas(buffer)
+    for page in pages:
+        draw_page(pdf_canvas, page)
+    pdf_canvas.save()
+    buffer.seek(0)
+    return buffer
+
+
+def stitch_pdf(images: list, dpi: int = None, draft: bool = True) -> BytesIO | None:
+    """
+    Lay the images out as one long strip and cut it into A4 pages
+    Pages are planned up front, each is built from the sources overlapping it only,
+    so runs of them can be rendered on any worker, see render_pages
+    """
+    dpi = dpi or settings.PDF_RENDER["dpi"]
+    scale, plans = plan_stitch(images)
+    return assemble_pdf(render_run(list(enumerate(plans)), scale, images, dpi, draft))
+
+
+async def render_pages(images: list, dpi: int = None, draft: bool = True) -> list:
+    """
+    Render the stitched pages of `images` concurrently on the shared pool
+    Each worker gets one run of consecutive pages, so that a source spanning several
+    pages is decoded once per run rather than once per page
+    """
+    dpi = dpi or settings.PDF_RENDER["dpi"]
+    loop = asyncio.get_running_loop()
+    scale, plans = plan_stitch(images)
+    runs = await asyncio.gather(
+        *(
+            loop.run_in_executor(
+                get_executor(), render_run, run, scale, images, dpi, draft
+            )
+            for run in split_runs(list(enumerate(plans)), pool_size())
+        )
+    )
+    return [page for run in runs for page in run]
+
+
+def report_timings(pages: list, seconds: float) -> None:
+    if not (timings := sorted(page.seconds for page in pages if page)):
+        return
+    for page in pages:
+        if page:
+            logger.debug(f"Page {page.number} rendered in {page.seconds * 1000:.0f} ms")
+    logger.info(
+        f"Rendered {len(timings)} pages in {seconds:.2f}s on {pool_size()} workers, "
+        f"per page median {timings[len(timings) // 2] * 1000:.0f} ms, "
+        f"max {timings[-1] * 1000:.0f} ms"
+    )
+
+
+RENDERERS = {MODE_PASSTHROUGH: passthrough_pdf, MODE_STITCH: stitch_pdf}
+
+
+def compose_pdf(images: list, mode: str = MODE_PASSTHROUGH) -> BytesIO | None:
+    """Render the images of an episode to a PDF with the renderer of `mode`"""
+    return RENDERERS[mode](images)
+
+
+async def images_to_pdf(images, mode: str = None):
+    mode = mode or settings.PDF_RENDER["mode"]
+    if mode == MODE_STITCH:
+        started = time.perf_counter()
+        pages = await render_pages(images)
+        report_timings(pages, time.perf_counter() - started)
+        return await asyncio.to_thread(assemble_pdf, pages)
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), compose_pdf, images, mode
+    )
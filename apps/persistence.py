@@ -0,0 +1,285 @@
+from collections import Counter
+from logging import getLogger
+
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from apps.models import Book, Episode, Image, Tag
+from apps.storage import BlobInfo
+
+logger = getLogger(__name__)
+
+BULK_BATCH_SIZE = 500
+
+
+def upsert_rows(model, rows: list, update_fields: list, **extra) -> set:
+    """
+    Insert or update scraped rows in a few statements
+    Returns the primary keys that did not exist before
+    """
+    to_python = model._meta.pk.to_python
+    # ON CONFLICT can not touch the same row twice, the last scraped copy wins
+    objs = {
+        pk: model(**{**row, "id": pk}, **extra)
+        for row in rows
+        if (pk := to_python(row["id"])) is not None
+    }
+    if not objs:
+        return set()
+
+    with transaction.atomic():
+        existing = set(model.objects.filter(pk__in=objs).values_list("pk", flat=True))
+        model.objects.bulk_create(
+            objs.values(),
+            batch_size=BULK_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=["id"],
+            update_fields=update_fields,
+        )
+    return set(objs) - existing
+
+
+def keyset_rows(queryset, fields: list, page_size: int = BULK_BATCH_SIZE):
+    """
+    Stream values_list rows of `fields`, which must identify a row, in their order
+    Each page is one query starting after the last row seen, so memory stays flat
+    and rows changed by the caller while streaming are neither skipped nor repeated
+    """
+    queryset = queryset.order_by(*fields).values_list(*fields)
+    last = None
+    while True:
+        page = queryset
+        if last is not None:
+            # (a, b) > (x, y) spelled out as a > x OR (a = x AND b > y)
+            after = Q()
+            for i, name in enumerate(fields):
+                after |= Q(
+                    **dict(zip(fields[:i], last[:i])), **{f"{name}__gt": last[i]}
+                )
+            page = page.filter(after)
+        if not (rows := list(page[:page_size])):
+            return
+        yield from rows
+        last = rows[-1]
+
+
+def count_of(queryset, field: str):
+    """Correlated COUNT(*) of `queryset` rows whose `field` points at the outer row"""
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(count=Count("*"))
+            .values("count"),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def refresh_book_counters(book_ids):
+    Book.objects.filter(pk__in=book_ids).update(
+        episode_count=count_of(Episode.objects.all(), "book")
+    )
+
+
+def refresh_episode_counters(episode_ids):
+    episodes = Episode.objects.filter(pk__in=episode_ids)
+    episodes.update(
+        image_count=count_of(Image.objects.all(), "episode"),
+        downloaded_image_count=count_of(
+            Image.objects.exclude(image_hash=""), "episode"
+        ),
+    )
+    # Missing images send an episode back to the download stage, whatever it reached
+    episodes.filter(image_count__gt=F("downloaded_image_count")).exclude(
+        status=Episode.STATUS_IMAGES_LISTED
+    ).update(
+        status=Episode.STATUS_IMAGES_LISTED,
+        status_changed_at=timezone.now(),
+        attempts=0,
+    )
+
+
+def advance_episode(episode_id, sources: list, target: str) -> bool:
+    """
+    Move an episode to the `target` status if it is still in one of `sources`
+    False when another worker moved it first
+    """
+    return bool(
+        Episode.objects.filter(pk=episode_id, status__in=sources).update(
+            status=target, status_changed_at=timezone.now(), attempts=0
+        )
+    )
+
+
+def complete_episodes(episode_ids) -> list:
+    """
+    Mark the episodes whose images all arrived as ready to be rendered
+    Returns the ones this call moved, so that each completion is handled once
+    """
+    sources = [Episode.STATUS_DISCOVERED, Episode.STATUS_IMAGES_LISTED]
+    candidates = Episode.objects.filter(
+        pk__in=episode_ids,
+        status__in=sources,
+        image_count__gt=0,
+        downloaded_image_count__gte=F("image_count"),
+    ).values_list("pk", flat=True)
+    return [
+        pk
+        for pk in candidates
+        if advance_episode(pk, sources, Episode.STATUS_IMAGES_COMPLETE)
+    ]
+
+
+def record_episode_failure(episode_id, max_attempts: int) -> bool:
+    """Count a failed try of the current stage, returns whether the episode is now failed"""
+    Episode.objects.filter(pk=episode_id).update(attempts=F("attempts") + 1)
+    return bool(
+        Episode.objects.filter(pk=episode_id, attempts__gte=max_attempts)
+        .exclude(status=Episode.STATUS_FAILED)
+        .update(status=Episode.STATUS_FAILED, status_changed_at=timezone.now())
+    )
+
+
+def refresh_tag_counters(tag_ids):
+    Tag.objects.filter(pk__in=tag_ids).update(
+        book_count=count_of(Book.tags.through.objects.all(), "tag")
+    )
+
+
+def gained_downloads(model, keys) -> Counter:
+    """
+    Episodes that gain a downloaded image once the given rows are stored, with how many
+    Rows still without an image are locked until the caller commits, so two workers
+    storing the same image count it once
+    """
+    if model is not Image:
+        return Counter()
+    return Counter(
+        Image.objects.select_for_update()
+        .filter(pk__in=keys, image_hash="")
+        .values_list("episode_id", flat=True)
+    )
+
+
+def count_downloads(gained: Counter) -> None:
+    """
+    Add newly stored images to the episode counters
+    Only an episode that may now be complete can change status, that one is recounted
+    so that a drifted counter never completes it early
+    """
+    episode_ids = {}
+    for episode_id, count in gained.items():
+        episode_ids.setdefault(count, []).append(episode_id)
+    for count, ids in episode_ids.items():
+        Episode.objects.filter(pk__in=ids).update(
+            downloaded_image_count=F("downloaded_image_count") + count
+        )
+    if complete := list(
+        Episode.objects.filter(
+            pk__in=gained, downloaded_image_count__gte=F("image_count")
+        ).values_list("pk", flat=True)
+    ):
+        refresh_episode_counters(complete)
+
+
+def reuse_images(model, reused: list) -> None:
+    """Point rows at known blobs, `reused` holds (keys, image fields) pairs"""
+    with transaction.atomic():
+        gained = gained_downloads(model, [key for keys, _ in reused for key in keys])
+        for keys, fields in reused:
+            model.objects.filter(pk__in=keys).update(**fields)
+        count_downloads(gained)
+
+
+def upsert_books(rows: list) -> set:
+    """Upsert one parsed listing page of books"""
+    return upsert_rows(Book, rows, ["title", "raw_url", "image_url", "update_marker"])
+
+
+def changed_books(markers: dict) -> set:
+    """Books whose listing update marker differs from the stored one, new books included"""
+    stored = dict(
+        Book.objects.filter(pk__in=markers).values_list("pk", "update_marker")
+    )
+    return {
+        book_id for book_id, marker in markers.items() if stored.get(book_id) != marker
+    }
+
+
+def upsert_episodes(book: Book, rows: list) -> set:
+    """Upsert the parsed chapter list of a book"""
+    created = upsert_rows(Episode, rows, ["title", "raw_url", "book"], book=book)
+    refresh_book_counters([book.pk])
+    return created
+
+
+def upsert_images(episode: Episode, rows: list) -> set:
+    """Upsert the parsed pages of a chapter"""
+    created = upsert_rows(Image, rows, ["index", "raw_url", "episode"], episode=episode)
+    refresh_episode_counters([episode.pk])
+    return created
+
+
+def update_book_details(book: Book, tags: list, hot: int, description: str):
+    """Save the book page metadata and attach its tags"""
+    with transaction.atomic():
+        Book.objects.filter(pk=book.pk).update(hot=hot, description=description)
+        Tag.objects.bulk_create(
+            [Tag(name=name) for name in set(tags)], ignore_conflicts=True
+        )
+        tag_ids = list(Tag.objects.filter(name__in=tags).values_list("id", flat=True))
+        through = Book.tags.through
+        through.objects.bulk_create(
+            [through(book_id=book.pk, tag_id=tag_id) for tag_id in tag_ids],
+            ignore_conflicts=True,
+        )
+        refresh_tag_counters(tag_ids)
+
+
+def outdated_books(current_episodes: dict) -> set:
+    """
+    Batched Book.is_outdated for a whole listing page
+    `current_episodes` maps book ids to the latest episode title shown on the listing
+    """
+    latest_title = Subquery(
+        Episode.objects.filter(book_id=OuterRef("pk"))
+        .order_by("-id")
+        .values("title")[:1]
+    )
+    latest = dict(
+        Book.objects.filter(pk__in=current_episodes)
+        .annotate(latest_title=latest_title)
+        .values_list("pk", "latest_title")
+    )
+    return {
+        book_id
+        for book_id, title in current_episodes.items()
+        if latest.get(book_id) is None or latest[book_id] != title
+    }
+
+
+def save_downloaded_images(model, results: list) -> int:
+    """
+    Update the rows of downloaded [key, content] pairs in one batch
+    Content is either raw bytes or the BlobInfo of an image already streamed to the store
+    """
+    objs = []
+    for key, content in results:
+        if not content:
+            continue
+        obj = model(pk=key)
+        if isinstance(content, BlobInfo):
+            obj.set_blob(content)
+        else:
+            obj.set_image(content)
+        objs.append(obj)
+    with transaction.atomic():
+        gained = gained_downloads(model, [obj.pk for obj in objs])
+        model.objects.bulk_update(objs, model.IMAGE_FIELDS, batch_size=BULK_BATCH_SIZE)
+        count_downloads(gained)
+    return len(objs)
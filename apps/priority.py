@@ -0,0 +1,39 @@
+import time
+from logging import getLogger
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = getLogger(__name__)
+
+# Priority steps of the Redis broker, lower values are consumed first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 3
+PRIORITY_BACKFILL = 9
+
+INTERACTIVE_KEY = "priority:interactive"
+
+
+def mark_interactive() -> None:
+    """Note that a reader is waiting on work, for the next `hold` seconds"""
+    cache.set(INTERACTIVE_KEY, True, timeout=settings.CRAWLER_PRIORITY["hold"])
+
+
+def interactive_waiting() -> bool:
+    return bool(cache.get(INTERACTIVE_KEY))
+
+
+def throttle_backfill() -> float:
+    """
+    Hold a background sweep back while reader-triggered work is waiting
+    Gives up after `max_pause` seconds so that a busy reader can not stall sweeps forever
+    Returns the seconds spent waiting
+    """
+    config = settings.CRAWLER_PRIORITY
+    started = time.monotonic()
+    while interactive_waiting():
+        if (waited := time.monotonic() - started) >= config["max_pause"]:
+            logger.warning(f"Resume backfill after waiting {waited:.0f}s")
+            break
+        time.sleep(config["poll"])
+    return time.monotonic() - started
@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import random
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from io import BytesIO
+from logging import getLogger
+
+from aiohttp import web
+from PIL import Image as PILImage
+
+from apps import tasks
+from apps.models import CrawlState, Episode
+from apps.runtime import run_async
+from apps.services import ImageExtractor
+from apps.transport import TokenBucket
+
+logger = getLogger(__name__)
+
+# Markup of the recorded pages in apps/testdata/pages, reduced to what the crawler reads
+LISTING_PAGE = """<!DOCTYPE html>
+<html lang="zh-CN"><head><meta charset="UTF-8"><title>漫画分类 - 第{page}页</title></head>
+<body><div class="cate-comic-list clearfix">{items}</div>
+<div class="pagination"><a class="end" href="{origin}/index.php/category/page/{pages}">{pages}</a></div>
+</body></html>"""
+LISTING_ITEM = """
+<div class="common-comic-item">
+    <a class="cover" href="{origin}/index.php/comic/{book}">
+        <img class="lazy" src="/static/images/loading.gif" data-original="{origin}/covers/{book}.jpg" alt="book {book}">
+    </a>
+    <p class="comic__title"><a href="{origin}/index.php/comic/{book}">book {book}</a></p>
+    <p class="comic-update">更新至：<a href="{origin}/index.php/chapter/{latest}">第{episodes}话</a></p>
+</div>"""
+BOOK_PAGE = """<!DOCTYPE html>
+<html lang="zh-CN"><head><meta charset="UTF-8"><title>book {book}</title></head>
+<body><div class="de-info__box">
+<div class="comic-status">
+    <span class="text">标签：<a href="/index.php/category/tags/1">tag {tag}</a></span>
+    <span class="text">状态：<b>连载中</b></span>
+    <span class="text">人气：<b>{hot} 热度</b></span>
+</div>
+<div class="comic-intro"><p class="intro-title">作品简介</p><p class="intro-author">作者</p><p class="intro-total">book {book}</p></div>
+</div>
+<ul class="chapter__list-box clearfix">{items}</ul>
+</body></html>"""
+BOOK_ITEM = """
+<li class="j-chapter-item"><a class="j-chapter-link" href="{origin}/index.php/chapter/{episode}">第{number}话 </a></li>"""
+CHAPTER_PAGE = """<!DOCTYPE html>
+<html lang="zh-CN"><head><meta charset="UTF-8"><title>chapter {episode}</title></head>
+<body><div class="rd-article-wr clearfix">{items}</div></body></html>"""
+CHAPTER_ITEM = """
+<div class="rd-article__pic hide" data-pid="{image}" data-index="{index}"><img class="lazy-read" src="/static/images/loading.gif" data-original="{origin}/images/{image}.jpg"></div>"""
+
+
+@dataclass
+class ReplaySite:
+    """
+    Stand-in for the comic site, serving pages in the recorded markup
+    Books, chapters and images are numbered so that every URL can be rendered on demand
+    """
+
+    pages: int = 10
+    books_per_page: int = 20
+    episodes: int = 5
+    images: int = 20
+    image_size: tuple = (720, 1000)
+    latency: float = 0
+    page_error_rate: float = 0
+    image_error_rate: float = 0
+    seed: int = None
+    origin: str = ""
+    served: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.random = random.Random(self.seed)
+        buffer = BytesIO()
+        PILImage.effect_noise(self.image_size, 32).convert("RGB").save(
+            buffer, format="JPEG", quality=85
+        )
+        self.image = buffer.getvalue()
+
+    def application(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/index.php/category/page/{page:\\d+}", self.listing)
+        app.router.add_get("/index.php/comic/{book:\\d+}", self.book)
+        app.router.add_get("/index.php/chapter/{episode:\\d+}", self.chapter)
+        app.router.add_get("/{kind:covers|images}/{key:\\d+}.jpg", self.picture)
+        return app
+
+    async def delay(self, kind: str, error_rate: float) -> bool:
+        """Simulate latency, and tell whether the request should fail"""
+        self.served[kind] = self.served.get(kind, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency * self.random.uniform(0.5, 1.5))
+        return self.random.random() < error_rate
+
+    async def page(self, request, kind: str, html: str) -> web.Response:
+        if await self.delay(kind, self.page_error_rate):
+            return web.Response(status=503)
+        etag = f'"{hashlib.sha1(html.encode()).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(text=html, content_type="text/html", headers={"ETag": etag})
+
+    async def listing(self, request) -> web.Response:
+        page = int(request.match_info["page"])
+        items = ""
+        if page <= self.pages:
+            first = (page - 1) * self.books_per_page + 1
+            items = "".join(
+                LISTING_ITEM.format(
+                    origin=self.origin,
+                    book=book,
+                    latest=book * 1000 + self.episodes,
+                    episodes=self.episodes,
+                )
+                for book in range(first, first + self.books_per_page)
+            )
+        html = LISTING_PAGE.format(
+            origin=self.origin, page=page, pages=self.pages, items=items
+        )
+        return await self.page(request, "listing", html)
+
+    async def book(self, request) -> web.Response:
+        book = int(request.match_info["book"])
+        items = "".join(
+            BOOK_ITEM.format(
+                origin=self.origin, episode=book * 1000 + number, number=number
+            )
+            for number in range(1, self.episodes + 1)
+        )
+        html = BOOK_PAGE.format(book=book, tag=book % 7, hot=book * 10, items=items)
+        return await self.page(request, "book", html)
+
+    async def chapter(self, request) -> web.Response:
+        episode = int(request.match_info["episode"])
+        items = "".join(
+            CHAPTER_ITEM.format(
+                origin=self.origin, image=episode * 1000 + index, index=index
+            )
+            for index in range(self.images)
+        )
+        html = CHAPTER_PAGE.format(episode=episode, items=items)
+        return await self.page(request, "chapter", html)
+
+    async def picture(self, request) -> web.Response:
+        if await self.delay("image", self.image_error_rate):
+            return web.Response(status=503)
+        # Bytes after the end of the JPEG are ignored by decoders but give every image its own hash
+        content = self.image + request.match_info["key"].encode()
+        return web.Response(body=content, content_type="image/jpeg")
+
+
+@contextmanager
+def serve(site: ReplaySite, host: str = "127.0.0.1", port: int = 0):
+    """Run the site on a background thread for the duration of the block"""
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(site.application())
+
+    async def start():
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        bound_host, bound_port = runner.addresses[0][:2]
+        site.origin = f"http://{bound_host}:{bound_port}"
+
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(start(), loop).result()
+    try:
+        yield site
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+@dataclass
+class Stage:
+    name: str
+    count: int = 0
+    unit: str = "pages"
+    seconds: float = 0
+
+    @property
+    def rate(self) -> float:
+        return self.count / self.seconds if self.seconds else 0
+
+    def __str__(self):
+        return f"{self.name:<10} {self.count:>7} {self.unit:<7} {self.seconds:>8.2f}s {self.rate:>9.1f} {self.unit}/s"
+
+
+@contextmanager
+def pointed_at(extractor: ImageExtractor, origin: str, rate_limit: float):
+    """Crawl `origin` at `rate_limit` pages/s for the duration of the block"""
+    saved = extractor.origin, extractor.rate_limit
+    extractor.origin, extractor.rate_limit = origin, TokenBucket(rate_limit)
+    try:
+        yield
+    finally:
+        extractor.origin, extractor.rate_limit = saved
+
+
+def run_pipeline(origin: str, rate_limit: float = 0) -> list:
+    """
+    Drive find_books, find_episodes, find_images and convert_to_pdf one stage after
+    the other against a replay site, with the current database and storage settings
+    Episodes are rendered when their completion queued convert_to_pdf
+    Returns the timing of each stage
+    """
+    extractor = ImageExtractor()
+    stages = []
+    # Follow-up tasks of each stage, run by the next one rather than by workers
+    queued = {
+        task.name: []
+        for task in [tasks.find_episodes, tasks.find_images, tasks.convert_to_pdf]
+    }
+    books, episodes, completed = queued.values()
+
+    def timed(stage: Stage, run, calls):
+        started = time.perf_counter()
+        for args, kwargs in calls:
+            run(*args, **kwargs)
+        stage.seconds = time.perf_counter() - started
+        stages.append(stage)
+        logger.info(str(stage))
+
+    def collect(task, args, kwargs):
+        queued[task.name].append((args, kwargs))
+
+    with pointed_at(extractor, origin, rate_limit), tasks.dispatch_to(collect):
+        listing = Stage("listing")
+        timed(listing, lambda: tasks.find_books("full"), [((), {})])
+        listing.count = CrawlState.objects.get(name="books").last_page
+        timed(Stage("books", len(books)), tasks.find_episodes, books)
+        chapters = Stage("chapters", len(episodes))
+        timed(chapters, tasks.find_images, list(episodes))
+        # Workers keep their pooled connections, but this site goes away after the run
+        run_async(extractor.close())
+
+    images = Stage(
+        "images",
+        sum(
+            Episode.objects.filter(
+                pk__in=[args[0] for args, _ in episodes]
+            ).values_list("downloaded_image_count", flat=True)
+        ),
+        "images",
+        chapters.seconds,
+    )
+    stages.append(images)
+    timed(Stage("pdf", len(completed), "pdfs"), tasks.convert_to_pdf, completed)
+    return stages
+
+
+def peak_memory_mb() -> float:
+    """Peak resident set size of this process, in MiB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
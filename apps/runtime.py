@@ -0,0 +1,91 @@
+import asyncio
+import os
+import threading
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from celery.concurrency import get_implementation, prefork
+from celery.signals import (
+    worker_init,
+    worker_process_init,
+    worker_process_shutdown,
+    worker_shutdown,
+)
+from django.db import connections
+
+from apps.executors import share_cpus, shutdown_executors
+from apps.services import ImageExtractor
+from apps.tools import preload
+
+# One loop per worker thread: a prefork child has one, a threads pool one per thread
+_local = threading.local()
+_loops = set()
+_loops_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """The event loop of this worker thread, created on first use and kept for its lifetime"""
+    loop = getattr(_local, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = _local.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        with _loops_lock:
+            _loops.add(loop)
+    return loop
+
+
+async def _run_task(coro):
+    """
+    Await a task coroutine with ORM calls of its own
+    sync_to_async and the async ORM would otherwise run every task of a threads pool
+    on the one thread asgiref keeps per process, one query at a time on one shared
+    connection. Each task gets a thread, and a connection closed when it ends
+    """
+    async with ThreadSensitiveContext():
+        try:
+            return await coro
+        finally:
+            await sync_to_async(connections.close_all)()
+
+
+def run_async(coro):
+    """Run a task coroutine on the long-lived loop, reusing its pooled HTTP session"""
+    return get_loop().run_until_complete(_run_task(coro))
+
+
+@worker_init.connect
+def preload_libraries(sender=None, **kwargs):
+    # Imported once in the parent, pool processes recycled after a few tasks inherit them
+    # Thread pools share one copy anyway, only the render worker forks
+    if sender and issubclass(get_implementation(sender.pool_cls), prefork.TaskPool):
+        preload()
+        # Each pool process starts its own render threads, see executors.pool_size
+        share_cpus(sender.concurrency or os.cpu_count() or 1)
+
+
+@worker_process_init.connect
+def reset_loop(**kwargs):
+    # A forked pool process must not drive the loop or the sessions of its parent
+    global _local
+    _local = threading.local()
+    _loops.clear()
+
+
+@worker_process_shutdown.connect
+def close_loop(**kwargs):
+    with _loops_lock:
+        loops = list(_loops)
+        _loops.clear()
+    # A worker that never crawled has no extractor and no transport to close
+    extractor = ImageExtractor._instance
+    for loop in loops:
+        if not loop.is_closed() and not loop.is_running():
+            if extractor is not None:
+                loop.run_until_complete(extractor.close())
+            loop.close()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def close_executors(**kwargs):
+    # Pool processes exit without running atexit hooks, let renders in flight finish
+    shutdown_executors()
@@ -1,10 +1,33 @@
 import asyncio
+import random
+from collections import deque
+from contextlib import AsyncExitStack, asynccontextmanager
+from io import BytesIO
+from itertools import islice
+from logging import getLogger
 from typing import AsyncGenerator, List
 
-from fake_useragent import UserAgent
-from requests_html import HTML, AsyncHTMLSession
+from django.conf import settings
+from lxml.etree import _Element
 
-from apps.tools import curl
+from apps.extractors import (
+    parse_book_details,
+    parse_chapters,
+    parse_document,
+    parse_listing,
+    parse_max_page,
+    parse_pages,
+)
+from apps.page_cache import NOT_MODIFIED, get_page_cache
+from apps.storage import BlobInfo, get_blob_store
+from apps.transport import Response, TokenBucket, TransportError, build_transport
+
+logger = getLogger(__name__)
+
+# Statuses that usually mean the pooled client was challenged rather than a real error
+FALLBACK_STATUSES = {403, 429, 503}
+# Image download statuses worth another attempt, on top of every 5xx
+RETRY_STATUSES = {408, 425, 429}
 
 
 class ImageExtractor:
@@ -20,119 +43,289 @@ class ImageExtractor:
         """Initialize ImageExtractor with necessary attributes"""
         if not hasattr(self, "_initialized"):
             self._initialized = True
-            self.origin = "https://se8.us"
-            self.cli = AsyncHTMLSession()
-            self.cli.headers.update(
-                {
-                    "User-Agent": UserAgent(os=["windows"], platforms="pc").chrome,
-                    "Accept-Language": "en-GB,en;q=0.9,zh-CN;q=0.8,zh;q=0.7",
-                    "Cache-Control": "max-age=0",
-                    "Dnt": "1",
-                    "Priority": "u=0, i",
-                }
+            self.origin = settings.CRAWLER_ORIGIN
+            headers = {
+                "User-Agent": self.user_agent(),
+                "Accept-Language": "en-GB,en;q=0.9,zh-CN;q=0.8,zh;q=0.7",
+                "Cache-Control": "max-age=0",
+                "Dnt": "1",
+                "Priority": "u=0, i",
+            }
+            config = settings.CRAWLER_HTTP
+            self.transport = build_transport(config, headers)
+            self.fallback = (
+                build_transport(config["FALLBACK"], headers)
+                if config.get("FALLBACK")
+                else None
             )
             self.max_page = 2000
+            self.page_cache = get_page_cache()
+            self.page_concurrency = settings.CRAWLER_PAGE_CONCURRENCY
+            self.rate_limit = TokenBucket(*settings.CRAWLER_RATE_LIMIT)
+            download = settings.CRAWLER_DOWNLOAD
+            self.download_concurrency = download["concurrency"]
+            self.download_retries = download["retries"]
+            self.download_backoff = download["backoff"]
+            self.download_max_backoff = download["max_backoff"]
+            self.download_timeout = download["timeout"]
+            self.download_max_bytes = download["max_bytes"]
+            self.download_chunk_size = download["chunk_size"]
 
-    async def _send_request(self, url: str, use_curl: bool = True) -> object:
-        """Send a GET request to the given URL"""
-        url = url.strip()
+    @staticmethod
+    def user_agent() -> str:
+        """CRAWLER_USER_AGENT, or a desktop Chrome one picked by fake_useragent"""
+        if settings.CRAWLER_USER_AGENT:
+            return settings.CRAWLER_USER_AGENT
+        from fake_useragent import UserAgent
+
+        return UserAgent(os=["windows"], platforms="pc").chrome
 
-        if use_curl:
-            resp = await asyncio.to_thread(curl, url)
-            return HTML(html=resp)
+    async def close(self):
+        """Release pooled connections of the current event loop"""
+        await self.transport.close()
+        if self.fallback:
+            await self.fallback.close()
 
-        return await self.cli.get(url=url, headers={"referer": "https://se8.us/"})
+    async def _fetch(self, url: str, headers: dict = None) -> Response:
+        """GET through the pooled transport, retrying once through the fallback"""
+        url = url.strip()
+        try:
+            resp = await self.transport.get(url, headers=headers)
+            if resp.status not in FALLBACK_STATUSES or not self.fallback:
+                return resp
+        except TransportError:
+            if not self.fallback:
+                raise
+        return await self.fallback.get(url, headers=headers)
+
+    async def _send_request(self, url: str, conditional: bool = False) -> _Element:
+        """
+        Fetch the page at the given URL and parse it
+        A conditional request returns NOT_MODIFIED when the page did not change
+        Raises TransportError, an unreachable page is not an empty one
+        """
+        url = url.strip()
+        entry = await self.page_cache.get(url) if conditional else None
+        await self.rate_limit.acquire()
+        try:
+            resp = await self._fetch(
+                url, headers=self.page_cache.conditional_headers(entry)
+            )
+        except TransportError as e:
+            logger.error(str(e))
+            raise
+        if conditional and not await self.page_cache.is_modified(url, entry, resp):
+            return NOT_MODIFIED
+        return parse_document(resp.content)
 
     async def get_max_page(self) -> int:
         """Fetch the maximum page number"""
         try:
             resp = await self._send_request(f"{self.origin}/index.php/category/page/1")
-            self.max_page = int(resp.xpath('//a[@class="end"]/@href')[0].split("/")[-1])
+            if max_page := parse_max_page(resp):
+                self.max_page = max_page
             print(f"Max page: {self.max_page}")
         except Exception as e:
             print(e)
 
-    async def get_books(self, target_page: int = None) -> AsyncGenerator[str, None]:
-        """Fetch books from the website"""
+    async def get_book_pages(
+        self, target_page: int = None, conditional: bool = False, start_page: int = 1
+    ) -> AsyncGenerator[List[dict], None]:
+        """
+        Fetch books from the website, one listing page at a time
+        With `conditional`, unchanged pages are yielded as NOT_MODIFIED, and the others
+        must be confirmed with confirm_page once processed
+        """
 
         page_range = (
-            range(1, self.max_page + 1)
+            range(start_page, self.max_page + 1)
             if not target_page
             else range(target_page, target_page + 1)
         )
 
-        for page in page_range:
-            print(f"Fetching page {page}")
-            resp = await self._send_request(
-                f"{self.origin}/index.php/category/page/{page}"
-            )
-            if not (books := resp.xpath("//div[@class='common-comic-item']")):
-                break
+        # Keep up to page_concurrency pages in flight but yield them in order
+        pages = iter(page_range)
+        pending = deque(
+            asyncio.ensure_future(self._get_listing(page, conditional))
+            for page in islice(pages, self.page_concurrency)
+        )
+        try:
+            while pending:
+                if not (books := await pending.popleft()):
+                    break
+                if (page := next(pages, None)) is not None:
+                    pending.append(
+                        asyncio.ensure_future(self._get_listing(page, conditional))
+                    )
+                yield books
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def listing_url(self, page: int) -> str:
+        return f"{self.origin}/index.php/category/page/{page}"
+
+    async def confirm_page(self, url: str) -> None:
+        """Skip the page on the next conditional crawl unless it changes, see PageCache"""
+        await self.page_cache.commit(url.strip())
 
+    async def _get_listing(self, page: int, conditional: bool = False) -> List[dict]:
+        """Fetch and parse one listing page"""
+        print(f"Fetching page {page}")
+        url = self.listing_url(page)
+        if (resp := await self._send_request(url, conditional)) is NOT_MODIFIED:
+            return NOT_MODIFIED
+        books = parse_listing(resp)
+        if not books and conditional:
+            # Never remember the end of the listing, it must be seen as empty again
+            await self.page_cache.delete(url)
+        return books
+
+    async def get_books(self, target_page: int = None) -> AsyncGenerator[dict, None]:
+        """Fetch books from the website"""
+        async for books in self.get_book_pages(target_page):
             for book in books:
-                yield {
-                    "raw_url": (url := book.xpath('//a[@class="cover"]/@href')[0]),
-                    "id": url.split("/")[-1],
-                    "title": book.xpath('//p[@class="comic__title"]')[0].text,
-                    "image_url": book.xpath("//img/@data-original")[0],
-                    "current": book.xpath("//p[@class='comic-update']/a/text()")[0],
-                }
-
-    async def get_episodes(self, url: str) -> AsyncGenerator[str, None]:
-        """Fetch episodes for a specific book"""
-        resp = await self._send_request(url)
-        if not (
-            episodes := resp.xpath("//ul[@class='chapter__list-box clearfix']//li")
-        ):
-            return
+                yield book
 
-        yield {
-            "tags": resp.xpath("//div[@class='comic-status']//a/text()"),
-            "hot": float(
-                resp.xpath("//div[@class='comic-status']/span[3]/b/text()")[0].split()[
-                    0
-                ]
-            ),
-            "description": resp.xpath("//div[@class='comic-intro']//p")[2].text,
-        }
+    async def get_episodes(
+        self, url: str, conditional: bool = False
+    ) -> AsyncGenerator[str, None]:
+        """
+        Fetch episodes for a specific book, nothing if the page did not change
+        With `conditional`, the page must be confirmed with confirm_page once processed
+        """
+        if (resp := await self._send_request(url, conditional)) is NOT_MODIFIED:
+            return
+        if not (episodes := parse_chapters(resp)):
+            if conditional:
+                await self.page_cache.delete(url.strip())
+            return
 
+        yield parse_book_details(resp)
         for episode in episodes:
-            yield {
-                "raw_url": (url := episode.xpath("//a/@href")[0]),
-                "id": url.split("/")[-1],
-                "title": episode.text,
-            }
+            yield episode
 
     async def get_images(self, url: str) -> AsyncGenerator:
         """Fetch images for a specific episode"""
-        resp = await self._send_request(url)
-        if not (images := resp.xpath("//div[@class='rd-article__pic hide']")):
-            return
+        for image in parse_pages(await self._send_request(url)):
+            yield image
 
-        for image_div in images:
-            yield {
-                "id": image_div.xpath("//@data-pid")[0],
-                "index": image_div.xpath("//@data-index")[0],
-                "raw_url": image_div.xpath("//img/@data-original")[0],
-            }
+    @asynccontextmanager
+    async def _stream(self, url: str, headers: dict = None):
+        """Streaming counterpart of _fetch, with the same fallback rules"""
+        url = url.strip()
+        async with AsyncExitStack() as stack:
+            try:
+                resp = await stack.enter_async_context(
+                    self.transport.stream(url, headers=headers)
+                )
+            except TransportError:
+                if not self.fallback:
+                    raise
+                resp = None
+            if resp is None or (resp.status in FALLBACK_STATUSES and self.fallback):
+                await stack.aclose()
+                resp = await stack.enter_async_context(
+                    self.fallback.stream(url, headers=headers)
+                )
+            yield resp
+
+    async def _download_once(self, url: str, open_sink, finish):
+        """
+        Stream one image into a sink, raising TransportError for transient failures
+        Returns None without reading the body when the response is not an acceptable image
+        """
+        async with self._stream(url, headers={"referer": f"{self.origin}/"}) as resp:
+            if resp.status in RETRY_STATUSES or resp.status >= 500:
+                raise TransportError(f"GET {url} returned {resp.status}")
+            if not resp.ok:
+                return None
+            content_type = resp.headers.get("Content-Type", "")
+            if not content_type.startswith("image"):
+                logger.warning(f"Reject {url}: unexpected content type {content_type}")
+                return None
+            if int(resp.headers.get("Content-Length") or 0) > self.download_max_bytes:
+                logger.warning(f"Reject {url}: larger than {self.download_max_bytes}")
+                return None
+
+            with open_sink() as sink:
+                received = 0
+                async for chunk in resp.iter_chunks(self.download_chunk_size):
+                    if (received := received + len(chunk)) > self.download_max_bytes:
+                        logger.warning(
+                            f"Reject {url}: larger than {self.download_max_bytes}"
+                        )
+                        return None
+                    sink.write(chunk)
+                return finish(sink, content_type.split(";")[0])
+
+    async def _download_with_retry(self, url: str, open_sink, finish):
+        """Download one image with exponential backoff and jitter between attempts"""
+        for attempt in range(self.download_retries + 1):
+            try:
+                return await asyncio.wait_for(
+                    self._download_once(url, open_sink, finish), self.download_timeout
+                )
+            except (TransportError, asyncio.TimeoutError) as e:
+                if attempt == self.download_retries:
+                    logger.error(f"Giving up {url} after {attempt + 1} attempts: {e!r}")
+                    return None
+                delay = min(
+                    self.download_max_backoff, self.download_backoff * 2**attempt
+                )
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
 
     async def download_image(self, url: str, key: str = None) -> str:
-        """Download and encode image from the given URL"""
-        resp = await self._send_request(url, use_curl=False)
-        if not resp.ok:
-            return ""
-        if not resp.headers.get("Content-Type", "").startswith("image"):
+        """Download image from the given URL into memory"""
+        if not (
+            content := await self._download_with_retry(
+                url, BytesIO, lambda sink, mime: sink.getvalue()
+            )
+        ):
             return ""
         if key:
-            return [key, resp.content]
-        return resp.content
+            return [key, content]
+        return content
+
+    async def download_image_to_store(self, url: str) -> BlobInfo | None:
+        """Stream image from the given URL straight into the blob store"""
+        return await self._download_with_retry(
+            url, get_blob_store().open_writer, lambda sink, mime: sink.commit(mime)
+        )
+
+    async def iter_images(self, items, to_store: bool = True) -> AsyncGenerator:
+        """
+        Download [key, url] items with at most download_concurrency in flight
+        Yields [key, result] as each one completes, result is empty on failure
+        Results are BlobInfo of the stored image, or the raw bytes without `to_store`
+        """
+        semaphore = asyncio.Semaphore(self.download_concurrency)
+        download = self.download_image_to_store if to_store else self.download_image
+
+        async def worker(key, url):
+            async with semaphore:
+                return [key, await download(url)]
+
+        tasks = [asyncio.ensure_future(worker(key, url)) for key, url in items]
+        try:
+            for future in asyncio.as_completed(tasks):
+                yield await future
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
     async def get_images_concurrently(self, urls: List[str]) -> List[str]:
-        """Fetch images concurrently"""
-        tasks = [self.download_image(url) for url in urls]
-        return await asyncio.gather(*tasks)
+        """Fetch images concurrently, in the order of the given URLs"""
+        results = dict(
+            [item async for item in self.iter_images(enumerate(urls), to_store=False)]
+        )
+        return [results[index] or "" for index in range(len(urls))]
 
     async def get_images_concurrently_with_id(self, items: dict) -> List[str]:
         """Fetch images concurrently"""
-        tasks = [self.download_image(url=url, key=key) for (key, url) in items]
-        return await asyncio.gather(*tasks)
+        return [
+            item if item[1] else ""
+            async for item in self.iter_images(items, to_store=False)
+        ]
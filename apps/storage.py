@@ -0,0 +1,202 @@
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+from functools import lru_cache
+from logging import getLogger
+from pathlib import Path
+from typing import BinaryIO
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = getLogger(__name__)
+
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
+
+def hash_content(content: bytes) -> str:
+    """Return the hex SHA-256 digest used as the blob key"""
+    return hashlib.sha256(content).hexdigest()
+
+
+def guess_mime(content: bytes) -> str:
+    """Guess the image MIME type from the leading magic bytes"""
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime in IMAGE_SIGNATURES:
+        if content.startswith(signature):
+            return mime
+    return ""
+
+
+@dataclass(frozen=True)
+class BlobInfo:
+    digest: str
+    size: int
+    mime: str = ""
+
+
+class BlobWriter:
+    """
+    Receive a blob chunk by chunk, hashing it on the fly
+    Nothing is stored unless commit() is called before the writer is closed
+    """
+
+    def __init__(self, store: "BlobStore"):
+        self.store = store
+        self.hasher = hashlib.sha256()
+        self.head = b""
+        self.size = 0
+        self._chunks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, chunk: bytes) -> None:
+        self.hasher.update(chunk)
+        if len(self.head) < 16:
+            self.head += chunk[:16]
+        self.size += len(chunk)
+        self._write(chunk)
+
+    def commit(self, mime: str = "") -> BlobInfo:
+        digest = self.hasher.hexdigest()
+        self._commit(digest)
+        return BlobInfo(digest, self.size, guess_mime(self.head) or mime)
+
+    def close(self) -> None:
+        self._chunks = []
+
+    def _write(self, chunk: bytes) -> None:
+        self._chunks.append(chunk)
+
+    def _commit(self, digest: str) -> None:
+        # Stores without a streaming path still get the whole blob at once
+        self.store.save(b"".join(self._chunks))
+
+
+class FileSystemBlobWriter(BlobWriter):
+    """Spool chunks to a temp file next to the blobs, then rename it into place"""
+
+    def __init__(self, store: "FileSystemBlobStore"):
+        super().__init__(store)
+        incoming = store.location / ".incoming"
+        incoming.mkdir(parents=True, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=incoming)
+        self.file = os.fdopen(fd, "wb")
+
+    def _write(self, chunk: bytes) -> None:
+        self.file.write(chunk)
+
+    def _commit(self, digest: str) -> None:
+        self.file.close()
+        path = self.store.path(digest)
+        if path.is_file():
+            # Same bytes are already stored, share the existing blob
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(self.tmp_path, path)
+
+    def close(self) -> None:
+        self.file.close()
+        Path(self.tmp_path).unlink(missing_ok=True)
+
+
+class BlobStore:
+    """Interface of a content-addressed store for raw image bytes"""
+
+    def save(self, content: bytes) -> str:
+        """Store the content and return its digest"""
+        raise NotImplementedError
+
+    def open(self, digest: str) -> BinaryIO:
+        """Open the blob for binary reading"""
+        raise NotImplementedError
+
+    def exists(self, digest: str) -> bool:
+        raise NotImplementedError
+
+    def delete(self, digest: str) -> None:
+        raise NotImplementedError
+
+    def read(self, digest: str) -> bytes:
+        """Read the whole blob into memory"""
+        with self.open(digest) as f:
+            return f.read()
+
+    def open_writer(self) -> BlobWriter:
+        """Start writing a blob whose digest is known once it is complete"""
+        return BlobWriter(self)
+
+
+class FileSystemBlobStore(BlobStore):
+    """Keep blobs as sharded, hash-named files, e.g. <location>/ab/cd/abcd..."""
+
+    def __init__(
+        self, location: str | Path, shard_depth: int = 2, shard_width: int = 2
+    ):
+        self.location = Path(location)
+        self.shard_depth = shard_depth
+        self.shard_width = shard_width
+
+    def path(self, digest: str) -> Path:
+        shards = [
+            digest[i * self.shard_width : (i + 1) * self.shard_width]
+            for i in range(self.shard_depth)
+        ]
+        return self.location.joinpath(*shards, digest)
+
+    def save(self, content: bytes) -> str:
+        digest = hash_content(content)
+        path = self.path(digest)
+        if path.is_file():
+            # Same bytes are already stored, share the existing blob
+            return digest
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a sibling temp file first so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        return digest
+
+    def open(self, digest: str) -> BinaryIO:
+        return self.path(digest).open("rb")
+
+    def open_writer(self) -> BlobWriter:
+        return FileSystemBlobWriter(self)
+
+    def exists(self, digest: str) -> bool:
+        return self.path(digest).is_file()
+
+    def delete(self, digest: str) -> None:
+        self.path(digest).unlink(missing_ok=True)
+
+
+@lru_cache(maxsize=None)
+def get_blob_store() -> BlobStore:
+    """Build the blob store configured by settings.BLOB_STORE"""
+    config = settings.BLOB_STORE
+    return import_string(config["BACKEND"])(**config.get("OPTIONS", {}))
+
+
+@receiver(setting_changed)
+def reset_blob_store(setting, **kwargs):
+    if setting == "BLOB_STORE":
+        get_blob_store.cache_clear()
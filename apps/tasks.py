@@ -1,124 +1,347 @@
 import asyncio
-import base64
-from contextlib import contextmanager
+from contextlib import aclosing, contextmanager
+from datetime import timedelta
 from logging import getLogger
 
 from asgiref.sync import sync_to_async
-from celery import shared_task
+from celery import chain, shared_task
+from celery.result import AsyncResult
 from celery_once import QueueOnce
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.files.base import ContentFile
-from django.db.models import Exists, OuterRef, Q
-
-from apps.models import Book, Episode, Image, Tag
+from django.utils import timezone
+
+from apps import frontier
+from apps.models import Book, CrawlState, Episode, FrontierEntry, Image
+from apps.page_cache import NOT_MODIFIED
+from apps.pdf import images_to_pdf
+from apps.persistence import (
+    changed_books,
+    complete_episodes,
+    keyset_rows,
+    outdated_books,
+    record_episode_failure,
+    reuse_images,
+    save_downloaded_images,
+    update_book_details,
+    upsert_books,
+    upsert_episodes,
+    upsert_images,
+)
+from apps.priority import (
+    PRIORITY_BACKFILL,
+    PRIORITY_INTERACTIVE,
+    mark_interactive,
+    throttle_backfill,
+)
+from apps.runtime import run_async
 from apps.services import ImageExtractor
-from apps.tools import images_to_long_image, long_image_to_pdf
+from apps.storage import get_blob_store
+from apps.thumbnails import get_thumbnail_cache
+from apps.tools import chunked
 from SE8 import celery_app
 
 logger = getLogger("celery")
 
 
+async def reuse_known_images(model, items: list, force: bool = False) -> list:
+    """Point rows at blobs already downloaded for the same URL, return the rest"""
+    if force or not items:
+        return items
+
+    known = await sync_to_async(model.known_images)(
+        [url for _, url in items], exclude_pks=[key for key, _ in items]
+    )
+    pending, reused = [], {}
+    for key, url in items:
+        if url in known:
+            reused.setdefault(url, []).append(key)
+        else:
+            pending.append([key, url])
+
+    if reused:
+        await sync_to_async(reuse_images)(
+            model, [(keys, known[url]) for url, keys in reused.items()]
+        )
+        logger.info(f"Reuse {len(items) - len(pending)} known {model.__name__} images")
+    return pending
+
+
+async def download_and_save(model, items: list, force: bool = False) -> int:
+    """
+    Download [key, url] items, storing each image as soon as it arrives
+    Episodes left with missing images count a failed try, dead image URLs end them
+    as failed instead of keeping them listed forever
+    """
+    items = await reuse_known_images(model, items, force=force)
+    saved, failed = 0, []
+    async for key, content in ImageExtractor().iter_images(items):
+        if not content:
+            failed.append(key)
+            continue
+        await sync_to_async(save_downloaded_images)(model, [[key, content]])
+        saved += 1
+    if failed:
+        logger.warning(f"Failed to download {len(failed)} {model.__name__} images")
+    if failed and model is Image:
+        async for episode_id in (
+            Image.objects.filter(pk__in=failed, image_hash="")
+            .values_list("episode_id", flat=True)
+            .distinct()
+        ):
+            await fail_attempt(episode_id)
+    return saved
+
+
+# Callback receiving the follow-up tasks of the crawl instead of the broker
+_dispatcher = None
+
+
 @contextmanager
-def async_event_loop():
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+def dispatch_to(callback):
+    """
+    Hand the follow-up tasks queued within the block to callback(task, args, kwargs)
+    rather than to the broker, see replay.run_pipeline
+    """
+    global _dispatcher
+    previous, _dispatcher = _dispatcher, callback
     try:
-        yield loop
+        yield
     finally:
-        loop.close()
+        _dispatcher = previous
 
 
-async def process_books():
-    async for data in ImageExtractor().get_books():
-        current_episode = data.pop("current", None)
-        book, created = await sync_to_async(Book.objects.update_or_create)(
-            id=data.pop("id"),
-            defaults=data,
-        )
-        if created or await sync_to_async(book.is_outdated)(
-            episodes_title=current_episode
-        ):
-            logger.info(f"Find book: {book.title}")
-            find_episodes.apply_async(args=[book.id], countdown=5)
+def dispatch(task, **options) -> None:
+    """Queue a follow-up task with apply_async options, see dispatch_to"""
+    if _dispatcher:
+        _dispatcher(task, options.get("args", ()), options.get("kwargs") or {})
+    else:
+        task.apply_async(**options)
 
 
-@celery_app.task(base=QueueOnce, once={"graceful": True})
-def find_books():
+async def render_completed(episode_ids) -> None:
+    """Queue the PDF of episodes whose last image just arrived"""
+    for episode_id in await sync_to_async(complete_episodes)(episode_ids):
+        logger.info(f"Episode {episode_id} is complete")
+        dispatch(convert_to_pdf, args=[episode_id])
+
+
+async def fail_attempt(episode_id) -> None:
+    """Count a failed try of the current stage of an episode"""
+    if await sync_to_async(record_episode_failure)(
+        episode_id, settings.CRAWLER_PIPELINE_MAX_ATTEMPTS
+    ):
+        logger.error(f"Episode {episode_id} failed")
+
+
+async def process_books(mode: str = CrawlState.MODE_INCREMENTAL):
+    """
+    Walk the listing, newest updates first
+    An incremental crawl stops after CRAWLER_INCREMENTAL_STOP_PAGES pages in a row
+    without changed books, a full crawl walks every page
+    A full crawl that did not finish is resumed after its last crawled page, an
+    incremental one starts over, the books updated since are on the first pages
+    An incremental crawl run in between leaves the state of the full one alone
+    """
+    incremental = mode == CrawlState.MODE_INCREMENTAL
+    state, _ = await CrawlState.objects.aget_or_create(name="books")
+    full_unfinished = (
+        state.started_at
+        and not state.finished_at
+        and state.mode == CrawlState.MODE_FULL
+    )
+    record = not (incremental and full_unfinished)
+    if full_unfinished and not incremental:
+        start_page = await sync_to_async(frontier.resume_page)()
+        logger.info(f"Resume {mode} crawl at page {start_page}")
+    elif record:
+        await sync_to_async(frontier.reset)(FrontierEntry.KIND_LISTING)
+        start_page, state.changed_books = 1, 0
+        state.mode, state.started_at, state.finished_at = mode, timezone.now(), None
+    else:
+        start_page = 1
+        logger.info("Full crawl unfinished, keep its checkpoint")
+    page = start_page - 1
+    if record:
+        state.last_page = page
+        await state.asave()
+
+    quiet_pages = 0
+    extractor = ImageExtractor()
+    async with aclosing(
+        extractor.get_book_pages(conditional=incremental, start_page=start_page)
+    ) as pages:
+        async for books in pages:
+            page += 1
+            changed = set()
+            if books is not NOT_MODIFIED:
+                markers = {book["id"]: book.pop("current", None) for book in books}
+                for book in books:
+                    book["update_marker"] = markers[book["id"]] or ""
+                changed = await sync_to_async(changed_books)(markers)
+                created = await sync_to_async(upsert_books)(books)
+                outdated = await sync_to_async(outdated_books)(markers)
+                found = [
+                    book
+                    for book in books
+                    if book["id"] in created or book["id"] in outdated
+                ]
+                await sync_to_async(frontier.enqueue)(
+                    FrontierEntry.KIND_BOOK,
+                    [[book["id"], book["raw_url"]] for book in found],
+                )
+                for book in found:
+                    logger.info(f"Find book: {book['title']}")
+                    dispatch(
+                        find_episodes,
+                        args=[book["id"]],
+                        kwargs={"from_frontier": True},
+                        countdown=5,
+                    )
+                await extractor.confirm_page(extractor.listing_url(page))
+
+            if record:
+                state.last_page = page
+                state.changed_books += len(changed)
+                await state.asave(update_fields=["last_page", "changed_books"])
+                await sync_to_async(frontier.checkpoint_page)(page)
+            quiet_pages = 0 if changed else quiet_pages + 1
+            if incremental and quiet_pages >= settings.CRAWLER_INCREMENTAL_STOP_PAGES:
+                logger.info(f"No changed books since page {page - quiet_pages}")
+                break
+
+    if record:
+        state.finished_at = timezone.now()
+        await state.asave(update_fields=["finished_at"])
+
+
+@celery_app.task(base=QueueOnce, once={"graceful": True, "keys": []})
+def find_books(mode: str = CrawlState.MODE_INCREMENTAL):
     """
     Find books from the website and create or update Book objects
-    Usage: from apps.tasks import find_books as t;t();
+    Usage: from apps.tasks import find_books as t;t(); t("full");
     """
-    with async_event_loop() as loop:
-        loop.run_until_complete(process_books())
+    run_async(process_books(mode))
 
 
-async def process_episodes(book_id: str):
+async def process_episodes(book_id: str, force: bool = False):
     try:
-        book = await sync_to_async(Book.objects.get)(id=book_id)
+        book = await Book.objects.aget(id=book_id)
     except ObjectDoesNotExist:
         logger.error(f"Book with id {book_id} does not exist.")
         return
 
-    async for data in ImageExtractor().get_episodes(book.raw_url):
+    extractor = ImageExtractor()
+    episodes = []
+    async for data in extractor.get_episodes(book.raw_url, conditional=not force):
         if "tags" in data:
-            for tag in data["tags"]:
-                await sync_to_async(
-                    lambda: book.tags.add(Tag.objects.get_or_create(name=tag)[0])
-                )()
-            book.hot = data["hot"]
-            book.description = data["description"]
-            await sync_to_async(book.save)(update_fields=["hot", "description"])
+            await sync_to_async(update_book_details)(book, **data)
         else:
-            episode, created = await sync_to_async(Episode.objects.update_or_create)(
-                id=data.pop("id"),
-                book=book,
-                defaults=data,
-            )
-            if created:
-                logger.info(f"Find episode: {episode.title}")
-                find_images.apply_async(args=[episode.id], countdown=5)
+            episodes.append(data)
+
+    created = await sync_to_async(upsert_episodes)(book, episodes)
+    found = [
+        episode
+        for episode in episodes
+        if Episode._meta.pk.to_python(episode["id"]) in created
+    ]
+    await sync_to_async(frontier.enqueue)(
+        FrontierEntry.KIND_EPISODE,
+        [[episode["id"], episode["raw_url"]] for episode in found],
+    )
+    for episode in found:
+        logger.info(f"Find episode: {episode['title']}")
+        dispatch(
+            find_images,
+            args=[episode["id"]],
+            kwargs={"from_frontier": True},
+            countdown=5,
+        )
+    await extractor.confirm_page(book.raw_url)
 
 
 @shared_task
-def find_episodes(book_id: str, start_index: int | None = None):
+def find_episodes(
+    book_id: str,
+    start_index: int | None = None,
+    force: bool = False,
+    from_frontier: bool = False,
+):
     """
     Find episodes for a specific book and create or update Episode objects
+    Dispatches of the crawl frontier skip books crawled since, other calls crawl again
     Usage: from apps.models import Book, Episode;from apps.tasks import find_episodes as t;t( Book.objects.first().id );
     """
-    with async_event_loop() as loop:
-        loop.run_until_complete(process_episodes(book_id))
+    with frontier.lease(
+        FrontierEntry.KIND_BOOK, book_id, reopen=not from_frontier
+    ) as leased:
+        if leased:
+            run_async(process_episodes(book_id, force=force))
 
 
 async def process_images(episode_id: str, force: bool = False):
-    episode = await sync_to_async(Episode.objects.get)(pk=episode_id)
+    episode = await Episode.objects.aget(pk=episode_id)
+    images = [data async for data in ImageExtractor().get_images(episode.raw_url)]
+    if not images:
+        await fail_attempt(episode.pk)
+        return
+    created = await sync_to_async(upsert_images)(episode, images)
+
     images_task = []
-    async for data in ImageExtractor().get_images(episode.raw_url):
-        image, created = await sync_to_async(Image.objects.update_or_create)(
-            id=data.pop("id"),
-            episode=episode,
-            defaults=data,
-        )
-        if created or force:
-            images_task.append([image.id, image.raw_url])
-            logger.info(f"Find image: {episode.title} - {image.index}")
+    for data in images:
+        image_id = Image._meta.pk.to_python(data["id"])
+        if image_id in created or force:
+            images_task.append([image_id, data["raw_url"]])
+            logger.info(f"Find image: {episode.title} - {data['index']}")
 
-    downloaded_images = await ImageExtractor().get_images_concurrently_with_id(
-        images_task
-    )
-    for key, image in downloaded_images:
-        image_obj = await sync_to_async(Image.objects.get)(pk=key)
-        image_obj.image = base64.b64encode(image).decode()
-        await sync_to_async(image_obj.save)(update_fields=["image"])
+    await download_and_save(Image, images_task, force=force)
+    await render_completed([episode.pk])
 
 
 @shared_task
-def find_images(episode_id: str, force: bool = False):
+def find_images(episode_id: str, force: bool = False, from_frontier: bool = False):
     """
     Find images for a specific episode and create or update Image objects
+    Dispatches of the crawl frontier skip episodes crawled since, see find_episodes
     Usage: from apps.models import Episode;from apps.tasks import find_images as t;t( Episode.objects.first().id );
     """
-    with async_event_loop() as loop:
-        loop.run_until_complete(process_images(episode_id, force=force))
+    with frontier.lease(
+        FrontierEntry.KIND_EPISODE, episode_id, reopen=not from_frontier
+    ) as leased:
+        if leased:
+            run_async(process_images(episode_id, force=force))
+
+
+@celery_app.task(base=QueueOnce, once={"graceful": True})
+def resume_frontier():
+    """
+    Dispatch again the books and episodes whose worker died or whose task was lost,
+    and forget the ones finished long ago
+    Usage: from apps.tasks import resume_frontier as t;t();
+    """
+    if pruned := frontier.prune():
+        logger.info(f"Pruned {pruned} finished frontier entries")
+    tasks = {
+        FrontierEntry.KIND_BOOK: find_episodes,
+        FrontierEntry.KIND_EPISODE: find_images,
+    }
+    entries = list(frontier.stale_entries())
+    for entry in entries:
+        logger.info(f"Resume {entry}")
+        tasks[entry.kind].apply_async(args=[entry.key], kwargs={"from_frontier": True})
+    frontier.dispatched(entries)
+
+
+async def process_download_image(image_id: str, force: bool = False):
+    image = await Image.objects.only("id", "episode_id", "raw_url", "image_hash").aget(
+        pk=image_id
+    )
+    if not force and image.has_image:
+        return
+    await download_and_save(Image, [[image.id, image.raw_url]], force=force)
+    await render_completed([image.episode_id])
 
 
 @shared_task
@@ -127,15 +350,18 @@ def download_image(image_id: str, force: bool = False):
     Download image for a specific Image object
     Usage: from apps.tasks import download_image as t;t();
     """
-    image = asyncio.run(sync_to_async(Image.objects.get)(pk=image_id))
-    if not force and image.image:
-        return
-    with async_event_loop() as loop:
-        image_content = loop.run_until_complete(
-            ImageExtractor().download_image(image.raw_url)
-        )
-    image.image = image_content
-    asyncio.run(sync_to_async(image.save)(update_fields=["image"]))
+    run_async(process_download_image(image_id, force=force))
+
+
+async def process_download_images(images_id_list: list):
+    images, episode_ids = [], set()
+    async for image_id, episode_id, raw_url in Image.objects.filter(
+        id__in=images_id_list
+    ).values_list("id", "episode_id", "raw_url"):
+        images.append([image_id, raw_url])
+        episode_ids.add(episode_id)
+    await download_and_save(Image, images)
+    await render_completed(episode_ids)
 
 
 @shared_task
@@ -144,107 +370,177 @@ def download_images(images_id_list: list):
     Download images for a specific episode
     Usage: from apps.models import Episode;from apps.tasks import download_images as t;t( Episode.objects.first().id );
     """
+    run_async(process_download_images(images_id_list))
 
-    images = asyncio.run(
-        sync_to_async(
-            lambda: list(
-                Image.objects.filter(id__in=images_id_list)
-                .only("id", "raw_url")
-                .values_list("id", "raw_url")
-            )
-        )()
-    )
 
-    with async_event_loop() as loop:
-        images_result = loop.run_until_complete(
-            ImageExtractor().get_images_concurrently_with_id(images)
-        )
-        for key, image in images_result:
-            image_obj = asyncio.run(sync_to_async(Image.objects.get)(pk=key))
-            image_obj.image = base64.b64encode(image).decode()
-            asyncio.run(sync_to_async(image_obj.save)(update_fields=["image"]))
+async def process_download_covers(book_ids: list):
+    books = [
+        [book_id, image_url]
+        async for book_id, image_url in Book.objects.filter(
+            id__in=book_ids
+        ).values_list("id", "image_url")
+    ]
+    await download_and_save(Book, books)
+
+
+@shared_task
+def download_covers(book_ids: list):
+    """
+    Download the covers of the given books concurrently
+    Usage: from apps.models import Book;from apps.tasks import download_covers as t;t( [Book.objects.first().id] );
+    """
+    run_async(process_download_covers(book_ids))
 
 
 @celery_app.task(base=QueueOnce, once={"graceful": True, "timeout": 60 * 60 * 24})
 def fix_images():
     """
-    Fix missing images for Book and Image objects
+    Fix missing images for Book and Image objects, in batched download jobs
     Usage: from apps.tasks import fix_images as t;t();
     """
-    for model, image_attr in [(Book, "image_url"), (Image, "raw_url")]:
-        for obj in asyncio.run(
-            sync_to_async(
-                lambda: list(model.objects.filter(image="").only("id", image_attr))
-            )()
+    # Ordered by episode so that a batch spans as few episodes as possible
+    # Episodes failed by dead image URLs are left alone until they are crawled again
+    for model, task, fields, missing in [
+        (Book, download_covers, ["id"], Book.objects.all()),
+        (
+            Image,
+            download_images,
+            ["episode_id", "id"],
+            Image.objects.exclude(episode__status=Episode.STATUS_FAILED),
+        ),
+    ]:
+        rows = keyset_rows(
+            missing.filter(image_hash=""),
+            fields,
+            settings.CRAWLER_SWEEP["page_size"],
+        )
+        for batch in chunked(
+            (row[-1] for row in rows), settings.CRAWLER_SWEEP["batch_size"]
         ):
-            if isinstance(obj, Image):
-                download_image.apply_async(args=[obj.id], countdown=5)
-            else:
-                with async_event_loop() as loop:
-                    obj.image = loop.run_until_complete(
-                        ImageExtractor().download_image(getattr(obj, image_attr))
-                    )
-                asyncio.run(sync_to_async(obj.save)(update_fields=["image"]))
+            throttle_backfill()
+            task.apply_async(args=[batch], priority=PRIORITY_BACKFILL)
 
 
 async def process_convert_to_pdf(episode_id: str, force: bool = False):
-    episode = await sync_to_async(Episode.objects.get)(pk=episode_id)
-    images = await sync_to_async(
-        lambda: list(
-            episode.images.all().order_by("index").values_list("image", flat=True)
+    episode = await Episode.objects.aget(pk=episode_id)
+    if episode.status == Episode.STATUS_RENDERED and episode.pdf and not force:
+        return
+    image_hashes = [
+        digest
+        async for digest in episode.images.order_by("index").values_list(
+            "image_hash", flat=True
         )
-    )()
-    images = [base64.b64decode(img) for img in images if img]
+    ]
+    store = get_blob_store()
+    images = await asyncio.to_thread(
+        lambda: [store.read(digest) for digest in image_hashes if digest]
+    )
 
     if not images:
+        # Not listed or downloaded yet, which their own stages count as failures
+        logger.info(f"No images to render for episode {episode_id}")
         return
 
-    combined_image = await images_to_long_image(images, use_process_pool=False)
-    pdf_buffer = await long_image_to_pdf(combined_image, use_process_pool=False)
+    try:
+        pdf_buffer = await images_to_pdf(images)
+    except Exception:
+        await fail_attempt(episode.pk)
+        raise
 
     if pdf_buffer:
-        await sync_to_async(
-            lambda: episode.pdf.save(
-                f"{episode.title}.pdf", ContentFile(pdf_buffer.read())
-            )
-        )()
-        await sync_to_async(episode.save)(update_fields=["pdf"])
+        previous = episode.pdf.name
+        await sync_to_async(episode.pdf.save)(
+            f"{episode.title}.pdf", ContentFile(pdf_buffer.read()), save=False
+        )
+        update_fields = ["pdf"]
+        # A PDF rendered while images are missing is replaced once they arrive
+        if len(images) == len(image_hashes):
+            episode.status = Episode.STATUS_RENDERED
+            episode.status_changed_at, episode.attempts = timezone.now(), 0
+            update_fields += ["status", "status_changed_at", "attempts"]
+        await episode.asave(update_fields=update_fields)
+        # The storage saved the new file under a new name, the old one is ours to delete
+        if previous and previous != episode.pdf.name:
+            await sync_to_async(episode.pdf.storage.delete)(previous)
         logger.info(f"Convert to PDF: {episode.title}")
 
 
-@shared_task
+@celery_app.task(base=QueueOnce, once={"graceful": True, "keys": ["episode_id"]})
 def convert_to_pdf(episode_id: str, force: bool = False):
     """
     Convert images of an episode to PDF
     Usage: from apps.models import Episode;from apps.tasks import convert_to_pdf as t;t( Episode.objects.first().id );
     """
-    with async_event_loop() as loop:
-        loop.run_until_complete(process_convert_to_pdf(episode_id, force))
+    run_async(process_convert_to_pdf(episode_id, force))
 
 
 @celery_app.task(base=QueueOnce, once={"graceful": True, "timeout": 60 * 60 * 24})
 def fix_pdf():
     """
-    Fix missing PDFs for episodes
+    Render the episodes whose images are complete but whose PDF task was lost
     Usage: from apps.tasks import fix_pdf as t;t();
     """
-    image_subquery = Image.objects.filter(episode_id=OuterRef("pk"), image="")
+    # Completed by this sweep, the download that completed them never queued their PDF
+    completed = complete_episodes(
+        Episode.objects.filter(status=Episode.STATUS_IMAGES_LISTED).values("pk")
+    )
+    dispatch_backfill(convert_to_pdf, completed)
+    # Recently completed ones still have their PDF task waiting in the queue
+    cutoff = timezone.now() - timedelta(seconds=settings.CRAWLER_SWEEP["grace"])
+    dispatch_backfill(
+        convert_to_pdf,
+        Episode.objects.filter(
+            status=Episode.STATUS_IMAGES_COMPLETE, status_changed_at__lt=cutoff
+        )
+        .order_by("status_changed_at")
+        .values_list("id", flat=True)
+        .iterator(),
+    )
 
-    for episode in asyncio.run(
-        sync_to_async(
-            lambda: list(
-                Episode.objects.filter(
-                    Q(pdf="") | Q(pdf__isnull=True),
-                    images__image__isnull=False,
-                )
-                .exclude(Exists(image_subquery))
-                .distinct()
-                .only("id")
-            )
-        )()
+
+def dispatch_backfill(task, keys):
+    """Queue one sweep task per key behind all other work, yielding to readers between batches"""
+    for index, key in enumerate(keys):
+        if index % settings.CRAWLER_SWEEP["batch_size"] == 0:
+            throttle_backfill()
+        task.apply_async(args=[key], countdown=5, priority=PRIORITY_BACKFILL)
+
+
+def episode_pdf_steps(episode: Episode) -> list:
+    """
+    Tasks still needed before an episode can be read as a PDF
+    While images are missing, the download that completes them queues the render
+    """
+    if not episode.image_count:
+        step = find_images.si(episode.id)
+    elif missing := list(
+        episode.images.filter(image_hash="").values_list("id", flat=True)
     ):
-        convert_to_pdf.apply_async(
-            args=[episode.id],
-            countdown=5,
-            options={"once": {"keys": [episode.id], "timeout": 60 * 60 * 24}},
-        )
+        step = download_images.si(missing)
+    else:
+        step = convert_to_pdf.si(episode.id)
+    return [step.set(priority=PRIORITY_INTERACTIVE)]
+
+
+def request_episode_pdf(episode: Episode) -> AsyncResult:
+    """
+    Prepare the PDF of an episode ahead of background sweeps
+    Concurrent readers of the same episode share one chain of tasks
+    Returns the result of its last task
+    """
+    mark_interactive()
+    key = f"priority:pdf:{episode.id}"
+    if task_id := cache.get(key):
+        return AsyncResult(task_id)
+    result = chain(*episode_pdf_steps(episode)).apply_async()
+    cache.set(key, result.id, timeout=settings.CRAWLER_PRIORITY["hold"])
+    return result
+
+
+@celery_app.task(base=QueueOnce, once={"graceful": True})
+def evict_thumbnails():
+    """
+    Keep the thumbnail cache within its configured size
+    Usage: from apps.tasks import evict_thumbnails as t;t();
+    """
+    get_thumbnail_cache().evict()
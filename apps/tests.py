@@ -1,9 +1,1414 @@
-from django.test import TestCase
+import asyncio
+import os
+import re
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from asgiref.sync import async_to_sync, sync_to_async
+from celery.signals import worker_init
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.utils import timezone
+from PIL import Image as PILImage
 
-def test_get_images():
-    from apps.services import ImageExtractor
+from apps import frontier
+from apps.executors import get_executor, pool_size, share_cpus, shutdown_executors
+from apps.extractors import (
+    parse_book_details,
+    parse_chapters,
+    parse_document,
+    parse_listing,
+    parse_max_page,
+    parse_pages,
+)
+from apps.management.commands.bench_parsers import CORPUS_DIR
+from apps.models import Book, CrawlState, Episode, FrontierEntry, Image, Tag
+from apps.page_cache import NOT_MODIFIED, PageCache
+from apps.pdf import (
+    MODE_STITCH,
+    RenderedPage,
+    Strip,
+    assemble_pdf,
+    compose_pdf,
+    decode_scaled,
+    images_to_pdf,
+    new_canvas,
+    plan_pages,
+    stitch_pdf,
+)
+from apps.persistence import (
+    complete_episodes,
+    keyset_rows,
+    outdated_books,
+    save_downloaded_images,
+    update_book_details,
+    upsert_books,
+    upsert_episodes,
+    upsert_images,
+)
+from apps.priority import (
+    PRIORITY_BACKFILL,
+    PRIORITY_INTERACTIVE,
+    interactive_waiting,
+    mark_interactive,
+    throttle_backfill,
+)
+from apps.replay import ReplaySite, run_pipeline, serve
+from apps.runtime import close_loop, get_loop, run_async
+from apps.services import ImageExtractor
+from apps.storage import get_blob_store, hash_content
+from apps.tasks import (
+    convert_to_pdf,
+    download_and_save,
+    episode_pdf_steps,
+    fix_images,
+    fix_pdf,
+    process_books,
+    process_convert_to_pdf,
+    process_download_images,
+    process_episodes,
+    request_episode_pdf,
+    resume_frontier,
+    reuse_known_images,
+)
+from apps.thumbnails import get_thumbnail_cache
+from apps.transport import (
+    AiohttpTransport,
+    Response,
+    TokenBucket,
+    Transport,
+    TransportError,
+)
+from SE8 import celery_app
 
-    extractor = ImageExtractor("https://se8.us/index.php/chapter/12310")
-    images = extractor.get_images()
-    assert len(images) > 0
+
+def make_image_bytes(size=(8, 8), color="red", format="JPEG") -> bytes:
+    buffer = BytesIO()
+    PILImage.new("RGB", size, color).save(buffer, format=format)
+    return buffer.getvalue()
+
+
+class BlobStoreTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        settings_override = override_settings(
+            BLOB_STORE={
+                "BACKEND": "apps.storage.FileSystemBlobStore",
+                "OPTIONS": {"location": f"{self.tmp_dir.name}/blobs"},
+            },
+            THUMBNAILS={"location": f"{self.tmp_dir.name}/thumbs", "size": 32},
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class FileSystemBlobStoreTests(BlobStoreTestCase):
+    def test_save_is_content_addressed_and_sharded(self):
+        content = make_image_bytes()
+        store = get_blob_store()
+        digest = store.save(content)
+
+        self.assertEqual(digest, hash_content(content))
+        self.assertEqual(store.path(digest).parent.name, digest[2:4])
+        self.assertEqual(store.read(digest), content)
+
+    def test_model_keeps_only_reference(self):
+        content = make_image_bytes(format="PNG")
+        book = Book.objects.create(id="book")
+        episode = Episode.objects.create(id=1, book=book)
+        image = Image(id=1, episode=episode)
+        image.set_image(content)
+        image.save()
+
+        image.refresh_from_db()
+        self.assertEqual(image.image_size, len(content))
+        self.assertEqual(image.image_mime, "image/png")
+        self.assertEqual(image.read_image(), content)
+
+    def test_identical_bytes_are_stored_once(self):
+        content = make_image_bytes()
+        store = get_blob_store()
+        path = store.path(store.save(content))
+        mtime = path.stat().st_mtime_ns
+
+        self.assertEqual(store.save(content), path.name)
+        self.assertEqual(path.stat().st_mtime_ns, mtime)
+
+    def test_known_url_is_not_downloaded_again(self):
+        book = Book.objects.create(id="book")
+        episode = Episode.objects.create(id=1, book=book)
+        known = Image(id=1, episode=episode, raw_url="https://img/banner.jpg")
+        known.set_image(make_image_bytes())
+        known.save()
+        Image.objects.create(id=2, episode=episode, raw_url="https://img/banner.jpg")
+        Image.objects.create(id=3, episode=episode, raw_url="https://img/page.jpg")
+
+        pending = async_to_sync(reuse_known_images)(
+            Image, [[2, "https://img/banner.jpg"], [3, "https://img/page.jpg"]]
+        )
+
+        self.assertEqual(pending, [[3, "https://img/page.jpg"]])
+        self.assertEqual(Image.objects.get(pk=2).image_hash, known.image_hash)
+
+
+class PersistenceTests(TestCase):
+    def test_upsert_reports_new_rows(self):
+        Book.objects.create(id="1", title="old")
+        rows = [
+            {"id": "1", "title": "new", "raw_url": "https://b/1", "image_url": ""},
+            {"id": "2", "title": "two", "raw_url": "https://b/2", "image_url": ""},
+        ]
+
+        with self.assertNumQueries(4):
+            created = upsert_books(rows)
+
+        self.assertEqual(created, {"2"})
+        self.assertEqual(Book.objects.get(pk="1").title, "new")
+
+    def test_outdated_books_compares_latest_episode(self):
+        book = Book.objects.create(id="1")
+        Book.objects.create(id="2")
+        upsert_episodes(book, [{"id": "10", "title": "ep 1", "raw_url": ""}])
+        upsert_episodes(book, [{"id": "11", "title": "ep 2", "raw_url": ""}])
+
+        self.assertEqual(outdated_books({"1": "ep 2", "2": "ep 1"}), {"2"})
+        self.assertEqual(outdated_books({"1": "ep 3"}), {"1"})
+
+    def test_update_book_details_attaches_tags(self):
+        book = Book.objects.create(id="1")
+        update_book_details(book, tags=["a", "b", "a"], hot=3.0, description="d")
+        update_book_details(book, tags=["b", "c"], hot=4.0, description="d")
+
+        book.refresh_from_db()
+        self.assertEqual(book.hot, 4)
+        self.assertEqual(
+            sorted(book.tags.values_list("name", flat=True)), ["a", "b", "c"]
+        )
+
+
+class SweepTests(TestCase):
+    def test_keyset_rows_stream_in_pages(self):
+        book = Book.objects.create(id="1")
+        for episode_id in [20, 10]:
+            Episode.objects.create(id=episode_id, book=book)
+        for image_id in range(6):
+            Image.objects.create(id=image_id, episode_id=10 if image_id % 2 else 20)
+
+        with self.assertNumQueries(4):
+            rows = list(keyset_rows(Image.objects.all(), ["episode_id", "id"], 2))
+
+        self.assertEqual(rows, [(10, 1), (10, 3), (10, 5), (20, 0), (20, 2), (20, 4)])
+
+    @override_settings(
+        CRAWLER_SWEEP={"batch_size": 2, "page_size": 2},
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+    )
+    def test_fix_images_dispatches_batches(self):
+        for book_id in "abc":
+            Book.objects.create(id=book_id)
+        Episode.objects.create(id=10, book_id="a")
+        for image_id in range(5):
+            Image.objects.create(
+                id=image_id, episode_id=10, image_hash="" if image_id else "x"
+            )
+
+        with mock.patch("apps.tasks.download_covers") as covers, mock.patch(
+            "apps.tasks.download_images"
+        ) as images:
+            fix_images()
+
+        self.assertEqual(
+            [c.kwargs["args"] for c in covers.apply_async.call_args_list],
+            [[["a", "b"]], [["c"]]],
+        )
+        self.assertEqual(
+            [c.kwargs["args"] for c in images.apply_async.call_args_list],
+            [[[1, 2]], [[3, 4]]],
+        )
+        self.assertEqual(
+            images.apply_async.call_args.kwargs["priority"], PRIORITY_BACKFILL
+        )
+
+
+class CounterTests(BlobStoreTestCase):
+    def test_counters_follow_discovery_and_downloads(self):
+        book = Book.objects.create(id="1")
+        upsert_episodes(book, [{"id": "10", "title": "ep", "raw_url": ""}])
+        episode = Episode.objects.get(pk=10)
+        upsert_images(
+            episode,
+            [{"id": str(i), "index": i, "raw_url": f"https://i/{i}"} for i in range(3)],
+        )
+        save_downloaded_images(Image, [[0, make_image_bytes()]])
+        update_book_details(book, tags=["a"], hot=0, description="")
+
+        episode.refresh_from_db()
+        self.assertEqual(Book.objects.get(pk="1").episode_count, 1)
+        self.assertEqual((episode.image_count, episode.downloaded_image_count), (3, 1))
+        self.assertEqual(Tag.objects.get(name="a").book_count, 1)
+
+    def test_downloads_are_counted_once(self):
+        book = Book.objects.create(id="1")
+        Episode.objects.create(id=10, book=book, image_count=2)
+        for i in range(2):
+            Image.objects.create(id=i, episode_id=10, index=i)
+
+        save_downloaded_images(Image, [[0, make_image_bytes()]])
+        save_downloaded_images(Image, [[0, make_image_bytes(color="blue")]])
+        self.assertEqual(Episode.objects.get(pk=10).downloaded_image_count, 1)
+
+        # A drifted counter is corrected once it claims the episode is complete
+        Episode.objects.filter(pk=10).update(downloaded_image_count=5)
+        Image.objects.create(id=2, episode_id=10, index=2)
+        save_downloaded_images(Image, [[1, make_image_bytes()]])
+        episode = Episode.objects.get(pk=10)
+        self.assertEqual((episode.image_count, episode.downloaded_image_count), (3, 2))
+
+    def test_backfill_command(self):
+        book = Book.objects.create(id="1")
+        Episode.objects.create(id=10, book=book)
+        Image.objects.create(id=1, episode_id=10)
+
+        call_command("backfill_counters", batch_size=1, stdout=StringIO())
+
+        self.assertEqual(Book.objects.get(pk="1").episode_count, 1)
+        self.assertEqual(Episode.objects.get(pk=10).image_count, 1)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class EpisodeStatusTests(BlobStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        book = Book.objects.create(id="1")
+        upsert_episodes(book, [{"id": "10", "title": "ep", "raw_url": ""}])
+        self.episode = Episode.objects.get(pk=10)
+
+    def status(self) -> str:
+        self.episode.refresh_from_db()
+        return self.episode.status
+
+    def test_status_follows_the_pipeline(self):
+        self.assertEqual(self.status(), Episode.STATUS_DISCOVERED)
+        upsert_images(
+            self.episode,
+            [{"id": str(i), "index": i, "raw_url": f"https://i/{i}"} for i in range(2)],
+        )
+        self.assertEqual(self.status(), Episode.STATUS_IMAGES_LISTED)
+
+        save_downloaded_images(Image, [[0, make_image_bytes()]])
+        self.assertEqual(complete_episodes([10]), [])
+        save_downloaded_images(Image, [[1, make_image_bytes(color="blue")]])
+        self.assertEqual(complete_episodes([10]), [10])
+        self.assertEqual(complete_episodes([10]), [])
+        self.assertEqual(self.status(), Episode.STATUS_IMAGES_COMPLETE)
+
+        with override_settings(MEDIA_ROOT=self.tmp_dir.name):
+            async_to_sync(process_convert_to_pdf)(10)
+        self.assertEqual(self.status(), Episode.STATUS_RENDERED)
+
+        upsert_images(self.episode, [{"id": "2", "index": 2, "raw_url": ""}])
+        self.assertEqual(self.status(), Episode.STATUS_IMAGES_LISTED)
+
+    def test_completed_downloads_queue_the_pdf(self):
+        digest = get_blob_store().save(make_image_bytes())
+        Episode.objects.create(id=11, book_id="1")
+        Image.objects.create(
+            id=1, episode_id=11, raw_url="https://i/1", image_hash=digest
+        )
+        upsert_images(self.episode, [{"id": "2", "index": 0, "raw_url": "https://i/1"}])
+
+        with mock.patch("apps.tasks.convert_to_pdf") as convert:
+            async_to_sync(process_download_images)([2])
+            async_to_sync(process_download_images)([2])
+
+        convert.apply_async.assert_called_once_with(args=[10])
+
+    @override_settings(CRAWLER_PIPELINE_MAX_ATTEMPTS=2)
+    def test_render_fails_after_its_attempts(self):
+        with mock.patch("apps.tasks.images_to_pdf", side_effect=OSError("broken")):
+            digest = get_blob_store().save(make_image_bytes())
+            Image.objects.create(id=1, episode_id=10, image_hash=digest)
+            for _ in range(2):
+                with self.assertRaises(OSError):
+                    async_to_sync(process_convert_to_pdf)(10)
+
+        self.assertEqual(self.status(), Episode.STATUS_FAILED)
+        self.assertEqual(self.episode.attempts, 2)
+
+    def test_fix_pdf_picks_complete_episodes(self):
+        Episode.objects.create(id=11, book_id="1", status=Episode.STATUS_RENDERED)
+        Episode.objects.filter(pk=10).update(
+            status=Episode.STATUS_IMAGES_LISTED, image_count=1, downloaded_image_count=1
+        )
+        # Only episodes complete for longer than the grace period lost their task
+        for pk, age in [(12, timedelta(0)), (13, timedelta(days=1))]:
+            Episode.objects.create(
+                id=pk,
+                book_id="1",
+                status=Episode.STATUS_IMAGES_COMPLETE,
+                status_changed_at=timezone.now() - age,
+            )
+
+        with mock.patch("apps.tasks.convert_to_pdf") as convert:
+            fix_pdf()
+
+        self.assertEqual(
+            [c.kwargs["args"] for c in convert.apply_async.call_args_list],
+            [[10], [13]],
+        )
+
+    def test_rendering_again_replaces_the_pdf(self):
+        digest = get_blob_store().save(make_image_bytes())
+        Image.objects.create(id=1, episode_id=10, image_hash=digest)
+
+        with override_settings(MEDIA_ROOT=self.tmp_dir.name):
+            async_to_sync(process_convert_to_pdf)(10)
+            async_to_sync(process_convert_to_pdf)(10, force=True)
+
+        self.episode.refresh_from_db()
+        self.assertEqual(
+            os.listdir(os.path.join(self.tmp_dir.name, "pdfs")),
+            [os.path.basename(self.episode.pdf.name)],
+        )
+
+    @override_settings(CRAWLER_PIPELINE_MAX_ATTEMPTS=2)
+    def test_dead_image_urls_fail_the_episode(self):
+        upsert_images(self.episode, [{"id": "1", "index": 0, "raw_url": "https://i/1"}])
+
+        async def unreachable(items, to_store=True):
+            for key, _ in items:
+                yield key, None
+
+        with mock.patch.object(ImageExtractor(), "iter_images", unreachable):
+            for _ in range(2):
+                async_to_sync(process_download_images)([1])
+        self.assertEqual(self.status(), Episode.STATUS_FAILED)
+
+        with mock.patch("apps.tasks.download_covers"), mock.patch(
+            "apps.tasks.download_images"
+        ) as images:
+            fix_images()
+        images.apply_async.assert_not_called()
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    CRAWLER_PRIORITY={"hold": 60, "poll": 0.01, "max_pause": 0.05},
+)
+class PriorityTests(BlobStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        book = Book.objects.create(id="1")
+        upsert_episodes(book, [{"id": "10", "title": "ep", "raw_url": ""}])
+        upsert_episodes(book, [{"id": "11", "title": "ep", "raw_url": ""}])
+        self.episode = Episode.objects.get(pk=10)
+        upsert_images(
+            self.episode,
+            [{"id": str(i), "index": i, "raw_url": f"https://i/{i}"} for i in range(3)],
+        )
+        save_downloaded_images(Image, [[0, make_image_bytes()]])
+        self.episode.refresh_from_db()
+
+    def test_reader_work_goes_first(self):
+        steps = episode_pdf_steps(self.episode)
+        empty_steps = episode_pdf_steps(Episode.objects.get(pk=11))
+
+        self.assertEqual(
+            [(step.task, step.args) for step in steps],
+            [("apps.tasks.download_images", ([1, 2],))],
+        )
+        self.assertEqual(
+            [step.task for step in empty_steps], ["apps.tasks.find_images"]
+        )
+        self.assertEqual(
+            {step.options["priority"] for step in steps + empty_steps},
+            {PRIORITY_INTERACTIVE},
+        )
+
+    def test_readers_of_an_episode_share_its_tasks(self):
+        with mock.patch("apps.tasks.chain") as chain:
+            chain.return_value.apply_async.return_value.id = "task-id"
+            first = request_episode_pdf(self.episode)
+            second = request_episode_pdf(self.episode)
+
+        chain.return_value.apply_async.assert_called_once()
+        self.assertEqual(second.id, first.id)
+        self.assertTrue(interactive_waiting())
+
+    def test_complete_episode_renders_once(self):
+        self.episode.images.update(image_hash="a" * 64)
+
+        steps = episode_pdf_steps(self.episode)
+
+        self.assertEqual(
+            [(step.task, step.args) for step in steps],
+            [("apps.tasks.convert_to_pdf", (10,))],
+        )
+        self.assertEqual(convert_to_pdf.once["keys"], ["episode_id"])
+
+    def test_rendering_before_images_is_not_a_failure(self):
+        async_to_sync(process_convert_to_pdf)(11)
+
+        self.assertEqual(Episode.objects.get(pk=11).attempts, 0)
+
+    def test_pdf_not_ready(self):
+        with mock.patch("apps.views.request_episode_pdf") as request_pdf:
+            response = self.client.get("/api/episode/10/pdf/")
+
+        request_pdf.assert_called_once()
+        request_pdf.return_value.get.assert_not_called()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response["Retry-After"], "5")
+
+    def test_pdf_ready(self):
+        with override_settings(MEDIA_ROOT=self.tmp_dir.name):
+            self.episode.pdf.save("ep.pdf", ContentFile(b"%PDF-1.4"))
+            response = self.client.get("/api/episode/10/pdf/")
+            self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.4")
+
+    def test_sweeps_yield_to_readers(self):
+        self.assertLess(throttle_backfill(), 0.01)
+        mark_interactive()
+        self.assertGreaterEqual(throttle_backfill(), 0.05)
+
+
+def pdf_page_count(buffer) -> int:
+    return len(re.findall(rb"/Type /Page\b(?!s)", buffer.getvalue()))
+
+
+def pdf_streams(buffer) -> list:
+    return re.findall(rb"stream\r?\n(.*?)endstream", buffer.getvalue(), re.S)
+
+
+class PdfTests(SimpleTestCase):
+    def test_pages_are_planned_from_overlapping_strips(self):
+        scale, pages = plan_pages([(100, 300), None, (50, 200)], 100, 250)
+
+        self.assertEqual(scale, 1)
+        self.assertEqual([page.height for page in pages], [250, 250])
+        self.assertEqual(pages[0].strips, [Strip(0, 0, 250, 0)])
+        self.assertEqual(pages[1].strips, [Strip(0, 250, 300, 0), Strip(2, 0, 200, 50)])
+
+    def test_stitched_pdf(self):
+        images = [make_image_bytes(size=(60, 200), color=c) for c in ["red", "blue"]]
+        images.append(b"not an image")
+
+        # 400 rows 60 pixels wide scaled to A4 width are 4.7 A4 heights
+        self.assertEqual(pdf_page_count(compose_pdf(images, MODE_STITCH)), 5)
+        self.assertIsNone(compose_pdf([b"not an image"], MODE_STITCH))
+
+    def test_stitched_pages_follow_dpi(self):
+        images = [make_image_bytes(size=(60, 200), color=c) for c in ["red", "blue"]]
+
+        pdf = stitch_pdf(images, dpi=144)
+
+        self.assertEqual(pdf_page_count(pdf), 5)
+        self.assertIn(b"/Width 1190", pdf.getvalue())
+
+    def test_encoded_pages_are_drawn_like_reportlab_images(self):
+        # draw_page relies on reportlab internals, a new release must not change them
+        from reportlab.lib.utils import ImageReader
+
+        img = PILImage.new("RGB", (60, 20), "red")
+        page = RenderedPage(0, 60, 20, 20, stream=zlib.compress(img.tobytes()))
+        buffer = BytesIO()
+        pdf_canvas = new_canvas(buffer)
+        pdf_canvas.drawImage(ImageReader(img), 0, 0, width=60, height=20)
+        pdf_canvas.save()
+
+        xobject = re.compile(rb"<<\s*/BitsPerComponent.*?endstream", re.S)
+        drawn = assemble_pdf([page]).getvalue()
+        self.assertEqual(xobject.search(drawn)[0], xobject.search(buffer.getvalue())[0])
+        self.assertIn(b"/ImageC", drawn)
+
+    def test_sources_are_decoded_near_their_drawn_size(self):
+        jpeg = make_image_bytes(size=(1600, 400))
+        png = make_image_bytes(size=(1600, 400), format="PNG")
+
+        for content in [jpeg, png]:
+            img, factor = decode_scaled(content, 0.25)
+            self.assertEqual((img.size, img.mode, factor), ((400, 100), "RGB", 4))
+        img, factor = decode_scaled(jpeg, 0.3)
+        self.assertEqual((img.size, factor), ((800, 200), 2))
+        img, factor = decode_scaled(jpeg, 0.25, draft=False)
+        self.assertEqual((img.size, factor), ((1600, 400), 1))
+        self.assertIsNone(decode_scaled(b"not an image", 0.25))
+
+    def test_passthrough_pdf_embeds_jpeg_streams(self):
+        jpeg = make_image_bytes(size=(60, 200))
+        png = make_image_bytes(size=(60, 200), color="blue", format="PNG")
+
+        pdf = compose_pdf([jpeg, png, b"not an image"]).getvalue()
+
+        self.assertEqual(pdf_page_count(BytesIO(pdf)), 2)
+        self.assertIn(jpeg, pdf)
+        self.assertIn(b"/DCTDecode", pdf)
+        self.assertNotIn(b"/ASCII85Decode", pdf)
+        self.assertIsNone(compose_pdf([b"not an image"]))
+
+    def test_passthrough_pdf_splits_tall_images(self):
+        # 3000 rows 60 pixels wide are 29763 points high at A4 width, over 2 pages
+        pdf = compose_pdf([make_image_bytes(size=(60, 3000))]).getvalue()
+
+        self.assertEqual(pdf_page_count(BytesIO(pdf)), 3)
+        self.assertEqual(pdf.count(b"/Subtype /Image"), 1)
+
+
+@override_settings(PDF_RENDER={"mode": "passthrough", "workers": 2, "dpi": 72})
+class ExecutorTests(SimpleTestCase):
+    def tearDown(self):
+        shutdown_executors()
+
+    def test_pool_is_shared_until_shutdown(self):
+        executor = get_executor()
+
+        self.assertIs(get_executor(), executor)
+        shutdown_executors()
+        self.assertIsNot(get_executor(), executor)
+
+    def test_pages_render_concurrently_in_order(self):
+        images = [make_image_bytes(size=(60, 200), color=c) for c in ["red", "blue"]]
+
+        with self.assertLogs("apps.pdf", "INFO") as logs:
+            pdf = async_to_sync(images_to_pdf)(images, mode=MODE_STITCH)
+
+        self.assertEqual(
+            pdf_streams(pdf), pdf_streams(compose_pdf(images, MODE_STITCH))
+        )
+        self.assertIn("Rendered 5 pages", logs.output[-1])
+
+    def test_sources_are_decoded_once_per_run(self):
+        # Each source is about 3.5 pages tall, 11 pages in all
+        images = [
+            make_image_bytes(size=(60, 300), color=c) for c in ["red", "green", "blue"]
+        ]
+
+        def decodes(render):
+            with mock.patch("apps.pdf.decode_scaled", wraps=decode_scaled) as decode:
+                pdf = render(images)
+            self.assertEqual(pdf_page_count(pdf), 11)
+            return Counter(images.index(c.args[0]) for c in decode.call_args_list)
+
+        self.assertEqual(decodes(stitch_pdf), {0: 1, 1: 1, 2: 1})
+        # Two runs of pages 0-5 and 6-10, only the source across their border is shared
+        self.assertEqual(
+            decodes(lambda images: async_to_sync(images_to_pdf)(images, MODE_STITCH)),
+            {0: 1, 1: 2, 2: 1},
+        )
+
+    def test_passthrough_renders_on_the_pool(self):
+        images = [make_image_bytes(size=(60, 200), color=c) for c in ["red", "blue"]]
+
+        self.assertEqual(pdf_page_count(async_to_sync(images_to_pdf)(images)), 2)
+        self.assertIsNone(async_to_sync(images_to_pdf)([b"not an image"]))
+
+
+class ThumbnailTests(BlobStoreTestCase):
+    def test_thumbnail_is_served_with_long_cache_headers(self):
+        digest = get_blob_store().save(make_image_bytes(size=(400, 800)))
+
+        response = self.client.get(f"/api/thumbnail/{digest}/")
+        thumbnail = PILImage.open(BytesIO(b"".join(response.streaming_content)))
+
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(thumbnail.size, (16, 32))
+        self.assertEqual(
+            self.client.get(
+                f"/api/thumbnail/{digest}/", HTTP_IF_NONE_MATCH=f'"{digest}"'
+            ).status_code,
+            304,
+        )
+
+    def test_unknown_digest_is_not_found(self):
+        response = self.client.get(f"/api/thumbnail/{'0' * 64}/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_evict_drops_least_recently_used(self):
+        cache = get_thumbnail_cache()
+        store = get_blob_store()
+        paths = [
+            cache.get(store.save(make_image_bytes(color=color)))
+            for color in ("red", "green", "blue")
+        ]
+        for age, path in enumerate(reversed(paths)):
+            os.utime(path, (1000 - age, 1000 - age))
+        cache.max_bytes = sum(path.stat().st_size for path in paths[1:])
+
+        self.assertEqual(cache.evict(), 1)
+        self.assertEqual([path.exists() for path in paths], [False, True, True])
+
+    def test_failed_writes_leave_no_temporary_files(self):
+        cache = get_thumbnail_cache()
+        digest = get_blob_store().save(make_image_bytes())
+        with mock.patch("apps.thumbnails.os.replace", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                cache.get(digest)
+        self.assertEqual(list(cache.path(digest).parent.iterdir()), [])
+
+        # A thumbnail being written is neither counted nor evicted
+        (cache.path(digest).parent / ".tmp-writing").write_bytes(b"0" * 1024)
+        path = cache.get(digest)
+        cache.max_bytes = path.stat().st_size
+        self.assertEqual(cache.evict(), 0)
+        self.assertTrue(path.exists())
+
+
+class ExtractorTests(SimpleTestCase):
+    def load(self, name):
+        return parse_document((CORPUS_DIR / f"{name}.html").read_bytes())
+
+    def test_listing_items_are_parsed_independently(self):
+        doc = self.load("listing")
+        books = parse_listing(doc)
+
+        self.assertEqual(len(books), 6)
+        self.assertEqual(len({book["id"] for book in books}), 6)
+        self.assertEqual(
+            books[1],
+            {
+                "raw_url": "https://se8.us/index.php/comic/3307",
+                "id": "3307",
+                "title": "秘密教学",
+                "image_url": "https://img.se8.us/cover/3307.jpg",
+                "current": "第211话",
+            },
+        )
+        self.assertEqual(parse_max_page(doc), 1873)
+
+    def test_book_page(self):
+        doc = self.load("book")
+        chapters = parse_chapters(doc)
+
+        self.assertEqual(
+            parse_book_details(doc),
+            {
+                "tags": ["剧情", "都市", "韩漫"],
+                "hot": 38912.0,
+                "description": "每到深夜，小巷尽头的食堂就会亮起灯，来来往往的客人带着各自的故事。",
+            },
+        )
+        self.assertEqual(
+            [c["id"] for c in chapters], [str(97001 + i) for i in range(8)]
+        )
+        self.assertEqual(chapters[-1]["title"], "第8话")
+
+    def test_chapter_page(self):
+        pages = parse_pages(self.load("chapter"))
+
+        self.assertEqual([page["index"] for page in pages], list("012345"))
+        self.assertEqual(pages[2]["id"], "5510003")
+        self.assertEqual(
+            pages[2]["raw_url"], "https://img.se8.us/chapter/97001/0003.jpg"
+        )
+
+    def test_empty_pages(self):
+        for doc in [self.load("empty_listing"), parse_document(b"")]:
+            self.assertEqual(parse_listing(doc), [])
+            self.assertEqual(parse_chapters(doc), [])
+            self.assertEqual(parse_pages(doc), [])
+            self.assertIsNone(parse_max_page(doc))
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command("bench_parsers", iterations=2, stdout=out)
+        self.assertIn("listing.html", out.getvalue())
+        self.assertIn("ms/page", out.getvalue())
+
+
+class StartupTests(SimpleTestCase):
+    def test_heavy_libraries_are_imported_on_first_use(self):
+        out = StringIO()
+        call_command("bench_startup", repeat=1, stdout=out)
+        self.assertIn("web", out.getvalue())
+        self.assertIn("worker", out.getvalue())
+
+    def test_budget_is_enforced(self):
+        with self.assertRaisesMessage(CommandError, "ms to import"):
+            call_command("bench_startup", repeat=1, budget_ms=1, stdout=StringIO())
+
+    def test_only_forking_workers_preload(self):
+        with mock.patch("apps.runtime.preload") as preload, mock.patch(
+            "apps.runtime.share_cpus"
+        ) as share_cpus:
+            for pool in ["threads", "prefork", "solo"]:
+                worker_init.send(sender=mock.Mock(pool_cls=pool, concurrency=2))
+
+        preload.assert_called_once_with()
+        share_cpus.assert_called_once_with(2)
+
+    @override_settings(PDF_RENDER={**settings.PDF_RENDER, "workers": 0})
+    def test_render_threads_share_the_cpus(self):
+        self.addCleanup(share_cpus, 1)
+        with mock.patch("os.cpu_count", return_value=8):
+            share_cpus(2)
+            self.assertEqual(pool_size(), 4)
+            share_cpus(16)
+            self.assertEqual(pool_size(), 1)
+
+
+class StubTransport(Transport):
+    def __init__(self, response=None, headers=None):
+        super().__init__(headers)
+        self.response = response
+        self.urls = []
+
+    async def get(self, url, headers=None):
+        self.urls.append(url)
+        return self.response
+
+
+class TransportTests(SimpleTestCase):
+    async def test_pooled_transport_reuses_connections(self):
+        peers = set()
+
+        async def handler(request):
+            peers.add(request.transport.get_extra_info("peername"))
+            return web.Response(text=request.headers["X-Test"])
+
+        app = web.Application()
+        app.router.add_get("/", handler)
+        async with TestServer(app) as server:
+            transport = AiohttpTransport(headers={"X-Test": "hello"})
+            responses = [await transport.get(str(server.make_url("/"))) for _ in "abc"]
+            await transport.close()
+
+        self.assertEqual([resp.text for resp in responses], ["hello"] * 3)
+        self.assertEqual(len(peers), 1)
+
+    async def test_fallback_on_rejected_request(self):
+        extractor = ImageExtractor()
+        primary, fallback = extractor.transport, extractor.fallback
+        self.addCleanup(setattr, extractor, "transport", primary)
+        self.addCleanup(setattr, extractor, "fallback", fallback)
+        extractor.transport = StubTransport(Response(url="", status=503))
+        extractor.fallback = StubTransport(Response(url="", status=200, content=b"ok"))
+
+        resp = await extractor._fetch(" https://se8.us/ ")
+
+        self.assertEqual(resp.content, b"ok")
+        self.assertEqual(extractor.fallback.urls, ["https://se8.us/"])
+
+
+class WorkerRuntimeTests(SimpleTestCase):
+    def test_shutdown_does_not_create_the_extractor(self):
+        loop = get_loop()
+        with mock.patch.object(ImageExtractor, "_instance", None):
+            close_loop()
+            self.assertIsNone(ImageExtractor._instance)
+        self.assertTrue(loop.is_closed())
+
+    def test_tasks_share_the_loop_and_connections(self):
+        peers = set()
+
+        async def handler(request):
+            peers.add(request.transport.get_extra_info("peername"))
+            return web.Response(text="ok")
+
+        async def running_loop():
+            return asyncio.get_running_loop()
+
+        app = web.Application()
+        app.router.add_get("/", handler)
+        server = TestServer(app)
+        transport = AiohttpTransport()
+        run_async(server.start_server())
+        try:
+            loops = set()
+            for _ in range(3):
+                loops.add(run_async(running_loop()))
+                run_async(transport.get(str(server.make_url("/"))))
+        finally:
+            run_async(transport.close())
+            run_async(server.close())
+
+        self.assertEqual(len(loops), 1)
+        self.assertEqual(len(peers), 1)
+
+    def test_worker_threads_get_their_own_loop(self):
+        async def running_loop():
+            await asyncio.sleep(0.01)
+            return asyncio.get_running_loop()
+
+        with ThreadPoolExecutor(2) as executor:
+            loops = list(executor.map(lambda _: run_async(running_loop()), range(2)))
+
+        self.assertIsNot(loops[0], loops[1])
+
+    def test_worker_threads_run_orm_calls_at_once(self):
+        # Both calls must be running for either to pass the barrier
+        barrier = threading.Barrier(2, timeout=5)
+
+        async def query():
+            return await sync_to_async(barrier.wait)()
+
+        with ThreadPoolExecutor(2) as executor:
+            list(executor.map(lambda _: run_async(query()), range(2)))
+
+    def test_nightly_jobs_fire_once(self):
+        # crontab(hour=1) alone would fire on every minute of that hour
+        for name in ["auto_fetch_books", "auto_reconcile_books", "auto_fix_images"]:
+            schedule = settings.CELERY_BEAT_SCHEDULE[name]["schedule"]
+            self.assertEqual(len(schedule.minute) * len(schedule.hour), 1, name)
+
+    def test_workloads_are_routed_to_their_queue(self):
+        router = celery_app.amqp.router
+        queues = {
+            name: router.route({}, f"apps.tasks.{name}")["queue"].name
+            for name in [
+                "find_books",
+                "download_images",
+                "convert_to_pdf",
+                "fix_pdf",
+                "fix_images",
+            ]
+        }
+        self.assertEqual(
+            queues,
+            {
+                "find_books": "discovery",
+                "download_images": "download",
+                "convert_to_pdf": "render",
+                "fix_pdf": "default",
+                "fix_images": "default",
+            },
+        )
+
+
+class ListingCrawlTests(SimpleTestCase):
+    def setUp(self):
+        self.extractor = ImageExtractor()
+        self.in_flight, self.max_in_flight, self.fetched = 0, 0, []
+
+    async def fake_listing(self, page, conditional=False):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.fetched.append(page)
+        await asyncio.sleep(0.01 * (page % 3))
+        self.in_flight -= 1
+        return [{"id": str(page)}] if page <= 5 else []
+
+    async def test_pages_are_fetched_concurrently_and_yielded_in_order(self):
+        with mock.patch.multiple(
+            self.extractor,
+            _get_listing=self.fake_listing,
+            page_concurrency=3,
+            max_page=20,
+        ):
+            pages = [books async for books in self.extractor.get_book_pages()]
+
+        self.assertEqual(pages, [[{"id": str(page)}] for page in range(1, 6)])
+        self.assertEqual(self.max_in_flight, 3)
+        self.assertLessEqual(max(self.fetched), 5 + 3)
+
+    async def test_unreachable_page_is_not_the_end_of_the_listing(self):
+        with mock.patch.multiple(
+            self.extractor, fallback=None, max_page=3
+        ), mock.patch.object(
+            self.extractor.transport, "get", side_effect=TransportError("down")
+        ), self.assertRaises(
+            TransportError
+        ):
+            [books async for books in self.extractor.get_book_pages()]
+
+    async def test_token_bucket_limits_rate(self):
+        bucket = TokenBucket(rate=100, burst=1)
+        started = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.035)
+
+    def test_token_bucket_is_shared_by_threads(self):
+        bucket = TokenBucket(rate=100, burst=1)
+        started = time.monotonic()
+        threads = [
+            threading.Thread(target=async_to_sync(bucket.acquire)) for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # The first token is there already, the other 7 arrive 10 ms apart
+        self.assertGreaterEqual(time.monotonic() - started, 0.065)
+
+
+class FlakyTransport(Transport):
+    """Fail each URL `failures` times with a 503 before serving an image"""
+
+    def __init__(self, failures=0):
+        super().__init__()
+        self.failures = failures
+        self.calls = {}
+        self.in_flight = self.max_in_flight = 0
+
+    async def get(self, url, headers=None):
+        self.calls[url] = self.calls.get(url, 0) + 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.001)
+        self.in_flight -= 1
+        if self.calls[url] <= self.failures:
+            return Response(url=url, status=500)
+        return Response(
+            url=url,
+            status=200,
+            headers={"Content-Type": "image/jpeg"},
+            content=make_image_bytes(color=url.rsplit("/", 1)[-1]),
+        )
+
+
+class DownloadSchedulerTests(BlobStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.extractor = ImageExtractor()
+        patcher = mock.patch.multiple(
+            self.extractor,
+            fallback=None,
+            download_concurrency=2,
+            download_retries=2,
+            download_backoff=0.001,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def use_transport(self, transport):
+        patcher = mock.patch.object(self.extractor, "transport", transport)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_transient_errors_are_retried(self):
+        self.use_transport(transport := FlakyTransport(failures=2))
+        items = [[i, f"https://img/{color}"] for i, color in enumerate(["red", "blue"])]
+
+        results = async_to_sync(self.extractor.get_images_concurrently_with_id)(items)
+
+        self.assertTrue(all(content for _, content in results))
+        self.assertEqual(set(transport.calls.values()), {3})
+        self.assertLessEqual(transport.max_in_flight, 2)
+
+    def test_exhausted_retries_are_not_stored(self):
+        self.use_transport(FlakyTransport(failures=10))
+        book = Book.objects.create(id="1")
+        Episode.objects.create(id=1, book=book)
+        Image.objects.create(id=1, episode_id=1, raw_url="https://img/red")
+
+        saved = async_to_sync(download_and_save)(Image, [[1, "https://img/red"]])
+
+        self.assertEqual(saved, 0)
+        self.assertEqual(Image.objects.get(pk=1).image_hash, "")
+
+    def test_results_are_saved_as_they_complete(self):
+        self.use_transport(FlakyTransport())
+        book = Book.objects.create(id="1")
+        Episode.objects.create(id=1, book=book)
+        colors = ["red", "blue", "green"]
+        for i, color in enumerate(colors):
+            Image.objects.create(id=i, episode_id=1, raw_url=f"https://img/{color}")
+
+        with mock.patch(
+            "apps.tasks.save_downloaded_images", wraps=save_downloaded_images
+        ) as save:
+            async_to_sync(download_and_save)(
+                Image, [[i, f"https://img/{color}"] for i, color in enumerate(colors)]
+            )
+
+        self.assertEqual(save.call_count, 3)
+        self.assertEqual(Episode.objects.get(pk=1).downloaded_image_count, 3)
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "pages": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    }
+)
+class PageCacheTests(SimpleTestCase):
+    async def crawl_twice(self, handler, processed=True):
+        app = web.Application()
+        app.router.add_get("/", handler)
+        extractor = ImageExtractor()
+        async with TestServer(app) as server:
+            url = str(server.make_url("/"))
+            with mock.patch.multiple(
+                extractor, transport=AiohttpTransport(), fallback=None
+            ):
+                first = await extractor._send_request(url, conditional=True)
+                if processed:
+                    await extractor.confirm_page(url)
+                second = await extractor._send_request(url, conditional=True)
+                await extractor.transport.close()
+        return first, second
+
+    async def test_etag_is_revalidated(self):
+        seen = []
+
+        async def handler(request):
+            seen.append(request.headers.get("If-None-Match"))
+            if request.headers.get("If-None-Match") == '"v1"':
+                return web.Response(status=304)
+            return web.Response(text="<p>page</p>", headers={"ETag": '"v1"'})
+
+        first, second = await self.crawl_twice(handler)
+
+        self.assertEqual(first.text_content(), "page")
+        self.assertIs(second, NOT_MODIFIED)
+        self.assertEqual(seen, [None, '"v1"'])
+
+    async def test_identical_body_without_validators(self):
+        async def handler(request):
+            return web.Response(text="<p>page</p>")
+
+        first, second = await self.crawl_twice(handler)
+
+        self.assertEqual(first.text_content(), "page")
+        self.assertIs(second, NOT_MODIFIED)
+
+    async def test_page_is_parsed_again_until_processed(self):
+        seen = []
+
+        async def handler(request):
+            seen.append(request.headers.get("If-None-Match"))
+            return web.Response(text="<p>page</p>", headers={"ETag": '"v1"'})
+
+        # The task failed before confirming the page, its retry must not skip it
+        first, second = await self.crawl_twice(handler, processed=False)
+
+        self.assertEqual(first.text_content(), "page")
+        self.assertEqual(second.text_content(), "page")
+        self.assertEqual(seen, [None, None])
+
+    async def test_uncommitted_pages_are_bounded(self):
+        page_cache = PageCache("pages", max_pending=2)
+        for url in "abc":
+            resp = Response(url=url, status=200, content=url.encode())
+            self.assertTrue(await page_cache.is_modified(url, None, resp))
+
+        self.assertEqual(list(page_cache.pending), ["b", "c"])
+        await page_cache.commit("a")
+        await page_cache.commit("c")
+        self.assertIsNone(await page_cache.get("a"))
+        self.assertIsNotNone(await page_cache.get("c"))
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "pages": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    }
+)
+class BookCrawlTests(TestCase):
+    def test_failed_book_is_crawled_again(self):
+        book = Book.objects.create(id="1", raw_url="https://se8.us/index.php/comic/1")
+        page = Response(
+            book.raw_url, 200, {"ETag": '"v1"'}, (CORPUS_DIR / "book.html").read_bytes()
+        )
+        extractor = ImageExtractor()
+        with mock.patch.object(extractor, "_fetch", return_value=page), mock.patch(
+            "apps.tasks.find_images"
+        ), mock.patch(
+            "apps.tasks.upsert_episodes", side_effect=RuntimeError("database gone")
+        ):
+            with self.assertRaises(RuntimeError):
+                async_to_sync(process_episodes)("1")
+        self.assertFalse(book.episodes.exists())
+
+        with mock.patch.object(extractor, "_fetch", return_value=page), mock.patch(
+            "apps.tasks.find_images"
+        ):
+            async_to_sync(process_episodes)("1")
+            self.assertTrue(book.episodes.exists())
+            # Processed, the page is skipped until it changes
+            with mock.patch("apps.tasks.upsert_episodes") as upsert:
+                async_to_sync(process_episodes)("1")
+            upsert.assert_called_once_with(book, [])
+
+
+class IncrementalCrawlTests(TestCase):
+    def setUp(self):
+        for i in range(2, 7):
+            Book.objects.create(id=str(i), update_marker="ep 1")
+        self.fetched, self.fail_at = [], None
+
+    async def fake_pages(self, target_page=None, conditional=False, start_page=1):
+        for page in range(start_page, 7):
+            if page == self.fail_at:
+                self.fail_at = None
+                raise RuntimeError("worker lost")
+            self.fetched.append(page)
+            yield [
+                {
+                    "id": str(page),
+                    "title": f"book {page}",
+                    "raw_url": "",
+                    "image_url": "",
+                    "current": "ep 2" if page == 1 else "ep 1",
+                }
+            ]
+
+    def crawl(self, mode):
+        with mock.patch.object(
+            ImageExtractor(), "get_book_pages", self.fake_pages
+        ), mock.patch("apps.tasks.find_episodes") as find_episodes:
+            async_to_sync(process_books)(mode)
+        return CrawlState.objects.get(name="books"), find_episodes
+
+    @override_settings(CRAWLER_INCREMENTAL_STOP_PAGES=3)
+    def test_incremental_crawl_stops_at_known_content(self):
+        state, find_episodes = self.crawl(CrawlState.MODE_INCREMENTAL)
+
+        self.assertEqual(self.fetched, [1, 2, 3, 4])
+        self.assertEqual((state.last_page, state.changed_books), (4, 1))
+        self.assertIsNotNone(state.finished_at)
+        self.assertEqual(Book.objects.get(pk="1").update_marker, "ep 2")
+        find_episodes.apply_async.assert_any_call(
+            args=["1"], kwargs={"from_frontier": True}, countdown=5
+        )
+
+    def test_full_crawl_walks_every_page(self):
+        state, _ = self.crawl(CrawlState.MODE_FULL)
+
+        self.assertEqual(self.fetched, [1, 2, 3, 4, 5, 6])
+        self.assertEqual(state.last_page, 6)
+
+    @override_settings(CRAWLER_INCREMENTAL_STOP_PAGES=10)
+    def test_interrupted_incremental_crawl_starts_over(self):
+        self.fail_at = 3
+        with self.assertRaises(RuntimeError):
+            self.crawl(CrawlState.MODE_INCREMENTAL)
+        state, _ = self.crawl(CrawlState.MODE_INCREMENTAL)
+
+        self.assertEqual(self.fetched, [1, 2, 1, 2, 3, 4, 5, 6])
+        self.assertEqual(state.last_page, 6)
+
+    def test_interrupted_crawl_resumes_after_checkpoint(self):
+        self.fail_at = 4
+        with self.assertRaises(RuntimeError):
+            self.crawl(CrawlState.MODE_FULL)
+        state, find_episodes = self.crawl(CrawlState.MODE_FULL)
+
+        self.assertEqual(self.fetched, [1, 2, 3, 4, 5, 6])
+        self.assertEqual(state.last_page, 6)
+        self.assertIsNotNone(state.finished_at)
+        self.assertEqual(
+            [c.kwargs["args"] for c in find_episodes.apply_async.call_args_list],
+            [["4"], ["5"], ["6"]],
+        )
+        self.assertEqual(
+            FrontierEntry.objects.get(kind=FrontierEntry.KIND_BOOK, key="1").status,
+            FrontierEntry.STATUS_PENDING,
+        )
+
+    @override_settings(CRAWLER_INCREMENTAL_STOP_PAGES=10)
+    def test_incremental_crawl_keeps_the_full_crawl_checkpoint(self):
+        self.fail_at = 4
+        with self.assertRaises(RuntimeError):
+            self.crawl(CrawlState.MODE_FULL)
+        state, _ = self.crawl(CrawlState.MODE_INCREMENTAL)
+        self.assertEqual((state.mode, state.last_page), (CrawlState.MODE_FULL, 3))
+        self.assertIsNone(state.finished_at)
+        state, _ = self.crawl(CrawlState.MODE_FULL)
+
+        self.assertEqual(self.fetched, [1, 2, 3, 1, 2, 3, 4, 5, 6, 4, 5, 6])
+        self.assertIsNotNone(state.finished_at)
+
+
+class FrontierTests(TestCase):
+    BOOK = FrontierEntry.KIND_BOOK
+
+    def test_lease_is_exclusive_until_it_expires(self):
+        frontier.enqueue(self.BOOK, [["1", "https://se8.us/index.php/comic/1"]])
+
+        self.assertTrue(frontier.acquire(self.BOOK, "1"))
+        self.assertFalse(frontier.acquire(self.BOOK, "1"))
+        FrontierEntry.objects.update(leased_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(
+            list(frontier.stale_entries().values_list("key", flat=True)), ["1"]
+        )
+        self.assertTrue(frontier.acquire(self.BOOK, "1"))
+        frontier.finish(self.BOOK, "1")
+        # A copy still in the queue leaves the finished entry alone, a new request does not
+        self.assertFalse(frontier.acquire(self.BOOK, "1", reopen=False))
+        self.assertTrue(frontier.acquire(self.BOOK, "1"))
+
+    def test_lease_outcome(self):
+        with frontier.lease(self.BOOK, "1") as leased:
+            self.assertTrue(leased)
+        with self.assertRaises(ValueError), frontier.lease(self.BOOK, "2"):
+            raise ValueError
+
+        statuses = dict(FrontierEntry.objects.values_list("key", "status"))
+        self.assertEqual(
+            statuses,
+            {"1": FrontierEntry.STATUS_DONE, "2": FrontierEntry.STATUS_PENDING},
+        )
+
+    def test_lost_tasks_are_dispatched_again(self):
+        frontier.enqueue(self.BOOK, [["1", ""], ["2", ""]])
+        FrontierEntry.objects.filter(key="1").update(
+            updated_at=timezone.now() - timedelta(days=1)
+        )
+
+        with mock.patch("apps.tasks.find_episodes") as find_episodes:
+            resume_frontier()
+            resume_frontier()
+
+        find_episodes.apply_async.assert_called_once_with(
+            args=["1"], kwargs={"from_frontier": True}
+        )
+
+    def test_finished_entries_are_pruned(self):
+        frontier.enqueue(self.BOOK, [["1", ""], ["2", ""]])
+        frontier.finish(self.BOOK, "1")
+        frontier.finish(self.BOOK, "2")
+        frontier.checkpoint_page(1)
+        FrontierEntry.objects.exclude(key="2").update(
+            updated_at=timezone.now() - timedelta(days=2)
+        )
+
+        resume_frontier()
+
+        self.assertEqual(
+            list(FrontierEntry.objects.values_list("kind", "key").order_by("key")),
+            [(FrontierEntry.KIND_LISTING, "1"), (self.BOOK, "2")],
+        )
+
+    @override_settings(
+        CRAWLER_FRONTIER={"lease": 60, "max_attempts": 3, "retention": 60}
+    )
+    def test_queued_tasks_are_dispatched_a_bounded_number_of_times(self):
+        frontier.enqueue(self.BOOK, [["1", ""]])
+
+        with mock.patch("apps.tasks.find_episodes") as find_episodes:
+            for _ in range(10):
+                # The task never reaches a worker, one lease passes between sweeps
+                FrontierEntry.objects.update(
+                    updated_at=timezone.now() - timedelta(minutes=2)
+                )
+                resume_frontier()
+
+        self.assertEqual(find_episodes.apply_async.call_count, 3)
+        self.assertEqual(FrontierEntry.objects.get().attempts, 3)
+
+    def test_command_reports_and_resets(self):
+        frontier.enqueue(self.BOOK, [["1", ""]])
+        frontier.checkpoint_page(1)
+        out = StringIO()
+
+        call_command("crawl_frontier", stdout=out)
+        self.assertIn("listing  done     1", out.getvalue())
+        call_command("crawl_frontier", reset=True, kind="listing", stdout=out)
+        self.assertEqual(frontier.resume_page(), 1)
+        self.assertEqual(FrontierEntry.objects.count(), 1)
+
+
+class StreamingDownloadTests(BlobStoreTestCase):
+    async def download(self, path, max_bytes=1024 * 1024):
+        image = make_image_bytes(size=(64, 64))
+
+        async def handler(request):
+            if request.path == "/page":
+                return web.Response(text="<html></html>", content_type="text/html")
+            response = web.StreamResponse(headers={"Content-Type": "image/jpeg"})
+            await response.prepare(request)
+            for _ in range(1 if request.path == "/image" else 100):
+                await response.write(image)
+            return response
+
+        app = web.Application()
+        app.router.add_get("/{name}", handler)
+        extractor = ImageExtractor()
+        async with TestServer(app) as server:
+            with mock.patch.multiple(
+                extractor,
+                transport=AiohttpTransport(),
+                fallback=None,
+                download_max_bytes=max_bytes,
+            ):
+                blob = await extractor.download_image_to_store(
+                    str(server.make_url(path))
+                )
+                await extractor.transport.close()
+        return image, blob
+
+    async def test_image_is_streamed_into_the_store(self):
+        image, blob = await self.download("/image")
+
+        self.assertEqual(blob.digest, hash_content(image))
+        self.assertEqual((blob.size, blob.mime), (len(image), "image/jpeg"))
+        self.assertEqual(get_blob_store().read(blob.digest), image)
+
+    async def test_oversized_image_is_rejected(self):
+        _, blob = await self.download("/huge", max_bytes=10 * 1024)
+
+        self.assertIsNone(blob)
+        self.assertEqual(list((get_blob_store().location / ".incoming").iterdir()), [])
+
+    async def test_non_image_is_rejected(self):
+        _, blob = await self.download("/page")
+        self.assertIsNone(blob)
+
+
+class ReplayPipelineTests(TransactionTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        settings_override = override_settings(
+            MEDIA_ROOT=self.tmp_dir.name,
+            BLOB_STORE={
+                "BACKEND": "apps.storage.FileSystemBlobStore",
+                "OPTIONS": {"location": f"{self.tmp_dir.name}/blobs"},
+            },
+            CACHES={
+                "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+                "pages": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            },
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_pipeline_against_replay_site(self):
+        site = ReplaySite(
+            pages=2,
+            books_per_page=3,
+            episodes=2,
+            images=3,
+            image_size=(600, 40),
+            image_error_rate=0.1,
+            seed=1,
+        )
+        with mock.patch.object(ImageExtractor(), "download_backoff", 0), serve(
+            site
+        ) as site:
+            stages = {stage.name: stage for stage in run_pipeline(site.origin)}
+
+        self.assertEqual(
+            {name: stage.count for name, stage in stages.items()},
+            {"listing": 2, "books": 6, "chapters": 12, "images": 36, "pdf": 12},
+        )
+        self.assertEqual(Book.objects.filter(hot__gt=0).count(), 6)
+        self.assertEqual(Image.objects.filter(image_hash="").count(), 0)
+        self.assertEqual(Episode.objects.exclude(pdf="").count(), 12)
+        self.assertGreater(site.served["image"], 36)
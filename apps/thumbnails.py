@@ -0,0 +1,120 @@
+import os
+import tempfile
+from functools import lru_cache
+from io import BytesIO
+from logging import getLogger
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from apps.storage import get_blob_store
+from apps.tools import pillow
+
+logger = getLogger(__name__)
+
+THUMBNAIL_MIME = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+# Thumbnails are written next to their final path under this prefix, then renamed
+TMP_PREFIX = ".tmp-"
+
+
+class ThumbnailCache:
+    """Small derivatives of blob store images, generated once and kept on disk"""
+
+    def __init__(
+        self,
+        location: str | Path,
+        size: int = 200,
+        format: str = "WEBP",
+        quality: int = 75,
+        max_bytes: int = 512 * 1024 * 1024,
+    ):
+        self.location = Path(location)
+        self.size = size
+        self.format = format.upper()
+        self.quality = quality
+        self.max_bytes = max_bytes
+
+    @property
+    def mime(self) -> str:
+        return THUMBNAIL_MIME[self.format]
+
+    def path(self, digest: str) -> Path:
+        return self.location / digest[:2] / f"{digest}.{self.format.lower()}"
+
+    def render(self, content: bytes) -> bytes:
+        img = pillow().open(BytesIO(content))
+        # Let the JPEG decoder scale down while decoding instead of afterwards
+        img.draft("RGB", (self.size, self.size))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((self.size, self.size))
+        buffer = BytesIO()
+        img.save(buffer, format=self.format, quality=self.quality)
+        return buffer.getvalue()
+
+    def get(self, digest: str) -> Path | None:
+        """Return the thumbnail file of a blob, rendering it on first use"""
+        path = self.path(digest)
+        if path.is_file():
+            # The mtime doubles as the last access time for eviction
+            os.utime(path)
+            return path
+
+        store = get_blob_store()
+        if not store.exists(digest):
+            return None
+        try:
+            thumbnail = self.render(store.read(digest))
+        except Exception as e:
+            logger.error(f"Error rendering thumbnail {digest}: {str(e)}")
+            return None
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=TMP_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(thumbnail)
+            os.replace(tmp_path, path)
+        finally:
+            # Only left behind when writing or renaming failed
+            Path(tmp_path).unlink(missing_ok=True)
+        return path
+
+    def evict(self) -> int:
+        """Drop the least recently used thumbnails until the cache fits max_bytes"""
+        entries = []
+        for path in self.location.glob("*/*"):
+            if path.name.startswith(TMP_PREFIX):
+                # Being written by another request, not a thumbnail yet
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        if removed:
+            logger.info(f"Evicted {removed} thumbnails")
+        return removed
+
+
+@lru_cache(maxsize=None)
+def get_thumbnail_cache() -> ThumbnailCache:
+    """Build the thumbnail cache configured by settings.THUMBNAILS"""
+    return ThumbnailCache(**settings.THUMBNAILS)
+
+
+@receiver(setting_changed)
+def reset_thumbnail_cache(setting, **kwargs):
+    if setting == "THUMBNAILS":
+        get_thumbnail_cache.cache_clear()
@@ -0,0 +1,230 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from email.parser import BytesHeaderParser
+from logging import getLogger
+from typing import TYPE_CHECKING, Mapping
+
+from django.utils.module_loading import import_string
+
+# aiohttp is imported by the transports that use it, web processes only queue tasks
+if TYPE_CHECKING:
+    import aiohttp
+
+logger = getLogger(__name__)
+
+
+class TransportError(Exception):
+    """The request could not be completed"""
+
+
+@dataclass
+class Response:
+    url: str
+    status: int
+    headers: Mapping[str, str] = field(default_factory=dict)
+    content: bytes = b""
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    async def iter_chunks(self, chunk_size: int = 64 * 1024):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start : start + chunk_size]
+
+
+class StreamingResponse(Response):
+    """Response whose body has not been read yet"""
+
+    def __init__(self, resp: "aiohttp.ClientResponse"):
+        super().__init__(url=str(resp.url), status=resp.status, headers=resp.headers)
+        self._resp = resp
+
+    async def iter_chunks(self, chunk_size: int = 64 * 1024):
+        import aiohttp
+
+        try:
+            async for chunk in self._resp.content.iter_chunked(chunk_size):
+                yield chunk
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise TransportError(f"GET {self.url} failed: {e!r}") from e
+
+
+class TokenBucket:
+    """
+    Allow `rate` acquisitions per second on average, with bursts up to `burst`
+    One bucket is shared by the threads and loops of a worker, the lock is only held
+    to take a token, never while waiting for one
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """Take a token, or return how long to wait for the next one"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while delay := self._take():
+            await asyncio.sleep(delay)
+
+
+class Transport:
+    """Interface of the HTTP client used by the crawler"""
+
+    def __init__(self, headers: Mapping[str, str] = None):
+        self.headers = dict(headers or {})
+
+    async def get(self, url: str, headers: Mapping[str, str] = None) -> Response:
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def stream(self, url: str, headers: Mapping[str, str] = None):
+        """GET whose body is read with iter_chunks(), buffered unless overridden"""
+        yield await self.get(url, headers=headers)
+
+    async def close(self) -> None:
+        pass
+
+
+class AiohttpTransport(Transport):
+    """
+    Connection-pooled client with keep-alive and a DNS cache, one pool per event loop
+    so that worker threads running their own loops never share a session
+    """
+
+    def __init__(
+        self,
+        headers: Mapping[str, str] = None,
+        limit: int = 64,
+        limit_per_host: int = 8,
+        dns_cache_ttl: int = 300,
+        keepalive_timeout: float = 30,
+        connect_timeout: float = 10,
+        read_timeout: float = 60,
+    ):
+        import aiohttp
+
+        super().__init__(headers)
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(
+            connect=connect_timeout, sock_read=read_timeout
+        )
+        self._sessions = {}
+
+    def session(self) -> "aiohttp.ClientSession":
+        import aiohttp
+
+        # A session is bound to the loop it was created on
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            for closed in [other for other in self._sessions if other.is_closed()]:
+                del self._sessions[closed]
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            session = self._sessions[loop] = aiohttp.ClientSession(
+                connector=connector, headers=self.headers, timeout=self.timeout
+            )
+        return session
+
+    async def get(self, url: str, headers: Mapping[str, str] = None) -> Response:
+        import aiohttp
+
+        try:
+            async with self.session().get(url, headers=headers) as resp:
+                return Response(
+                    url=str(resp.url),
+                    status=resp.status,
+                    headers=resp.headers,
+                    content=await resp.read(),
+                )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise TransportError(f"GET {url} failed: {e!r}") from e
+
+    @asynccontextmanager
+    async def stream(self, url: str, headers: Mapping[str, str] = None):
+        import aiohttp
+
+        try:
+            resp = await self.session().get(url, headers=headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise TransportError(f"GET {url} failed: {e!r}") from e
+        try:
+            yield StreamingResponse(resp)
+        finally:
+            resp.release()
+
+    async def close(self) -> None:
+        """Close the session of the running loop"""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None and not session.closed:
+            await session.close()
+
+
+class CurlTransport(Transport):
+    """Fallback that shells out to curl for hosts that reject the pooled client"""
+
+    def __init__(self, headers: Mapping[str, str] = None, timeout: float = 60):
+        super().__init__(headers)
+        self.timeout = timeout
+
+    async def get(self, url: str, headers: Mapping[str, str] = None) -> Response:
+        args = ["curl", "-sS", "-L", "--compressed", "-D", "-"]
+        args += ["--max-time", str(self.timeout)]
+        for key, value in {**self.headers, **(headers or {})}.items():
+            args += ["-H", f"{key}: {value}"]
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            url,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await proc.communicate()
+        if proc.returncode:
+            raise TransportError(f"curl {url} failed: {stderr.decode().strip()}")
+
+        # -D - prints one header block per response when following redirects
+        status, head = 0, b""
+        while stdout.startswith(b"HTTP/"):
+            head, _, stdout = stdout.partition(b"\r\n\r\n")
+            status = int(head.split(b" ", 2)[1])
+        headers = BytesHeaderParser().parsebytes(head.partition(b"\r\n")[2])
+        return Response(url=url, status=status, headers=headers, content=stdout)
+
+
+def build_transport(config: dict, headers: Mapping[str, str] = None) -> Transport:
+    """Build a transport from a {"BACKEND": ..., "OPTIONS": ...} setting"""
+    return import_string(config["BACKEND"])(
+        headers=headers, **config.get("OPTIONS", {})
+    )
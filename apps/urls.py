@@ -1,10 +1,20 @@
-from django.urls import path
+from django.urls import path, re_path
 
-from apps.views import TriggerFindBooksView, read_episode_view, serve_pdf
+from apps.views import (
+    TriggerFindBooksView,
+    read_episode_view,
+    serve_pdf,
+    serve_thumbnail,
+)
 
 urlpatterns = [
     path("episode/<int:episode_id>/pdf/", serve_pdf, name="serve_pdf"),
     path("episode/<int:episode_id>/", read_episode_view, name="read_episode_view"),
+    re_path(
+        r"^thumbnail/(?P<digest>[0-9a-f]{64})/$",
+        serve_thumbnail,
+        name="serve_thumbnail",
+    ),
     path(
         "trigger-find-books/", TriggerFindBooksView.as_view(), name="trigger_find_books"
     ),
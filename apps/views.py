@@ -1,15 +1,16 @@
-import asyncio
 import logging
 
-from asgiref.sync import sync_to_async
-from django.http import HttpResponse, JsonResponse
+from django.db import transaction
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, render
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_safe
 
 from apps.models import Episode
-from apps.tasks import find_books
+from apps.tasks import find_books, request_episode_pdf
+from apps.thumbnails import get_thumbnail_cache
 
 logger = logging.getLogger(__name__)
 
@@ -21,13 +22,23 @@ class TriggerFindBooksView(View):
         return JsonResponse({"status": "success"})
 
 
+@transaction.non_atomic_requests
 def serve_pdf(request, episode_id):
+    episode = get_object_or_404(Episode, pk=episode_id)
     try:
-        episode = get_object_or_404(Episode, pk=episode_id)
-        buffer = asyncio.run(episode.convert_to_pdf(read=True))
-        response = HttpResponse(buffer, content_type="application/pdf")
-        response["Content-Disposition"] = f'attachment; filename="{episode.title}.pdf"'
-        return response
+        if not episode.pdf:
+            # Rendering happens on the workers, ahead of the nightly backlog,
+            # while the client polls
+            request_episode_pdf(episode)
+            response = HttpResponse("The PDF is being prepared", status=202)
+            response["Retry-After"] = "5"
+            return response
+        return FileResponse(
+            episode.pdf.open("rb"),
+            content_type="application/pdf",
+            as_attachment=True,
+            filename=f"{episode.title}.pdf",
+        )
 
     except Exception as e:
         logger.error(f"Error generating PDF for episode {episode_id}: {str(e)}")
@@ -37,6 +48,9 @@ def serve_pdf(request, episode_id):
 def read_episode_view(request, episode_id):
     episode = get_object_or_404(Episode, id=episode_id)
     book = episode.book
+    if not episode.pdf:
+        # Start early, the page requests the PDF right after loading
+        request_episode_pdf(episode)
 
     previous_episode = (
         Episode.objects.filter(book=book, id__lt=episode_id).order_by("-id").first()
@@ -52,3 +66,19 @@ def read_episode_view(request, episode_id):
         "next_episode": next_episode,
     }
     return render(request, "admin/read_episode.html", context)
+
+
+@require_safe
+def serve_thumbnail(request, digest):
+    # Thumbnails are addressed by the content hash, so they never change
+    if request.headers.get("If-None-Match") == f'"{digest}"':
+        response = HttpResponse(status=304)
+    elif not (path := get_thumbnail_cache().get(digest)):
+        raise Http404("Image not found")
+    else:
+        response = FileResponse(
+            path.open("rb"), content_type=get_thumbnail_cache().mime
+        )
+    response["ETag"] = f'"{digest}"'
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
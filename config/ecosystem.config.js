@@ -8,8 +8,21 @@ module.exports = {
       autorestart: true
     },
     {
-      name: "celery-worker",
-      script: "sleep 20 && celery -A SE8 worker -l INFO -E --logfile /opt/server/vol/logs/celery-worker.log",
+      // Listing, book and chapter pages, plus the default queue of light sweeps
+      name: "celery-discovery",
+      script: "sleep 20 && celery -A SE8 worker -n discovery@%h -Q discovery,default -P threads -c 4 --prefetch-multiplier 1 -O fair -l INFO -E --logfile /opt/server/vol/logs/celery-discovery.log",
+      autorestart: true
+    },
+    {
+      // Image downloads wait on the network, threads keep many in flight cheaply
+      name: "celery-download",
+      script: "sleep 20 && celery -A SE8 worker -n download@%h -Q download -P threads -c 8 --prefetch-multiplier 1 -l INFO -E --logfile /opt/server/vol/logs/celery-download.log",
+      autorestart: true
+    },
+    {
+      // PDF rendering is CPU bound, one process per core and no prefetching
+      name: "celery-render",
+      script: "sleep 20 && celery -A SE8 worker -n render@%h -Q render -P prefork -c 2 --prefetch-multiplier 1 -O fair --max-tasks-per-child 50 -l INFO -E --logfile /opt/server/vol/logs/celery-render.log",
       autorestart: true
     },
     {